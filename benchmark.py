@@ -0,0 +1,295 @@
+"""
+mm 离线基准测试。
+
+在本机启动 OpenAI 兼容的模拟服务(见 mockserver.py)，通过真实的 mm 命令行和 OpenAIModel
+回放问题集，报告：
+  * 冷启动/热启动时间 (mm --help，以及环境缓存为空/已生成时的完整一次请求)
+  * 端到端延迟的 p50/p95/p99 以及各阶段耗时 (通过 TRACE_FILE 收集)
+  * 注入失败命令后的平均重试次数
+  * 批量模式在不同并发下的吞吐量
+  * OpenAIModel.chat() 在模拟服务之上的额外开销
+不访问网络、不产生费用，结果可复现，可用于发现热路径上的性能退化。
+
+用法: python benchmark.py [--corpus requests.jsonl] [--limit 20] [--latency-ms 50]
+                          [--tokens-per-sec 200] [--error-rate 0] [--fail-rate 0.3] [--json]
+问题集的格式同批量模式 (纯文本或带 prompt/query/title 字段的 JSONL)。
+"""
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import mmbatch
+from mockserver import MockConfig, start_mock_server
+from tracing import percentile, summarize
+
+MM_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mm.py")
+
+# 未指定问题集时使用的示例问题
+SAMPLE_PROMPTS = [
+    "列出当前目录下的所有文件",
+    "查找最近修改的10个文件",
+    "统计当前目录下python文件的行数",
+    "显示磁盘使用情况",
+    "find all files larger than 100MB",
+    "show the 5 processes using the most memory",
+    "count lines in all markdown files",
+    "compress the logs directory into a tar.gz",
+]
+
+
+# mm 还会加载程序目录下用户的 .env (不覆盖已有的环境变量)。影响请求路径的配置都在这里固定，
+# 否则用户的备用端点会让请求发到真实的付费服务，限流、追踪、流式输出等配置也会让结果因人而异
+BENCH_ENV = {
+    "OPENAI_API_KEY": "sk-benchmark",
+    "MODEL_NAME": "mock",
+    "MODEL_TEMPERATURE": "0.7",
+    "MODEL_MAX_TOKENS": "2048",
+    "FALLBACK_ENDPOINTS": "",
+    "RATE_LIMIT_RPM": "0",
+    "RATE_LIMIT_TPM": "0",
+    "RATE_LIMIT_RETRIES": "5",
+    "TRACE_FILE": "",
+    "DAEMON": "0",
+    "PREWARM": "1",
+    "STREAM": "0",
+    "VALIDATE": "1",
+    "VALIDATE_RETRIES": "1",
+    "RETRY_CANDIDATES": "1",
+    "ERROR_CONTEXT_TOKENS": "1500",
+    "HISTORY": "1",
+    "RESPONSE_CACHE": "1",
+    "ENV_CACHE": "1",
+    "TOOL_INDEX": "1",
+    "COMMAND_TIMEOUT": "30",
+    # 示例问题中有几条能被本地意图模板匹配，关闭后每条都会请求模型；意图模板单独测量
+    "INTENTS": "0",
+    "SAFETY": "1",
+    "MODIFY": "0",
+    "PYTHONIOENCODING": "utf-8",
+}
+
+
+def load_prompts(path, limit):
+    if path:
+        with open(path, encoding="utf-8") as f:
+            prompts = [item["prompt"] for item in mmbatch.read_batch_items(f) if item["prompt"]]
+    else:
+        prompts = list(SAMPLE_PROMPTS)
+    return prompts[:limit] if limit else prompts
+
+
+def distribution(values):
+    if not values:
+        return {"count": 0}
+    return {"count": len(values), "p50": percentile(values, 0.5), "p95": percentile(values, 0.95),
+            "p99": percentile(values, 0.99), "max": max(values)}
+
+
+class Bench:
+    """
+    以子进程运行 mm，所有状态(缓存、历史、环境指纹)都放在临时目录中，不影响用户数据。
+    """
+    def __init__(self, base_url, workdir):
+        self.workdir = workdir
+        self.cache_dir = os.path.join(workdir, "cache")
+        self.trace_file = os.path.join(workdir, "trace.jsonl")
+        self.env = dict(os.environ, **BENCH_ENV)
+        self.env.update({
+            "OPENAI_API_BASE": base_url,
+            "MM_CACHE_DIR": self.cache_dir,
+            # 不使用用户自定义的意图
+            "INTENTS_FILE": os.path.join(workdir, "intents.json"),
+        })
+
+    def run(self, args, stdin="n\n", extra_env=None, trace=False):
+        env = dict(self.env, **(extra_env or {}))
+        if trace:
+            env["TRACE_FILE"] = self.trace_file
+        start = time.perf_counter()
+        result = subprocess.run([sys.executable, MM_PATH] + args, input=stdin, capture_output=True,
+                                text=True, encoding="utf-8", env=env, cwd=self.workdir)
+        elapsed = (time.perf_counter() - start) * 1000
+        return elapsed, result
+
+    def reset_cache(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def reset_trace(self):
+        if os.path.exists(self.trace_file):
+            os.remove(self.trace_file)
+
+    def read_traces(self):
+        if not os.path.exists(self.trace_file):
+            return []
+        with open(self.trace_file, encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+
+def bench_startup(bench, runs):
+    bench.reset_cache()
+    help_times = [bench.run(["--help"], stdin="")[0] for _ in range(runs)]
+    # 首次请求需要探测环境并建立工具索引，之后直接使用环境指纹
+    bench.reset_cache()
+    cold, _ = bench.run(["--no-cache", "--no-history", "列出文件"])
+    warm = [bench.run(["--no-cache", "--no-history", "列出文件"])[0] for _ in range(runs)]
+    # 命中本地意图模板时不请求模型
+    intent = [bench.run(["--no-cache", "--no-history", "列出文件"], extra_env={"INTENTS": "1"})[0]
+              for _ in range(runs)]
+    return {"help_ms": distribution(help_times), "first_request_cold_ms": cold,
+            "first_request_warm_ms": distribution(warm), "intent_hit_ms": distribution(intent)}
+
+
+def bench_latency(bench, prompts, server):
+    bench.reset_trace()
+    server.reset_stats()
+    times, failures = [], 0
+    for prompt in prompts:
+        elapsed, result = bench.run(["--no-cache", "--no-history", prompt], trace=True)
+        times.append(elapsed)
+        if result.returncode != 0:
+            failures += 1
+    phases = {}
+    if os.path.exists(bench.trace_file):
+        phases = {name: {k: round(v, 1) for k, v in s.items()} for name, s in summarize([bench.trace_file]).items()}
+    return {"e2e_ms": distribution(times), "failures": failures, "phases": phases, "server": server.snapshot()}
+
+
+def bench_retries(bench, prompts, server):
+    bench.reset_trace()
+    server.reset_stats()
+    for prompt in prompts:
+        # 确认执行，失败后确认执行重新生成的命令
+        bench.run(["--no-cache", "--no-history", prompt], stdin="y\ny\ny\n", trace=True)
+    attempts = [sum(1 for s in record["spans"] if s["name"] == "execute") for record in bench.read_traces()]
+    retries = [max(0, a - 1) for a in attempts]
+    return {"runs": len(attempts), "avg_retries": sum(retries) / len(retries) if retries else 0.0,
+            "max_retries": max(retries) if retries else 0, "server": server.snapshot()}
+
+
+def bench_batch(bench, prompts, concurrencies, server):
+    corpus = os.path.join(bench.workdir, "batch.jsonl")
+    with open(corpus, "w", encoding="utf-8") as f:
+        for i, prompt in enumerate(prompts):
+            f.write(json.dumps({"id": i, "prompt": prompt}, ensure_ascii=False) + "\n")
+    results = {}
+    for concurrency in concurrencies:
+        server.reset_stats()
+        elapsed, result = bench.run(["--no-cache", "--concurrency", str(concurrency), "--batch", corpus], stdin="")
+        lines = [line for line in result.stdout.splitlines() if line.strip()]
+        results[str(concurrency)] = {"items": len(lines), "elapsed_ms": round(elapsed, 1),
+                                     "items_per_sec": round(len(lines) / (elapsed / 1000), 2) if elapsed else 0.0,
+                                     "errors": sum(1 for line in lines if '"error"' in line)}
+    return results
+
+
+def bench_client(base_url, prompts, latency_ms):
+    """
+    在进程内直接调用 OpenAIModel.chat()，测量客户端在模拟延迟之外的额外开销
+    """
+    from opensdkmodel import OpenAIModel
+    overrides = dict(BENCH_ENV, OPENAI_API_BASE=base_url)
+    saved = {k: os.environ.get(k) for k in overrides}
+    os.environ.update(overrides)
+    try:
+        model = OpenAIModel()
+        start = time.perf_counter()
+        model.chat([{"role": "user", "content": "warmup"}])
+        first = (time.perf_counter() - start) * 1000
+        overheads = []
+        for prompt in prompts:
+            start = time.perf_counter()
+            model.chat([{"role": "user", "content": prompt}])
+            overheads.append((time.perf_counter() - start) * 1000 - latency_ms)
+        return {"first_call_ms": first, "overhead_ms": distribution(overheads)}
+    finally:
+        for key, value in saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+def format_distribution(d):
+    if not d.get("count"):
+        return "无数据"
+    return f"p50 {d['p50']:.1f} ms, p95 {d['p95']:.1f} ms, p99 {d['p99']:.1f} ms, max {d['max']:.1f} ms (n={d['count']})"
+
+
+def print_report(report):
+    startup = report["startup"]
+    print("== 启动时间 ==")
+    print("mm --help:            " + format_distribution(startup["help_ms"]))
+    print(f"首次请求(冷):         {startup['first_request_cold_ms']:.1f} ms")
+    print("首次请求(热):         " + format_distribution(startup["first_request_warm_ms"]))
+    print("意图模板命中:         " + format_distribution(startup["intent_hit_ms"]))
+    latency = report["latency"]
+    print("\n== 端到端延迟 ==")
+    print("mm <问题>:            " + format_distribution(latency["e2e_ms"]))
+    print(f"失败的运行: {latency['failures']}，服务端统计: {latency['server']}")
+    for name, s in sorted(latency["phases"].items(), key=lambda item: -item[1]["p50"]):
+        print(f"  {name:<16} p50 {s['p50']:8.1f} ms  p95 {s['p95']:8.1f} ms")
+    retries = report["retries"]
+    print("\n== 失败重试 ==")
+    print(f"运行 {retries['runs']} 次，平均重试 {retries['avg_retries']:.2f} 次，最多 {retries['max_retries']} 次，"
+          f"服务端统计: {retries['server']}")
+    print("\n== 批量模式吞吐量 ==")
+    for concurrency, s in report["batch"].items():
+        print(f"并发 {concurrency:>3}: {s['items']} 条 {s['elapsed_ms']:.0f} ms，{s['items_per_sec']:.2f} 条/秒，失败 {s['errors']} 条")
+    client = report["client"]
+    print("\n== OpenAIModel.chat() ==")
+    print(f"首次调用: {client['first_call_ms']:.1f} ms；模拟延迟之外的开销: " + format_distribution(client["overhead_ms"]))
+
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description="mm 离线基准测试")
+    parser.add_argument("--corpus", help="问题集文件 (纯文本或JSONL)，默认使用内置示例")
+    parser.add_argument("--limit", type=int, default=20, help="最多使用的问题数，0 表示全部")
+    parser.add_argument("--runs", type=int, default=5, help="启动时间的测量次数")
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--tokens-per-sec", type=float, default=200)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="注入错误(默认429)的请求比例")
+    parser.add_argument("--error-status", type=int, default=429)
+    parser.add_argument("--fail-rate", type=float, default=0.3, help="重试测试中回复失败命令的比例")
+    parser.add_argument("--concurrency", default="1,8", help="批量模式测试的并发数，逗号分隔")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="以JSON输出结果")
+    args = parser.parse_args(argv)
+
+    prompts = load_prompts(args.corpus, args.limit)
+    if not prompts:
+        print("问题集为空。", file=sys.stderr)
+        return 1
+    config = MockConfig(latency_ms=args.latency_ms, tokens_per_sec=args.tokens_per_sec,
+                        error_rate=args.error_rate, error_status=args.error_status, retry_after=0,
+                        seed=args.seed)
+    server = start_mock_server(config)
+    workdir = tempfile.mkdtemp(prefix="mm-benchmark-")
+    try:
+        bench = Bench(server.base_url, workdir)
+        report = {"config": {"prompts": len(prompts), "latency_ms": args.latency_ms,
+                             "tokens_per_sec": args.tokens_per_sec, "error_rate": args.error_rate}}
+        report["startup"] = bench_startup(bench, args.runs)
+        report["latency"] = bench_latency(bench, prompts, server)
+        config.fail_rate = args.fail_rate
+        report["retries"] = bench_retries(bench, prompts, server)
+        config.fail_rate = 0.0
+        report["batch"] = bench_batch(bench, prompts, [int(c) for c in args.concurrency.split(",") if c], server)
+        report["client"] = bench_client(server.base_url, prompts, args.latency_ms)
+    finally:
+        server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print_report(report)
+    return 1 if report["latency"]["failures"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,27 @@
+import os
+import platform
+
+
+def get_cache_dir():
+    """
+    获取mm的用户缓存目录，不存在时自动创建。
+    Windows: %LOCALAPPDATA%\\mm\\Cache
+    macOS:   ~/Library/Caches/mm
+    其他:    $XDG_CACHE_HOME/mm 或 ~/.cache/mm
+    可通过环境变量 MM_CACHE_DIR 覆盖。
+    返回:
+        缓存目录的绝对路径
+    """
+    cache_dir = os.getenv("MM_CACHE_DIR")
+    if not cache_dir:
+        os_name = platform.system()
+        if os_name == "Windows":
+            base = os.getenv("LOCALAPPDATA") or os.path.expanduser("~")
+            cache_dir = os.path.join(base, "mm", "Cache")
+        elif os_name == "Darwin":
+            cache_dir = os.path.join(os.path.expanduser("~"), "Library", "Caches", "mm")
+        else:
+            base = os.getenv("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+            cache_dir = os.path.join(base, "mm")
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
@@ -0,0 +1,266 @@
+import os
+import re
+import shlex
+import shutil
+import subprocess
+
+# 不对应PATH中可执行文件的shell关键字和内建命令
+POSIX_BUILTINS = {
+    "!", ".", ":", "[", "[[", "]]", "{", "}", "alias", "bg", "bind", "break", "builtin", "case", "cd",
+    "command", "compgen", "complete", "continue", "declare", "dirs", "disown", "do", "done", "echo",
+    "elif", "else", "enable", "esac", "eval", "exec", "exit", "export", "false", "fc", "fg", "fi", "for",
+    "function", "getopts", "hash", "help", "history", "if", "in", "jobs", "kill", "let", "local",
+    "logout", "popd", "printf", "pushd", "pwd", "read", "readonly", "return", "select", "set", "shift",
+    "shopt", "source", "suspend", "test", "then", "time", "times", "trap", "true", "type", "typeset",
+    "ulimit", "umask", "unalias", "unset", "until", "wait", "while",
+}
+CMD_BUILTINS = {
+    "assoc", "break", "call", "cd", "chdir", "cls", "color", "copy", "date", "del", "dir", "echo",
+    "endlocal", "erase", "exit", "for", "ftype", "goto", "if", "md", "mkdir", "mklink", "move", "path",
+    "pause", "popd", "prompt", "pushd", "rd", "rem", "ren", "rename", "rmdir", "set", "setlocal",
+    "shift", "start", "time", "title", "type", "ver", "verify", "vol",
+}
+# 其后紧跟的单词同样是要执行的程序，值为带参数的选项
+WRAPPER_COMMANDS = {
+    "sudo": {"-u", "-g", "-C", "-D", "-h", "-p", "-U"},
+    "nohup": set(),
+    "time": set(),
+    "env": {"-u", "-C", "-S"},
+    "xargs": {"-I", "-n", "-P", "-d", "-L", "-s", "-E", "-a"},
+    "exec": {"-a"},
+    "nice": {"-n"},
+    "timeout": {"-s", "-k", "--signal", "--kill-after"},
+    "watch": {"-n", "-d"},
+    "command": set(),
+}
+# 第一个位置参数不是程序名的包装命令(如 timeout 5 cmd)
+WRAPPERS_WITH_LEADING_ARG = {"timeout"}
+# 其后的单词不是程序名的关键字(变量名、匹配值等)
+POSIX_NON_COMMAND_KEYWORDS = {"for", "select", "case", "in", "function"}
+POSIX_SHELLS = ("bash", "sh", "zsh", "dash", "ksh")
+
+_ASSIGNMENT_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*=")
+_REDIRECTIONS = {"<", ">", ">>", "<<", "<<<", ">&", "<&", "&>", "&>>", ">|"}
+_SIMPLE_SEPARATOR_RE = re.compile(r"\|\||&&|[|;&\n]")
+_CASE_TERMINATORS = {";;", ";&", ";;&"}
+
+
+def shell_family(shell):
+    """
+    返回:
+        "posix"、"powershell" 或 "cmd"
+    """
+    name = os.path.basename(shell).lower()
+    if name in ("powershell.exe", "pwsh.exe", "powershell", "pwsh"):
+        return "powershell"
+    if name == "cmd.exe":
+        return "cmd"
+    return "posix"
+
+
+def _posix_tokens(command):
+    lexer = shlex.shlex(command, posix=True, punctuation_chars=True)
+    lexer.whitespace_split = True
+    lexer.commenters = "#"
+    lexer.wordchars += "$"
+    return list(lexer)
+
+
+def leading_executables(command, shell):
+    """
+    粗略提取命令中每个命令段(管道、;、&&、子shell等之后)开头的程序名，不执行任何代码。
+    """
+    if shell_family(shell) != "posix":
+        names = []
+        for segment in _SIMPLE_SEPARATOR_RE.split(command):
+            words = segment.split()
+            if words:
+                names.append(words[0].strip("(){}"))
+        return [n for n in names if n]
+
+    try:
+        tokens = _posix_tokens(command)
+    except ValueError:
+        return []
+    names = []
+    command_position = True
+    skip_next = 0
+    wrapper = None
+    # case 语句：case WORD in 之后、每个 ;; 之后到 ) 为止是匹配模式，不是命令
+    case_depth = 0
+    awaiting_in = False
+    in_pattern = False
+    for token in tokens:
+        if in_pattern:
+            if token == "esac":
+                case_depth -= 1
+                in_pattern = False
+            elif token == ")":
+                in_pattern = False
+                command_position = True
+            continue
+        if awaiting_in and token == "in":
+            awaiting_in = False
+            in_pattern = True
+            continue
+        if token in _CASE_TERMINATORS and case_depth:
+            in_pattern = True
+            wrapper = None
+            continue
+        if token == "esac" and case_depth:
+            case_depth -= 1
+            command_position = False
+            continue
+        if token and all(c in "();<>|&" for c in token):
+            # 重定向之后是文件名，其余运算符之后是新的命令
+            command_position = token not in _REDIRECTIONS
+            skip_next = 1 if token in _REDIRECTIONS else 0
+            wrapper = None
+            continue
+        if skip_next:
+            skip_next -= 1
+            continue
+        if not command_position:
+            continue
+        if token in POSIX_NON_COMMAND_KEYWORDS:
+            if token == "case":
+                case_depth += 1
+                awaiting_in = True
+            command_position = False
+            continue
+        if token in POSIX_BUILTINS and token not in WRAPPER_COMMANDS:
+            # if/then/do 等关键字之后仍是命令位置，其他内建命令的参数不是程序
+            command_position = token in ("!", "if", "then", "else", "elif", "do", "while", "until", "{", "time")
+            continue
+        if wrapper is not None and token.startswith("-"):
+            skip_next = 1 if token in WRAPPER_COMMANDS[wrapper] else 0
+            continue
+        if _ASSIGNMENT_RE.match(token) or token.startswith("$"):
+            command_position = not token.startswith("$")
+            continue
+        names.append(token)
+        if token in WRAPPER_COMMANDS:
+            wrapper = token
+            skip_next = 1 if token in WRAPPERS_WITH_LEADING_ARG else 0
+        else:
+            command_position = False
+            wrapper = None
+    return names
+
+
+def missing_executables(command, shell):
+    """
+    检查命令引用的程序是否存在(相当于对每个程序执行 command -v)。
+    返回:
+        不存在的程序名列表(保持出现顺序、去重)
+    """
+    family = shell_family(shell)
+    missing = []
+    for name in leading_executables(command, shell):
+        lowered = name.lower()
+        if family == "posix" and name in POSIX_BUILTINS:
+            continue
+        if family == "cmd" and lowered in CMD_BUILTINS:
+            continue
+        # PowerShell的cmdlet(动词-名词)和别名无法通过PATH判断
+        if family == "powershell" and ("-" in name or not os.path.splitext(name)[1]):
+            continue
+        # 带路径的脚本可能由命令本身先行创建，无法静态判断
+        if os.sep in name or (os.altsep and os.altsep in name):
+            continue
+        if shutil.which(name) is None and name not in missing:
+            missing.append(name)
+    return missing
+
+
+# 通过环境变量传入命令，避免再次转义；只解析不执行
+_POWERSHELL_PARSE_SCRIPT = (
+    "$errors = $null; "
+    "[void][System.Management.Automation.Language.Parser]::ParseInput($env:MM_CHECK_COMMAND, [ref]$null, [ref]$errors); "
+    "if ($errors) { $errors | ForEach-Object { $_.Message }; exit 1 }"
+)
+
+
+def check_syntax(command, shell, timeout=3):
+    """
+    使用目标shell的不执行模式检查语法：POSIX shell 使用 -n，
+    PowerShell 使用其自带的语法解析器(启动较慢，超时时间放宽)。
+    返回:
+        (是否通过, 诊断信息)；cmd.exe 等无法检查或检查超时时视为通过
+    """
+    family = shell_family(shell)
+    if family == "powershell":
+        argv = [shell, "-NoProfile", "-NonInteractive", "-Command", _POWERSHELL_PARSE_SCRIPT]
+        env = dict(os.environ, MM_CHECK_COMMAND=command)
+        timeout = max(timeout, 10)
+    elif family == "posix" and os.path.basename(shell).startswith(POSIX_SHELLS):
+        argv = [shell, "-n", "-c", command]
+        env = None
+    else:
+        return True, ""
+    try:
+        result = subprocess.run(argv, capture_output=True, text=True, timeout=timeout, env=env)
+    except (OSError, subprocess.TimeoutExpired):
+        return True, ""
+    return result.returncode == 0, (result.stdout + result.stderr).strip()
+
+
+def validate_command(command, shell):
+    """
+    执行前的离线检查：语法是否有效，引用的程序是否存在。
+    返回:
+        问题说明列表，为空表示通过
+    """
+    problems = []
+    ok, diagnostic = check_syntax(command, shell)
+    if not ok:
+        problems.append("语法错误: " + (diagnostic or "未知"))
+    missing = missing_executables(command, shell)
+    if missing:
+        problems.append("未找到程序: " + ", ".join(missing))
+    return problems
+
+
+def _normalize(command):
+    return " ".join(command.split())
+
+
+def rank_candidates(candidates, shell, failed_commands=()):
+    """
+    对多个候选命令去重并按本地启发式规则排序：语法有效、引用的程序存在、
+    多个候选一致、与之前失败的命令不同者优先，较短的命令略优先。
+    参数:
+        candidates: 候选命令列表
+        shell: shell类型
+        failed_commands: 之前执行失败的命令
+    返回:
+        [(命令, 问题说明列表), ...]，最优的排在最前
+    """
+    failed = {_normalize(c) for c in failed_commands}
+    votes = {}
+    order = []
+    for command in candidates:
+        key = _normalize(command)
+        if key not in votes:
+            order.append(command.strip())
+        votes[key] = votes.get(key, 0) + 1
+
+    scored = []
+    for command in order:
+        key = _normalize(command)
+        notes = []
+        score = 2.0 * (votes[key] - 1) - len(command) / 1000.0
+        if key in failed:
+            score -= 50
+            notes.append("与之前失败的命令相同")
+        ok, diagnostic = check_syntax(command, shell)
+        if not ok:
+            score -= 100
+            notes.append("语法错误: " + (diagnostic.splitlines()[-1] if diagnostic else "未知"))
+        missing = missing_executables(command, shell)
+        if missing:
+            score -= 10 * len(missing)
+            notes.append("未找到程序: " + ", ".join(missing))
+        scored.append((score, command, notes))
+    scored.sort(key=lambda item: item[0], reverse=True)
+    return [(command, notes) for _, command, notes in scored]
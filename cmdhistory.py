@@ -0,0 +1,192 @@
+import math
+import os
+import re
+import sqlite3
+import time
+from collections import Counter
+
+from cachedir import get_cache_dir
+
+NGRAM = 3
+MAX_PROBE_GRAMS = 8  # 候选召回时最多使用的最稀有n-gram数
+MAX_PROBE_POSTINGS = 4000  # 候选召回时最多读取的倒排记录数，保证检索耗时有上限
+MAX_CANDIDATES = 20  # 精确重排的候选数
+_PUNCTUATION_RE = re.compile(r"[\s?？.。!！,，;；:：'\"“”‘’`]+")
+
+
+def normalize(text):
+    """规范化问题：小写、去除标点，空白合并为单个空格。"""
+    return _PUNCTUATION_RE.sub(" ", text.lower()).strip()
+
+
+def ngrams(text):
+    """
+    字符n-gram词频，首尾以空格填充，使短问题(如中文)也能产生足够的n-gram。
+    """
+    padded = f" {normalize(text)} "
+    if len(padded) < NGRAM:
+        return Counter([padded])
+    return Counter(padded[i:i + NGRAM] for i in range(len(padded) - NGRAM + 1))
+
+
+# 本地命令历史：记录执行成功的 (问题, shell, 操作系统, 命令)，按字符n-gram TF-IDF相似度检索
+class CommandHistory:
+    """
+    基于SQLite倒排索引的命令历史。
+    查询时先用问题中最稀有的若干n-gram召回候选，再对少量候选计算精确的TF-IDF余弦相似度，
+    因此检索耗时基本不随历史条目数增长。
+    """
+    def __init__(self, path=None, max_entries=100000):
+        """
+        参数:
+            path: 数据库路径，默认位于用户缓存目录下的 history.sqlite3
+            max_entries: 最大条目数，超出后删除最早的条目
+        """
+        self.path = path or os.path.join(get_cache_dir(), "history.sqlite3")
+        self.max_entries = max_entries
+        self.conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                id INTEGER PRIMARY KEY, query TEXT NOT NULL, norm TEXT NOT NULL,
+                shell TEXT NOT NULL, os_name TEXT NOT NULL, command TEXT NOT NULL,
+                exit_status INTEGER NOT NULL, uses INTEGER NOT NULL DEFAULT 1, created REAL NOT NULL);
+            CREATE UNIQUE INDEX IF NOT EXISTS entries_unique ON entries(norm, shell, os_name, command);
+            CREATE TABLE IF NOT EXISTS grams (gram TEXT PRIMARY KEY, df INTEGER NOT NULL) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS postings (
+                gram TEXT NOT NULL, entry_id INTEGER NOT NULL, PRIMARY KEY (gram, entry_id)) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS postings_entry ON postings(entry_id);
+        """)
+
+    def record(self, query, shell, os_name, command, exit_status=0):
+        """
+        写入一条执行记录，相同的问题和命令只更新使用次数和时间。
+        """
+        norm = normalize(query)
+        if not norm or not command.strip():
+            return
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            row = self.conn.execute(
+                "SELECT id FROM entries WHERE norm = ? AND shell = ? AND os_name = ? AND command = ?",
+                (norm, shell, os_name, command)).fetchone()
+            if row is not None:
+                self.conn.execute(
+                    "UPDATE entries SET uses = uses + 1, exit_status = ?, created = ?, query = ? WHERE id = ?",
+                    (exit_status, time.time(), query, row[0]))
+                return
+            entry_id = self.conn.execute(
+                "INSERT INTO entries(query, norm, shell, os_name, command, exit_status, created) "
+                "VALUES(?, ?, ?, ?, ?, ?, ?)",
+                (query, norm, shell, os_name, command, exit_status, time.time())).lastrowid
+            grams = list(ngrams(norm))
+            self.conn.executemany("INSERT INTO postings(gram, entry_id) VALUES(?, ?)",
+                                  [(g, entry_id) for g in grams])
+            self.conn.executemany(
+                "INSERT INTO grams(gram, df) VALUES(?, 1) ON CONFLICT(gram) DO UPDATE SET df = df + 1",
+                [(g,) for g in grams])
+        self._evict()
+
+    def mark_failed(self, shell, os_name, command, exit_status):
+        """
+        历史命令再次执行失败时更新其状态，此后不再被推荐。
+        """
+        self.conn.execute(
+            "UPDATE entries SET exit_status = ? WHERE shell = ? AND os_name = ? AND command = ?",
+            (exit_status, shell, os_name, command))
+
+    def _evict(self):
+        count = self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        # 超出10%后才批量删除，避免每次写入都触发淘汰
+        if self.max_entries <= 0 or count <= self.max_entries * 1.1:
+            return
+        with self.conn:
+            self.conn.execute("BEGIN IMMEDIATE")
+            old_ids = [r[0] for r in self.conn.execute(
+                "SELECT id FROM entries ORDER BY created LIMIT ?", (count - self.max_entries,))]
+            for entry_id in old_ids:
+                grams = [r[0] for r in self.conn.execute(
+                    "SELECT gram FROM postings WHERE entry_id = ?", (entry_id,))]
+                self.conn.executemany("UPDATE grams SET df = df - 1 WHERE gram = ?", [(g,) for g in grams])
+                self.conn.execute("DELETE FROM postings WHERE entry_id = ?", (entry_id,))
+                self.conn.execute("DELETE FROM entries WHERE id = ?", (entry_id,))
+            self.conn.execute("DELETE FROM grams WHERE df <= 0")
+
+    def _document_frequencies(self, grams):
+        if not grams:
+            return {}
+        placeholders = ",".join("?" * len(grams))
+        return dict(self.conn.execute(
+            f"SELECT gram, df FROM grams WHERE gram IN ({placeholders})", list(grams)).fetchall())
+
+    @staticmethod
+    def _weights(tf, df, total):
+        return {g: c * (math.log((total + 1) / (df.get(g, 0) + 1)) + 1) for g, c in tf.items()}
+
+    @staticmethod
+    def _cosine(a, b):
+        dot = sum(w * b[g] for g, w in a.items() if g in b)
+        if not dot:
+            return 0.0
+        return dot / (math.sqrt(sum(w * w for w in a.values())) * math.sqrt(sum(w * w for w in b.values())))
+
+    def search(self, query, shell, os_name, limit=1):
+        """
+        检索与问题最相似的、执行成功过的历史命令(仅限相同shell和操作系统)。
+        返回:
+            [(相似度, 原问题, 命令), ...]，按相似度从高到低排列
+        """
+        norm = normalize(query)
+        exact = self.conn.execute(
+            "SELECT query, command FROM entries WHERE norm = ? AND shell = ? AND os_name = ? AND exit_status = 0 "
+            "ORDER BY uses DESC, created DESC LIMIT ?", (norm, shell, os_name, limit)).fetchall()
+        if exact:
+            return [(1.0, q, command) for q, command in exact]
+
+        query_tf = ngrams(norm)
+        total = self.conn.execute("SELECT MAX(id) FROM entries").fetchone()[0] or 0
+        if not total:
+            return []
+        df = self._document_frequencies(query_tf)
+        # 只用最稀有的n-gram召回候选：信息量最大，倒排列表也最短；
+        # 高度相似的历史问题必然包含这些n-gram，常见n-gram对相似度贡献很小，不必读取
+        probe, budget = [], MAX_PROBE_POSTINGS
+        for gram in sorted((g for g in query_tf if g in df), key=lambda g: df[g])[:MAX_PROBE_GRAMS]:
+            if probe and df[gram] > budget:
+                break
+            probe.append(gram)
+            budget -= df[gram]
+        if not probe:
+            return []
+        placeholders = ",".join("?" * len(probe))
+        hits = Counter()
+        for gram, entry_id in self.conn.execute(
+                f"SELECT gram, entry_id FROM postings WHERE gram IN ({placeholders}) LIMIT ?",
+                probe + [MAX_PROBE_POSTINGS]):
+            hits[entry_id] += 1.0 / df[gram]
+        candidate_ids = [entry_id for entry_id, _ in hits.most_common(MAX_CANDIDATES * 5)]
+        if not candidate_ids:
+            return []
+
+        placeholders = ",".join("?" * len(candidate_ids))
+        rows = self.conn.execute(
+            f"SELECT id, query, norm, command FROM entries WHERE id IN ({placeholders}) "
+            "AND shell = ? AND os_name = ? AND exit_status = 0",
+            candidate_ids + [shell, os_name]).fetchall()
+        if not rows:
+            return []
+        rows.sort(key=lambda row: hits[row[0]], reverse=True)
+        rows = [row[1:] for row in rows[:MAX_CANDIDATES]]
+        candidate_tfs = [ngrams(norm) for _, norm, _ in rows]
+        all_grams = set(query_tf)
+        for tf in candidate_tfs:
+            all_grams.update(tf)
+        df = self._document_frequencies(all_grams)
+        query_vec = self._weights(query_tf, df, total)
+        scored = [(self._cosine(query_vec, self._weights(tf, df, total)), q, command)
+                  for (q, _, command), tf in zip(rows, candidate_tfs)]
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return scored[:limit]
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,101 @@
+import hashlib
+import json
+import os
+import platform
+
+from cachedir import get_cache_dir
+
+FINGERPRINT_VERSION = 1
+# 发行版信息文件，升级系统时其修改时间会变化
+OS_RELEASE_FILES = ("/etc/os-release", "/usr/lib/os-release")
+# 影响shell检测和系统提示词的环境变量
+SIGNAL_ENV_VARS = ("SHELL", "PATH", "PSModulePath", "POWERSHELL_DISTRIBUTION_CHANNEL", "COMSPEC")
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def compute_signature(prompt_template, extra=None):
+    """
+    计算环境指纹的失效信号：只读取环境变量和少量文件的修改时间，开销极小。
+    参数:
+        prompt_template: 系统提示词模板，模板变化时指纹失效
+        extra: 其他需要纳入指纹的信号(可JSON序列化)
+    返回:
+        签名字符串
+    """
+    signals = {
+        "version": FINGERPRINT_VERSION,
+        "system": platform.system(),
+        "env": {name: os.environ.get(name) for name in SIGNAL_ENV_VARS},
+        "os_release": [_mtime(path) for path in OS_RELEASE_FILES],
+        "template": hashlib.sha256(prompt_template.encode("utf-8")).hexdigest(),
+        "extra": extra,
+    }
+    # Windows下的shell由父进程决定，同一终端会话中父进程不变
+    if signals["system"] == "Windows":
+        signals["parent"] = os.getppid()
+    return hashlib.sha256(json.dumps(signals, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def get_fingerprint_path():
+    return os.path.join(get_cache_dir(), "environment.json")
+
+
+def load_fingerprint(signature, path=None):
+    """
+    读取磁盘上的环境指纹，签名不一致或文件损坏时返回None。
+    """
+    try:
+        with open(path or get_fingerprint_path(), "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(data, dict) or data.get("signature") != signature:
+        return None
+    return data
+
+
+def save_fingerprint(data, path=None):
+    """
+    原子地写入环境指纹，写入失败(如只读目录)时忽略。
+    """
+    path = path or get_fingerprint_path()
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+def get_environment(prompt_template, probe, extra=None, use_cache=True):
+    """
+    获取环境指纹(shell、操作系统名称、系统提示词等)。
+    签名未变化时直接使用磁盘上的结果，跳过shell检测和发行版探测。
+    参数:
+        prompt_template: 系统提示词模板
+        probe: 无参函数，执行实际探测并返回字典
+        extra: 其他需要纳入签名的信号
+        use_cache: 是否读写磁盘缓存
+    返回:
+        探测结果字典
+    """
+    signature = compute_signature(prompt_template, extra)
+    if use_cache:
+        cached = load_fingerprint(signature)
+        if cached is not None:
+            return cached
+    data = dict(probe())
+    data["signature"] = signature
+    if use_cache:
+        save_fingerprint(data)
+    return data
@@ -0,0 +1,139 @@
+import re
+
+# ANSI转义序列：CSI(颜色、光标移动等)、OSC(窗口标题、超链接)及其他单字符序列
+ANSI_RE = re.compile(r"\x1b\[[0-?]*[ -/]*[@-~]|\x1b\][^\x07\x1b]*(?:\x07|\x1b\\)|\x1b[@-Z\\-_]")
+
+MAX_LINE_CHARS = 400  # 单行最大字符数(压缩后的JSON、进度条等超长行)
+MIN_SECTION_TOKENS = 64  # 每段输出至少保留的token预算
+
+
+def strip_ansi(text):
+    """
+    去除ANSI转义序列，并对含回车的行(进度条等)只保留最后一次刷新的内容。
+    """
+    text = ANSI_RE.sub("", text)
+    return "\n".join(line.rsplit("\r", 1)[-1] if "\r" in line.rstrip("\r") else line.rstrip("\r")
+                     for line in text.split("\n"))
+
+
+def collapse_repeats(lines):
+    """
+    合并连续重复的行。
+    """
+    collapsed = []
+    previous, count = None, 0
+    for line in lines + [None]:
+        if line == previous:
+            count += 1
+            continue
+        if previous is not None:
+            collapsed.append(previous if count == 1 else f"{previous}  [重复 {count} 次]")
+        previous, count = line, 1
+    return collapsed
+
+
+def estimate_tokens(text):
+    """
+    粗略估算token数：ASCII字符约4个一个token，中文等非ASCII字符约一个一个token。
+    """
+    ascii_chars = sum(1 for c in text if ord(c) < 128)
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+def _clip_line(line):
+    if len(line) > MAX_LINE_CHARS:
+        return line[:MAX_LINE_CHARS] + f" ...[截断 {len(line) - MAX_LINE_CHARS} 个字符]"
+    return line
+
+
+def fit_to_budget(text, budget_tokens):
+    """
+    清理输出(去除ANSI、合并重复行、截断超长行)后按token预算保留开头和结尾的行。
+    结尾通常包含最终的错误原因，因此分配更多预算。
+    参数:
+        text: 命令输出
+        budget_tokens: token预算
+    返回:
+        不超过预算的文本
+    """
+    lines = collapse_repeats([_clip_line(line) for line in strip_ansi(text).strip().split("\n")])
+    cleaned = "\n".join(lines)
+    if estimate_tokens(cleaned) <= budget_tokens:
+        return cleaned
+
+    head_budget = budget_tokens // 3
+    tail_budget = budget_tokens - head_budget
+    head, used = [], 0
+    for line in lines:
+        cost = estimate_tokens(line) + 1
+        if used + cost > head_budget:
+            break
+        head.append(line)
+        used += cost
+    tail, used = [], 0
+    for line in reversed(lines[len(head):]):
+        cost = estimate_tokens(line) + 1
+        if used + cost > tail_budget:
+            break
+        tail.append(line)
+        used += cost
+    tail.reverse()
+    omitted = len(lines) - len(head) - len(tail)
+    return "\n".join(head + [f"... [省略 {omitted} 行] ..."] + tail)
+
+
+def last_error_line(attempt):
+    """
+    一次尝试的最后一行错误输出(没有错误输出时取标准输出)
+    """
+    for text in (attempt.get("stderr") or "", attempt.get("stdout") or ""):
+        lines = [line.strip() for line in strip_ansi(text).split("\n") if line.strip()]
+        if lines:
+            return _clip_line(lines[-1])[:200]
+    return "无输出"
+
+
+def build_error_context(original_query, attempts, budget_tokens=1500, hint=""):
+    """
+    构造发送给模型的重试提示，总长度控制在token预算之内。
+    最近一次失败保留开头+结尾的输出，更早的失败只保留命令、返回码和最后一行错误。
+    参数:
+        original_query: 原始用户问题
+        attempts: 按时间顺序排列的失败尝试列表，每项包含 command、returncode、stdout、stderr
+        budget_tokens: token预算
+        hint: 附加的重试提示
+    返回:
+        重试提示文本
+    """
+    latest = attempts[-1]
+    history = ""
+    if len(attempts) > 1:
+        history = "之前失败的尝试:\n" + "\n".join(
+            f"{i}. '{_clip_line(a['command'])}' (返回码 {a['returncode']}): {last_error_line(a)}"
+            for i, a in enumerate(attempts[:-1], 1)) + "\n"
+
+    header = f"""第{len(attempts)}次重试：
+{history}最近一次尝试的命令: '{_clip_line(latest['command'])}'
+执行结果: 失败 (返回码 {latest['returncode']})
+"""
+    footer = f"""原始任务: {original_query}
+
+重要提示: {hint}
+请生成一个完全不同的命令来完成任务，避免重复之前失败的方法。"""
+
+    remaining = max(2 * MIN_SECTION_TOKENS, budget_tokens - estimate_tokens(header + footer))
+    stderr = (latest.get("stderr") or "").strip()
+    stdout = (latest.get("stdout") or "").strip()
+    output = ""
+    if stderr and stdout:
+        # 错误输出更有价值，分得三分之二的预算；标准输出较短时把剩余预算让给错误输出
+        stdout_part = fit_to_budget(stdout, max(MIN_SECTION_TOKENS, remaining // 3))
+        stderr_budget = max(MIN_SECTION_TOKENS, remaining - estimate_tokens(stdout_part))
+        output = f"错误输出: {fit_to_budget(stderr, stderr_budget)}\n标准输出: {stdout_part}\n"
+    elif stderr:
+        output = f"错误输出: {fit_to_budget(stderr, remaining)}\n"
+    elif stdout:
+        output = f"标准输出: {fit_to_budget(stdout, remaining)}\n"
+    else:
+        output = f"命令返回码: {latest['returncode']}，无详细错误信息\n"
+    return header + output + footer
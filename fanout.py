@@ -0,0 +1,150 @@
+"""
+把同一个命令并发地在多个目标上执行：本地目录(以该目录为工作目录执行)，
+或通过包装命令(如 ssh、docker exec)执行的远程主机/容器。
+"""
+import glob
+import os
+import shlex
+import threading
+import time
+
+import streamexec
+from cmdcheck import shell_family
+from errorcontext import last_error_line
+from intents import quote_argument
+
+
+class FanoutResult:
+    """
+    单个目标的执行结果
+    """
+    def __init__(self, target, result=None, error=None, elapsed=0.0):
+        """
+        参数:
+            target: 目标(目录或主机名)
+            result: streamexec.CommandResult，无法启动时为None
+            error: 无法启动时的错误说明
+            elapsed: 耗时(秒)
+        """
+        self.target = target
+        self.result = result
+        self.error = error
+        self.elapsed = elapsed
+
+    @property
+    def ok(self):
+        return self.result is not None and self.result.returncode == 0 and not self.result.timed_out
+
+    def describe(self):
+        """
+        失败原因的一行说明
+        """
+        if self.error:
+            return self.error
+        if self.result.timed_out:
+            return "执行超时"
+        if self.result.interrupted:
+            return "被用户中断"
+        return f"返回码 {self.result.returncode}: " + last_error_line(
+            {"stdout": self.result.stdout, "stderr": self.result.stderr})
+
+
+def read_targets(spec):
+    """
+    解析目标列表：文件(每行一个目标，# 开头为注释)，或逗号分隔的列表；
+    列表中含通配符的项按本地路径展开(如 services/*)。
+    返回:
+        去重后保持顺序的目标列表
+    """
+    if os.path.isfile(spec):
+        with open(spec, "r", encoding="utf-8") as f:
+            entries = [line.strip() for line in f]
+    else:
+        entries = [entry.strip() for entry in spec.split(",")]
+    targets = []
+    for entry in entries:
+        if not entry or entry.startswith("#"):
+            continue
+        if glob.has_magic(entry):
+            targets.extend(sorted(p for p in glob.glob(os.path.expanduser(entry)) if os.path.isdir(p)))
+        else:
+            targets.append(entry)
+    return list(dict.fromkeys(targets))
+
+
+def build_target_argv(shell, command, target, wrapper=None):
+    """
+    构造在目标上执行命令的参数列表和工作目录。
+    参数:
+        shell: 本地shell类型
+        command: 要执行的命令
+        target: 目标
+        wrapper: 包装命令模板，如 "ssh {target} {command}"，{target} 和 {command} 会按本地shell加上引号；
+                 为空时目标是本地目录
+    返回:
+        (参数列表, 工作目录)
+    """
+    if not wrapper:
+        return streamexec.build_shell_argv(shell, command), os.path.expanduser(target)
+    family = shell_family(shell)
+    # 命令和目标原样传给远程，POSIX shell 下不保留 ~ 的本地展开
+    quote = shlex.quote if family == "posix" else lambda value: quote_argument(value, family)
+    quoted_target, quoted_command = quote(target), quote(command)
+    if quoted_target is None or quoted_command is None:
+        raise ValueError("目标或命令中包含无法在当前shell中安全引用的字符")
+    wrapped = wrapper.replace("{target}", quoted_target).replace("{command}", quoted_command)
+    return streamexec.build_shell_argv(shell, wrapped), None
+
+
+def run_fanout(shell, command, targets, concurrency=8, timeout=None, wrapper=None):
+    """
+    在所有目标上并发执行命令，输出实时显示在终端上，每行以 [目标] 开头。
+    参数:
+        shell: 本地shell类型
+        command: 要执行的命令
+        targets: 目标列表
+        concurrency: 最大并发数
+        timeout: 每个目标的超时时间(秒)
+        wrapper: 远程执行的包装命令模板，为空时目标是本地目录
+    返回:
+        按目标顺序排列的 FanoutResult 列表
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    lock = threading.Lock()
+    width = max(len(t) for t in targets)
+
+    cancel = threading.Event()
+
+    def run(target):
+        if cancel.is_set():
+            return FanoutResult(target, error="被用户中断")
+        start = time.perf_counter()
+        try:
+            argv, cwd = build_target_argv(shell, command, target, wrapper)
+            if cwd is not None and not os.path.isdir(cwd):
+                return FanoutResult(target, error="目录不存在")
+            result = streamexec.run_streaming(argv, timeout=timeout, cwd=cwd,
+                                              prefix=f"[{target.ljust(width)}] ", lock=lock, cancel=cancel)
+            return FanoutResult(target, result, elapsed=time.perf_counter() - start)
+        except (OSError, ValueError) as e:
+            return FanoutResult(target, error=str(e), elapsed=time.perf_counter() - start)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(targets)))) as pool:
+        try:
+            return list(pool.map(run, targets))
+        except KeyboardInterrupt:
+            # 子进程在各自的会话中运行，收不到终端的 Ctrl+C，由各工作线程中断后再退出
+            cancel.set()
+            raise
+
+
+def format_summary(results, elapsed):
+    """
+    汇总结果：失败的目标逐个列出原因，最后一行为总计
+    """
+    lines = [f"  ✗ {r.target}: {r.describe()}" for r in results if not r.ok]
+    succeeded = sum(1 for r in results if r.ok)
+    slowest = max(results, key=lambda r: r.elapsed)
+    lines.append(f"共 {len(results)} 个目标：成功 {succeeded}，失败 {len(results) - succeeded}，"
+                 f"总耗时 {elapsed:.1f} 秒 (最慢 {slowest.target} {slowest.elapsed:.1f} 秒)")
+    return "\n".join(lines)
@@ -0,0 +1,274 @@
+import json
+import os
+import re
+import shlex
+import shutil
+
+from cachedir import get_cache_dir
+from cmdcheck import leading_executables, shell_family
+
+# 看起来像路径的参数(包含 / . ~ 之一)，避免把普通名词当成路径
+PATH_ARG = r"[~\w.\-]*[/.~][\w./~\-]*"
+# 看起来像文件名或通配符的参数(包含 . 或 *)
+NAME_ARG = r"[\w\-]*[.*][\w.*\-]*"
+
+# 内置的常用意图：问题必须完整匹配某个模式才使用模板，否则交给模型。
+# templates 按 shell 类型(posix/powershell/cmd)给出，可以是多个候选，依次选用第一个所需程序都存在的；
+# 没有对应 shell 的模板时同样交给模型。模板中的 {参数} 取自模式中的同名分组，缺省值见 defaults。
+# 不内置 tail -f 这类持续运行的命令：执行时受 COMMAND_TIMEOUT 限制，总会以超时结束。
+BUILTIN_INTENTS = [
+    {
+        "name": "list-files",
+        "patterns": [
+            r"(list|show)( all)? files( in (the )?(current|this) (dir|directory|folder))?",
+            r"ls",
+            r"(列出|显示|查看)(当前目录|当前文件夹)?(下|中)?的?(所有)?文件(列表)?",
+        ],
+        "templates": {"posix": "ls -la", "powershell": "Get-ChildItem -Force", "cmd": "dir /a"},
+    },
+    {
+        "name": "list-files-in",
+        "patterns": [
+            r"(list|show)( all)? files in (?P<path>\S+)",
+            r"(列出|显示|查看)\s*(?P<path>[^\s的]+)\s*(目录|文件夹)(下|中|里)的?(所有)?文件",
+            rf"(列出|显示|查看)\s*(?P<path>{PATH_ARG})\s*(下|中|里)的?(所有)?文件",
+        ],
+        "templates": {"posix": "ls -la {path}", "powershell": "Get-ChildItem -Force {path}", "cmd": "dir /a {path}"},
+    },
+    {
+        "name": "current-directory",
+        "patterns": [r"pwd", r"where am i", r"(show|print)( the)? current (dir|directory)",
+                     r"(显示|查看)?当前(所在)?(的)?(目录|路径|文件夹)"],
+        "templates": {"posix": "pwd", "powershell": "Get-Location", "cmd": "cd"},
+    },
+    {
+        "name": "disk-usage",
+        "patterns": [r"(show |check )?(the )?disk (usage|space|free space)", r"df",
+                     r"(显示|查看|检查)?磁盘(的)?(使用情况|空间|使用率|剩余空间|占用)"],
+        "templates": {"posix": "df -h", "powershell": "Get-PSDrive -PSProvider FileSystem"},
+    },
+    {
+        "name": "directory-size",
+        "patterns": [rf"(show |check )?(the )?size of (?P<path>{PATH_ARG})", rf"how big is (?P<path>{PATH_ARG})",
+                     r"(显示|查看)?\s*(?P<path>[^\s的]+)\s*(目录|文件夹)的?(大小|占用空间)",
+                     rf"(显示|查看)?\s*(?P<path>{PATH_ARG})\s*的?(大小|占用空间)"],
+        "templates": {
+            "posix": "du -sh {path}",
+            "powershell": "(Get-ChildItem {path} -Recurse -Force | Measure-Object -Property Length -Sum).Sum / 1MB",
+        },
+    },
+    {
+        "name": "memory-usage",
+        "patterns": [r"(show |check )?(the )?(memory|ram) usage", r"(show |check )?free memory",
+                     r"(显示|查看)?内存(的)?(使用情况|占用|使用率)"],
+        "templates": {
+            "posix": ["free -h", "vm_stat"],
+            "powershell": "Get-CimInstance Win32_OperatingSystem | Select-Object TotalVisibleMemorySize,FreePhysicalMemory",
+        },
+    },
+    {
+        "name": "find-by-name",
+        "patterns": [
+            r"find (all )?(files? )?(named|called) (?P<name>\S+)( in (?P<path>\S+))?",
+            rf"find (all )?(?P<name>{NAME_ARG})( files?)?( in (?P<path>\S+))?",
+            rf"(在\s*(?P<path>[^\s的]+?)\s*(目录|文件夹)?(下|中|里))?(查找|搜索|寻找)(名为|名字是|文件名为)\s*(?P<name>[^\s的]+)\s*的?文件",
+            rf"(在\s*(?P<path>[^\s的]+?)\s*(目录|文件夹)?(下|中|里))?(查找|搜索|寻找)(所有)?\s*(?P<name>{NAME_ARG})\s*(的)?文件",
+        ],
+        "defaults": {"path": "."},
+        "templates": {
+            "posix": "find {path} -name {name}",
+            "powershell": "Get-ChildItem -Path {path} -Recurse -Filter {name}",
+            "cmd": "dir /s /b {path}\\{name}",
+        },
+    },
+    {
+        "name": "port-owner",
+        "patterns": [
+            r"(what|which) (process|program) is (using|listening on|on) port (?P<port>\d{1,5})",
+            r"who is using port (?P<port>\d{1,5})",
+            r"(查看|查询|检查)?\s*(?P<port>\d{1,5})\s*端口(被)?(谁|哪个进程|什么进程)(占用|在用|使用)了?",
+            r"(查看|查询)?(哪个进程|谁)占用了?\s*(?P<port>\d{1,5})\s*端口",
+        ],
+        "templates": {
+            "posix": ["lsof -i :{port}", "ss -ltnp sport = :{port}"],
+            "powershell": "Get-NetTCPConnection -LocalPort {port} | Select-Object LocalAddress,LocalPort,State,OwningProcess",
+            "cmd": "netstat -ano | findstr :{port}",
+        },
+    },
+    {
+        "name": "kill-by-port",
+        "patterns": [
+            r"kill (the )?(process(es)? )?(on|using|listening on|at) port (?P<port>\d{1,5})",
+            r"free (up )?port (?P<port>\d{1,5})",
+            r"(杀死|杀掉|结束|关闭|停止)(占用)?\s*(?P<port>\d{1,5})\s*端口(的|上的)?(进程|程序)?",
+            r"(杀死|杀掉|结束|关闭|停止)占用\s*端口\s*(?P<port>\d{1,5})\s*的(进程|程序)",
+        ],
+        "templates": {
+            "posix": ["kill $(lsof -t -i :{port})", "fuser -k {port}/tcp"],
+            "powershell": "Get-NetTCPConnection -LocalPort {port} | ForEach-Object { Stop-Process -Id $_.OwningProcess -Force }",
+        },
+    },
+    {
+        "name": "tail-file",
+        "patterns": [
+            rf"tail (the )?(last (?P<lines>\d+) lines of )?(?P<path>{PATH_ARG})",
+            rf"(show|print) (the )?last (?P<lines>\d+) lines (of|in) (?P<path>{PATH_ARG})",
+            rf"(显示|查看|输出)\s*(?P<path>{PATH_ARG})\s*的?最后\s*(?P<lines>\d+)\s*行",
+        ],
+        "defaults": {"lines": "20"},
+        "templates": {"posix": "tail -n {lines} {path}", "powershell": "Get-Content {path} -Tail {lines}"},
+    },
+]
+
+# 参数中不允许出现的字符：即使加了引号，在 cmd.exe 中这些字符仍可能被解释
+_CMD_UNSAFE_RE = re.compile(r'[&|<>^%"!\r\n]')
+# 不去掉结尾的 "."，它可能就是路径参数(如 how big is .)
+_TRAILING_PUNCTUATION = "?？。!！ "
+# 中文问题中指代当前目录的词(如 "当前目录的大小" 中的 "当前")，作为路径参数时替换为 "."
+_CURRENT_DIR_RE = re.compile(r"^(当前|这个|这|此|本|该)(目录|文件夹)?$")
+
+
+def normalize_query(query):
+    """
+    规范化问题：合并空白、去掉结尾的标点。不转换大小写(匹配时忽略大小写)，以保留路径等参数的原样
+    """
+    return " ".join(query.split()).rstrip(_TRAILING_PUNCTUATION)
+
+
+def quote_argument(value, family):
+    """
+    按shell类型为参数加引号，无法安全表示时返回None
+    """
+    if family == "posix":
+        # 保留 ~ 的展开
+        if value == "~" or value.startswith("~/"):
+            return "~" + (shlex.quote(value[1:]) if len(value) > 1 else "")
+        return shlex.quote(value)
+    if family == "powershell":
+        return "'" + value.replace("'", "''") + "'"
+    if _CMD_UNSAFE_RE.search(value):
+        return None
+    return f'"{value}"' if " " in value else value
+
+
+class IntentMatcher:
+    """
+    本地意图匹配：用预编译的正则表达式把常见问题直接转换为经过审核的命令模板，不访问网络。
+    """
+    def __init__(self, intents=None, user_file=None):
+        """
+        参数:
+            intents: 意图列表，默认使用内置意图
+            user_file: 用户自定义意图的JSON文件(格式同 BUILTIN_INTENTS)，优先于内置意图
+        """
+        definitions = list(intents if intents is not None else BUILTIN_INTENTS)
+        if user_file and os.path.exists(user_file):
+            with open(user_file, "r", encoding="utf-8") as f:
+                definitions = list(json.load(f)) + definitions
+        self.intents = [(intent, [re.compile(f"^(?:{p})$", re.IGNORECASE) for p in intent["patterns"]]) for intent in definitions]
+        self._which_cache = {}
+
+    def _available(self, command, shell):
+        for name in leading_executables(command, shell):
+            if name not in self._which_cache:
+                self._which_cache[name] = shutil.which(name) is not None
+            if not self._which_cache[name]:
+                return False
+        return True
+
+    def may_match(self, query):
+        """
+        不考虑shell类型和程序是否存在，只判断问题是否匹配某个模式。不需要检测shell，可在预连接之前调用
+        """
+        text = normalize_query(query)
+        return bool(text) and any(p.match(text) for _, patterns in self.intents for p in patterns)
+
+    def match(self, query, shell):
+        """
+        匹配问题。
+        返回:
+            (意图名, 命令)，无法可靠匹配时返回None
+        """
+        text = normalize_query(query)
+        if not text:
+            return None
+        family = shell_family(shell)
+        for intent, patterns in self.intents:
+            templates = intent.get("templates", {}).get(family)
+            if not templates:
+                continue
+            for pattern in patterns:
+                m = pattern.match(text)
+                if m is None:
+                    continue
+                args = dict(intent.get("defaults", {}))
+                args.update({k: v for k, v in m.groupdict().items() if v})
+                if "path" in args and _CURRENT_DIR_RE.match(args["path"]):
+                    args["path"] = "."
+                quoted = {}
+                for key, value in args.items():
+                    quoted[key] = quote_argument(value, family)
+                    if quoted[key] is None:
+                        return None
+                for template in ([templates] if isinstance(templates, str) else templates):
+                    command = self._render(template, quoted)
+                    if command is None:
+                        continue
+                    if family != "posix" or self._available(command, shell):
+                        return intent["name"], command
+                return None
+        return None
+
+    @staticmethod
+    def _render(template, args):
+        """
+        只替换模板中的 {参数}，其余花括号(如 PowerShell 的脚本块)原样保留；
+        模板引用了没有值的参数时返回None
+        """
+        missing = []
+
+        def replace(m):
+            if m.group(1) in args:
+                return args[m.group(1)]
+            missing.append(m.group(1))
+            return m.group(0)
+
+        command = re.sub(r"\{(\w+)\}", replace, template)
+        return None if missing else command
+
+
+class IntentStats:
+    """
+    意图匹配的命中统计，保存在缓存目录中
+    """
+    def __init__(self, path=None):
+        self.path = path or os.path.join(get_cache_dir(), "intent_stats.json")
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.data = json.load(f)
+        except (OSError, ValueError):
+            self.data = {}
+        self.data.setdefault("queries", 0)
+        self.data.setdefault("hits", 0)
+        self.data.setdefault("by_intent", {})
+
+    def record(self, *intent_names):
+        """
+        记录若干次匹配结果(未命中为None)并写回统计文件
+        """
+        for intent_name in intent_names:
+            self.data["queries"] += 1
+            if intent_name:
+                self.data["hits"] += 1
+                self.data["by_intent"][intent_name] = self.data["by_intent"].get(intent_name, 0) + 1
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass
+
+    @property
+    def hit_rate(self):
+        return self.data["hits"] / self.data["queries"] if self.data["queries"] else 0.0
@@ -1,15 +1,71 @@
+from tracing import tracer
 import os
 import platform
-from opensdkmodel import OpenAIModel
 import sys
-import subprocess
-from dotenv import load_dotenv # 确保这行在最顶部且没有被注释或条件化
-import distro
-import pyperclip
+import re
+import streamexec
+import errorcontext
+import cmdcheck
+import envprobe
+import toolindex
+import intents
+import time
+import atexit
 from termcolor import colored
-from colorama import init
+# 注意：openai、distro、pyperclip、colorama、dotenv 等较重的模块，以及模型客户端、响应缓存、命令历史(sqlite3)、
+# 守护进程(socket)、批量、交互和并发执行模式的模块仅在需要时才导入，以保证 mm --help、缓存命中等不访问网络的路径启动足够快
+
+# 命令行开关 -> 选项名
+CLI_FLAGS = {
+    "-a": "ask",
+    "-i": "interactive",
+    "--no-cache": "no_cache",
+    "--cache-stats": "cache_stats",
+    "--stream": "stream",
+    "--daemon": "daemon",
+    "--daemon-stop": "daemon_stop",
+    "--unordered": "unordered",
+    "--timing": "timing",
+    "--no-history": "no_history",
+    "--profile": "profile",
+    "--intent-stats": "intent_stats",
+}
+
+# 带参数值的命令行选项 -> 选项名
+CLI_OPTIONS = {
+    "--batch": "batch",
+    "--concurrency": "concurrency",
+    "--timeout": "timeout",
+    "--fanout": "fanout",
+}
+
+# 是否使用本地响应缓存(可通过 --no-cache 关闭)
+response_cache_enabled = True
+_response_cache = None
+
+# 是否使用本地命令历史(可通过 --no-history 关闭)
+history_enabled = True
+_command_history = None
+
+# 本次运行的环境指纹(shell、操作系统名称、系统提示词)，首次使用时从磁盘缓存加载或探测
+_environment = None
+
+# 本地意图匹配器，首次使用时加载
+_intent_matcher = None
+# 待写入统计文件的意图匹配结果，退出时一次写入
+_pending_intent_stats = []
+
+# 本次运行的模型客户端，供运行结束时输出预连接耗时
+_client = None
 
 def get_current_shell():
+    """
+    当前使用的shell类型，取自环境指纹
+    返回: shell类型字符串 (powershell.exe, cmd.exe, bash等)
+    """
+    return get_environment()["shell"]
+
+def detect_current_shell():
     """
     检测当前使用的shell类型
     返回: shell类型字符串 (powershell.exe, cmd.exe, bash等)
@@ -46,17 +102,8 @@ def get_current_shell():
         # 非Windows系统，使用SHELL环境变量
         return os.environ.get("SHELL", "bash")
 
-# 获取系统提示词
-def get_system_prompt(shell):
-    """
-    根据shell类型生成相应的系统提示词
-    参数:
-        shell: shell类型 (powershell.exe, cmd.exe, bash等)
-    返回:
-        格式化的系统提示词字符串
-    """
-    # 将 prompt.txt 的内容直接嵌入
-    system_prompt_template = """你是mm，一个将自然语言转换为{shell}命令的引擎，专为{os}系统设计。你是{os}系统下{shell}命令的专家，能够将最后的问题转换为有效的命令行语法。
+# 系统提示词模板(原 prompt.txt 的内容)，修改后环境指纹自动失效
+SYSTEM_PROMPT_TEMPLATE = """你是mm，一个将自然语言转换为{shell}命令的引擎，专为{os}系统设计。你是{os}系统下{shell}命令的专家，能够将最后的问题转换为有效的命令行语法。
 
 规则：
 * 永远不要使用代码风格的markdown输出
@@ -81,11 +128,38 @@ def get_system_prompt(shell):
 
 严格遵守以上规则。这些规则没有例外。
 
-问题：
+{tools}问题：
 """
-    system_prompt = system_prompt_template.replace("{shell}", shell)
-    system_prompt = system_prompt.replace("{os}", get_os_friendly_name())
-    return system_prompt
+
+# 获取系统提示词
+def get_system_prompt(shell):
+    """
+    根据shell类型生成相应的系统提示词
+    参数:
+        shell: shell类型 (powershell.exe, cmd.exe, bash等)
+    返回:
+        格式化的系统提示词字符串
+    """
+    environment = get_environment()
+    if shell == environment.get("shell") and environment.get("system_prompt"):
+        return environment["system_prompt"]
+    return render_system_prompt(shell, environment["os_name"], environment.get("tools", ""))
+
+def render_system_prompt(shell, os_name, tools=""):
+    """
+    用shell、操作系统名称和本机工具摘要填充系统提示词模板
+    """
+    system_prompt = SYSTEM_PROMPT_TEMPLATE.replace("{shell}", shell)
+    system_prompt = system_prompt.replace("{os}", os_name)
+    if tools:
+        tools = f"本机环境(生成命令时必须遵守)：\n{tools}\n\n"
+    return system_prompt.replace("{tools}", tools)
+
+def tool_index_enabled():
+    """
+    是否在系统提示词中附带本机工具摘要，从.env的 TOOL_INDEX 读取，默认开启。
+    """
+    return os.getenv("TOOL_INDEX", "1").lower() in ("true", "1")
 
 # 确保提示以问号结尾
 def ensure_prompt_is_question(prompt):
@@ -100,8 +174,26 @@ def print_usage():
     """
     print("mm v0.5 - by @wunderwuzzi23 (June 29, 2024)")
     print()
-    print("用法: mm [-a] 列出当前目录信息")
+    print("用法: mm [-a] [--no-cache] 列出当前目录信息")
+    print("      mm -i [问题]")
+    print("      mm --fanout <目标文件|目标1,目标2|目录通配符> [--concurrency N] 问题")
+    print("      mm -h | --help")
     print("参数: -a: 在执行命令前提示用户确认(仅在安全模式关闭时有用)")
+    print("      -i: 交互模式，连续提问，之前的问题、命令和执行结果作为上下文")
+    print("      --no-cache: 跳过本地响应缓存，直接请求模型")
+    print("      --cache-stats: 显示本地响应缓存的统计信息")
+    print("      --no-history: 不推荐相似的历史命令，直接请求模型")
+    print("      --stream: 流式输出模型生成的命令")
+    print("      --daemon: 在前台运行常驻守护进程(保持预热的模型连接)")
+    print("      --daemon-stop: 停止正在运行的守护进程")
+    print("      --batch <文件|->: 批量将JSONL/文本中的问题转换为命令并以JSONL输出(不执行)")
+    print("      --concurrency N: 批量模式的最大并发请求数，或 --fanout 的最大并发执行数")
+    print("      --fanout <目标>: 只生成一次命令，确认后在多个目录(或通过 FANOUT_WRAPPER 在多台主机)上并发执行")
+    print("      --unordered: 批量模式按完成顺序输出结果")
+    print("      --timeout N: 命令执行超时时间(秒)，0 表示不限时")
+    print("      --timing: 显示预连接(TCP+TLS握手)的耗时及被本地准备工作隐藏的部分")
+    print("      --intent-stats: 显示本地意图模板的命中统计")
+    print("      --profile: 运行结束后显示各阶段耗时(导入、.env加载、环境检测、首个token、生成、执行等)及token用量")
     print("支持的Shell: PowerShell, CMD, Bash")
     print()
     print("当前配置(.env):")
@@ -128,12 +220,31 @@ def print_usage():
     modify_bool = modify_env in ("true", "1")
     print("* 修改模式       : " + str(modify_bool))
 
+    print("* 执行超时(秒)   : " + str(os.getenv("COMMAND_TIMEOUT", "30")))
+    print("* 执行前检查     : " + str(validation_enabled()))
+    print("* 重试候选数     : " + str(os.getenv("RETRY_CANDIDATES", "1")))
+    print("* 会话上下文预算 : " + str(get_session_tokens()))
+    print("* 并发执行包装   : " + str(os.getenv("FANOUT_WRAPPER") or "无(本地目录)"))
+    print("* 限流(RPM/TPM)  : " + str(os.getenv("RATE_LIMIT_RPM", "0")) + "/" + str(os.getenv("RATE_LIMIT_TPM", "0"))
+          + " (0 表示不限制)")
     print("* 命令颜色: " + str(os.getenv("SUGGESTED_COMMAND_COLOR", "yellow")))
+    print("* 流式输出       : " + str(os.getenv("STREAM", "0").lower() in ("true", "1")))
+    print("* 预连接         : " + str(prewarm_enabled()))
+    print("* 守护进程       : " + str(daemon_enabled()))
+    print("* 命令历史       : " + str(os.getenv("HISTORY", "1").lower() in ("true", "1")))
+    print("* 本地意图模板   : " + str(intents_enabled()))
+    print("* 工具索引       : " + str(tool_index_enabled()))
+    print("* 环境缓存       : " + str(os.getenv("ENV_CACHE", "1").lower() in ("true", "1")))
+    print("* 响应缓存       : " + str(os.getenv("RESPONSE_CACHE", "1").lower() in ("true", "1")))
 
 # 获取操作系统友好名称
 def get_os_friendly_name():
+  return get_environment()["os_name"]
+
+def detect_os_friendly_name():
   os_name = platform.system()
   if os_name == "Linux":
+    import distro
     return "Linux/"+distro.name(pretty=True)
   elif os_name == "Windows":
     return os_name
@@ -142,13 +253,243 @@ def get_os_friendly_name():
   else:
     return os_name
 
-def chat_completion(client, query, shell):
+def probe_environment():
+    """
+    实际探测环境：检测shell、读取发行版名称并生成系统提示词
+    """
+    shell = detect_current_shell()
+    os_name = detect_os_friendly_name()
+    tools = toolindex.build_summary() if tool_index_enabled() else ""
+    return {"shell": shell, "os_name": os_name, "tools": tools,
+            "system_prompt": render_system_prompt(shell, os_name, tools)}
+
+def get_environment():
+    """
+    获取环境指纹。$SHELL、$PATH、$PATH 各目录的修改时间、/etc/os-release 等未变化时直接读取磁盘缓存，
+    跳过shell检测、发行版探测和工具索引更新；同一进程内只计算一次。可通过.env的 ENV_CACHE=0 关闭磁盘缓存。
+    """
+    global _environment
+    if _environment is None:
+        with tracer.span("environment") as span:
+            probed = []
+            def probe():
+                probed.append(True)
+                return probe_environment()
+            _environment = envprobe.get_environment(
+                SYSTEM_PROMPT_TEMPLATE, probe,
+                extra={"tools": toolindex.path_signature()} if tool_index_enabled() else None,
+                use_cache=os.getenv("ENV_CACHE", "1").lower() in ("true", "1"))
+            span["cached"] = not probed
+    return _environment
+
+def parse_args(argv):
+    """
+    解析命令行参数，开关需位于问题之前。
+    参数:
+        argv: 不含程序名的参数列表
+    返回:
+        (选项字典, 用户问题字符串)
+    """
+    options = {name: False for name in CLI_FLAGS.values()}
+    options.update({name: None for name in CLI_OPTIONS.values()})
+    idx = 0
+    while idx < len(argv) and (argv[idx] in CLI_FLAGS or argv[idx] in CLI_OPTIONS):
+        if argv[idx] in CLI_FLAGS:
+            options[CLI_FLAGS[argv[idx]]] = True
+            idx += 1
+        else:
+            # 缺少参数值时使用 "-" (例如 --batch 位于末尾时从标准输入读取)
+            options[CLI_OPTIONS[argv[idx]]] = argv[idx + 1] if idx + 1 < len(argv) else "-"
+            idx += 2
+    return options, " ".join(argv[idx:])
+
+def get_model_params():
+    """
+    从.env读取模型参数，无法解析时给出警告并使用默认值。
+    返回:
+        (模型名称, 温度系数, 最大令牌数)
+    """
+    model = os.getenv("MODEL_NAME")
+
+    try:
+        temperature = float(os.getenv("MODEL_TEMPERATURE", "0.7"))
+    except ValueError:
+        print(colored(f"警告：.env 文件中的 MODEL_TEMPERATURE ('{os.getenv('MODEL_TEMPERATURE')}') 不是有效的浮点数，将使用默认值 0.7。", "yellow"))
+        temperature = 0.7
+
+    try:
+        max_tokens = int(os.getenv("MODEL_MAX_TOKENS", "2048"))
+    except ValueError:
+        print(colored(f"警告：.env 文件中的 MODEL_MAX_TOKENS ('{os.getenv('MODEL_MAX_TOKENS')}') 不是有效的整数，将使用默认值 2048。", "yellow"))
+        max_tokens = 2048
+    return model, temperature, max_tokens
+
+def get_response_cache():
+    """
+    获取本地响应缓存实例，缓存被关闭或无法打开时返回None。
+    """
+    global _response_cache
+    if not response_cache_enabled or os.getenv("RESPONSE_CACHE", "1").lower() not in ("true", "1"):
+        return None
+    if _response_cache is None:
+        import sqlite3
+        from responsecache import ResponseCache
+        try:
+            _response_cache = ResponseCache(
+                max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000")),
+                ttl=int(os.getenv("RESPONSE_CACHE_TTL", str(7 * 24 * 3600))))
+        except (ValueError, OSError, sqlite3.Error) as e:
+            print(colored(f"警告：无法打开响应缓存，将直接请求模型: {e}", "yellow"))
+            return None
+    return _response_cache
+
+def get_cache_key(query, shell, system_prompt=None, model_params=None):
+    """
+    计算问题在当前环境下的缓存键。
+    """
+    if system_prompt is None:
+        system_prompt = get_system_prompt(shell)
+    from responsecache import ResponseCache
+    model, temperature, _ = model_params or get_model_params()
+    return ResponseCache.make_key(query, shell, get_os_friendly_name(), model, temperature, system_prompt)
+
+def print_cache_stats():
+    """
+    打印本地响应缓存的统计信息
+    """
+    cache = get_response_cache()
+    if cache is None:
+        print("响应缓存未启用。")
+        return
+    stats = cache.stats()
+    lookups = stats["hits"] + stats["misses"]
+    hit_rate = stats["hits"] / lookups * 100 if lookups else 0.0
+    print("响应缓存: " + cache.path)
+    print(f"* 条目数       : {stats['entries']}")
+    print(f"* 文件大小     : {stats['size_bytes'] / 1024:.1f} KB")
+    print(f"* 命中/未命中  : {stats['hits']}/{stats['misses']}")
+    print(f"* 命中率       : {hit_rate:.1f}%")
+
+class StreamEcho:
+    """
+    流式回显模型生成的命令。
+    在能够确定回复不是错误说明或Markdown代码块之前暂不输出，避免闪现无效内容。
+    """
+    def __init__(self):
+        self.color = os.getenv("SUGGESTED_COMMAND_COLOR", "yellow")
+        self.text = ""
+        self.shown = 0
+
+    def __call__(self, delta):
+        self.text += delta
+        if self.shown == 0:
+            if response_may_become_invalid(self.text):
+                return
+            print("命令: ", end='')
+        print(colored(self.text[self.shown:], self.color, attrs=['bold']), end='', flush=True)
+        self.shown = len(self.text)
+
+    def finish(self):
+        if self.shown:
+            print()
+
+def daemon_enabled():
+    if os.getenv("DAEMON", "0").lower() not in ("true", "1"):
+        return False
+    import mmdaemon
+    return mmdaemon.daemon_supported()
+
+def prewarm_enabled():
+    return os.getenv("PREWARM", "1").lower() in ("true", "1")
+
+def start_prewarm(client):
+    if prewarm_enabled() and hasattr(client, "prewarm"):
+        client.prewarm()
+
+def print_prewarm_timing(client):
+    """
+    打印预连接耗时：后台导入openai和建立连接共用了多久，其中多少与本地准备工作重叠。
+    """
+    stats = getattr(client, "prewarm_stats", None)
+    if not stats:
+        print(colored("预连接: 未使用", "cyan"))
+        return
+    total = stats["import"] + stats["connect"]
+    hidden = max(0.0, total - stats["waited"])
+    print(colored(f"预连接: 导入 {stats['import']:.0f} ms + 握手 {stats['connect']:.0f} ms，"
+                  f"其中 {hidden:.0f} ms 与本地准备重叠，请求前等待 {stats['waited']:.0f} ms", "cyan"))
+
+def create_client():
+    """
+    创建模型客户端。启用守护进程模式时优先使用已预热的守护进程，
+    守护进程未运行时在后台启动它，本次调用回退到本地模型客户端。
+    配置了 FALLBACK_ENDPOINTS 时本地模型客户端为多端点对冲的 HedgedModel。
+    返回:
+        OpenAIModel、HedgedModel 或 DaemonModel 实例
+    """
+    if daemon_enabled():
+        import mmdaemon
+        try:
+            # 使用守护进程时本进程不导入 opensdkmodel 和 openai
+            return mmdaemon.DaemonModel()
+        except OSError:
+            mmdaemon.spawn_daemon()
+    from opensdkmodel import create_model
+    return create_model()
+
+def handle_service_options(options):
+    """
+    处理不需要生成命令的选项(缓存统计、守护进程管理)。
+    返回:
+        是否已处理(已处理时调用方应直接退出)
+    """
+    if options["cache_stats"]:
+        print_cache_stats()
+        return True
+    if options["intent_stats"]:
+        print_intent_stats()
+        return True
+    if options["daemon_stop"]:
+        import mmdaemon
+        if not mmdaemon.daemon_supported() or not mmdaemon.stop_daemon():
+            print("mm 守护进程未运行。")
+        return True
+    if options["daemon"]:
+        import mmdaemon
+        if not mmdaemon.daemon_supported():
+            print(colored("当前平台不支持守护进程模式。", "red"))
+            sys.exit(1)
+        check_api_key()
+        try:
+            idle_timeout = int(os.getenv("DAEMON_IDLE_TIMEOUT", "1800"))
+        except ValueError:
+            idle_timeout = 1800
+        from opensdkmodel import create_model
+        model = create_model()
+        model.prewarm()
+        mmdaemon.run_daemon(model, idle_timeout)
+        return True
+    return False
+
+def build_messages(system_prompt, query, history=None):
+    return [
+        {"role": "system", "content": system_prompt},
+        *(history or []),
+        {"role": "user", "content": query}
+    ]
+
+def chat_completion(client, query, shell, use_cache=True, echo=None, history=None):
     """
     调用模型进行对话，所有模型参数均从.env文件读取。
+    相同环境下的相同问题优先从本地响应缓存返回。
     参数:
         client: OpenAIModel实例
         query: 用户输入的自然语言
         shell: 当前shell类型
+        use_cache: 是否读写本地响应缓存
+        echo: StreamEcho实例，提供时以流式方式请求并实时回显，
+              一旦发现错误说明或Markdown代码块立即取消生成
+        history: 之前的多轮消息(交互模式或修改问题时)，回复依赖上下文，因此不使用响应缓存
     返回:
         模型生成的回复内容
     """
@@ -156,50 +497,385 @@ def chat_completion(client, query, shell):
         print ("未指定用户提示。")
         sys.exit(-1)
     system_prompt = get_system_prompt(shell)
-    model = os.getenv("MODEL_NAME")
-    
+    model_params = get_model_params()
+    model, temperature, max_tokens = model_params
+
+    cache = get_response_cache() if use_cache and not history else None
+    if cache is not None:
+        with tracer.span("cache_lookup") as span:
+            cache_key = get_cache_key(query, shell, system_prompt, model_params)
+            cached = cache.get(cache_key)
+            span["hit"] = cached is not None
+        if cached is not None:
+            return cached
+
     try:
-        temperature = float(os.getenv("MODEL_TEMPERATURE", "0.7"))
+        response = client.chat(
+            model=model,
+            messages=build_messages(system_prompt, query, history),
+            temperature=temperature,
+            max_tokens=max_tokens,
+            stream=echo is not None,
+            on_token=echo,
+            should_abort=response_is_invalid)
+    except Exception as e:
+        import ratelimit
+        if not ratelimit.is_rate_limited(e):
+            raise
+        reason = str(e) if isinstance(e, ratelimit.RateLimitExceeded) else "API 请求频率超限 (429)"
+        print(colored(f"{reason}，请稍后再试或在.env中设置(调低) RATE_LIMIT_RPM/RATE_LIMIT_TPM。", "red"))
+        sys.exit(1)
+    if echo is not None:
+        echo.finish()
+
+    if cache is not None and response and not response_is_invalid(response):
+        cache.put(cache_key, response)
+    return response
+
+def validation_enabled():
+    """
+    是否在执行前离线检查生成的命令，从.env的 VALIDATE 读取，默认开启。
+    """
+    return os.getenv("VALIDATE", "1").lower() in ("true", "1")
+
+def get_validate_retries():
+    """
+    命令未通过离线检查时自动重新生成的最大次数，从.env的 VALIDATE_RETRIES 读取。
+    """
+    try:
+        return max(0, int(os.getenv("VALIDATE_RETRIES", "1")))
     except ValueError:
-        print(colored(f"警告：.env 文件中的 MODEL_TEMPERATURE ('{os.getenv('MODEL_TEMPERATURE')}') 不是有效的浮点数，将使用默认值 0.7。", "yellow"))
-        temperature = 0.7
+        print(colored(f"警告：.env 文件中的 VALIDATE_RETRIES ('{os.getenv('VALIDATE_RETRIES')}') 不是有效的整数，将使用默认值 1。", "yellow"))
+        return 1
+
+def generate_command(client, query, shell, echo=None, history=None):
+    """
+    生成命令并在交给用户确认之前进行检查：先检查错误说明和Markdown，
+    再用目标shell的不执行模式检查语法、检查引用的程序是否存在；
+    未通过时附带诊断信息立即重新生成，而不是等命令执行失败后再重试。
+    参数:
+        client: OpenAIModel实例
+        query: 用户输入的自然语言
+        shell: 当前shell类型
+        echo: StreamEcho实例，提供时首次生成以流式方式回显
+        history: 之前的多轮消息
+    返回:
+        (命令, 是否已回显)；超过重新生成次数仍未通过时返回最后一次的命令
+    """
+    with tracer.span("generate"):
+        response = chat_completion(client, query, shell, echo=echo, history=history)
+    check_for_issue(response)
+    check_for_markdown(response)
+    echoed = bool(echo and echo.shown)
+    if not validation_enabled():
+        return response, echoed
 
+    retries = get_validate_retries()
+    for attempt in range(retries + 1):
+        with tracer.span("validate") as span:
+            problems = cmdcheck.validate_command(response, shell)
+            span["ok"] = not problems
+        if not problems:
+            return response, echoed
+        if attempt == 0 and not history:
+            # 未通过检查的回复不应再从缓存返回(带上下文的回复不会写入缓存)
+            invalidate_cached_response(query, shell)
+        print(colored(f"⚠️  生成的命令未通过本地检查: {'；'.join(problems)}", "yellow"))
+        if attempt == retries:
+            break
+        print(colored("正在根据检查结果重新生成命令...", "yellow"))
+        with tracer.span("generate", reason="validation"):
+            response = chat_completion(client, f"""原始任务: {query}
+生成的命令: '{response}'
+执行前的本地检查未通过:
+{chr(10).join(problems)}
+请修正这些问题，生成一个可以直接执行的命令。""", shell, use_cache=False, history=history)
+        check_for_issue(response)
+        check_for_markdown(response)
+        echoed = False
+    return response, echoed
+
+def run_batch_mode(source, shell, concurrency=None, ordered=True):
+    """
+    批量模式：并发将多个问题转换为命令，结果以JSONL写到标准输出，从不执行命令。
+    参数:
+        source: 输入文件路径，"-" 表示标准输入
+        shell: 默认shell类型(条目中的 shell 字段可覆盖)
+        concurrency: 最大并发请求数，默认读取 BATCH_CONCURRENCY
+        ordered: 是否按输入顺序输出
+    返回:
+        失败的条目数
+    """
+    if concurrency is None:
+        concurrency = os.getenv("BATCH_CONCURRENCY", "8")
     try:
-        max_tokens = int(os.getenv("MODEL_MAX_TOKENS", "2048"))
+        concurrency = int(concurrency)
     except ValueError:
-        print(colored(f"警告：.env 文件中的 MODEL_MAX_TOKENS ('{os.getenv('MODEL_MAX_TOKENS')}') 不是有效的整数，将使用默认值 2048。", "yellow"))
-        max_tokens = 2048
-        
-    response = client.chat(
-        model=model,
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": query}
-        ],
-        temperature=temperature,
-        max_tokens=max_tokens)
-    return response
+        print(colored(f"警告：并发数 ('{concurrency}') 不是有效的整数，将使用默认值 8。", "yellow"), file=sys.stderr)
+        concurrency = 8
+
+    import mmbatch
+    from opensdkmodel import create_model
+    if source == "-":
+        items = mmbatch.read_batch_items(sys.stdin)
+    else:
+        try:
+            with open(source, encoding="utf-8") as f:
+                items = mmbatch.read_batch_items(f)
+        except (OSError, UnicodeDecodeError) as e:
+            print(colored(f"无法读取批量输入文件 '{source}': {e}", "red"), file=sys.stderr)
+            sys.exit(1)
+
+    client = create_model()
+    model, temperature, max_tokens = get_model_params()
+    cache = get_response_cache()
+
+    async def translate(item):
+        if not item["prompt"]:
+            raise ValueError("未指定用户提示。")
+        item_shell = item["shell"] or shell
+        system_prompt = get_system_prompt(item_shell)
+        cache_key = None
+        if cache is not None:
+            cache_key = get_cache_key(item["prompt"], item_shell, system_prompt, (model, temperature, max_tokens))
+            cached = cache.get(cache_key)
+            if cached is not None:
+                return cached
+        response = await client.achat(
+            model=model,
+            messages=build_messages(system_prompt, item["prompt"]),
+            temperature=temperature,
+            max_tokens=max_tokens)
+        if not response or response_is_invalid(response):
+            raise ValueError("无效的模型回复: " + (response or ""))
+        if cache_key is not None:
+            cache.put(cache_key, response)
+        return response
+
+    start = time.perf_counter()
+    failed = mmbatch.run_batch(items, translate, concurrency, ordered)
+    print(f"批量完成: 共 {len(items)} 条, 成功 {len(items) - failed} 条, 失败 {failed} 条, 耗时 {time.perf_counter() - start:.2f} 秒",
+          file=sys.stderr)
+    return failed
+
+def get_command_history():
+    """
+    获取本地命令历史实例，历史被关闭或无法打开时返回None。
+    """
+    global _command_history
+    if not history_enabled or os.getenv("HISTORY", "1").lower() not in ("true", "1"):
+        return None
+    if _command_history is None:
+        import sqlite3
+        import cmdhistory
+        try:
+            _command_history = cmdhistory.CommandHistory(
+                max_entries=int(os.getenv("HISTORY_MAX_ENTRIES", "100000")))
+        except (ValueError, OSError, sqlite3.Error) as e:
+            print(colored(f"警告：无法打开命令历史: {e}", "yellow"))
+            return None
+    return _command_history
+
+def intents_enabled():
+    """
+    是否使用本地意图模板，从.env的 INTENTS 读取，默认开启。
+    """
+    return os.getenv("INTENTS", "1").lower() in ("true", "1")
+
+def get_intents_file():
+    """
+    用户自定义意图的JSON文件，从.env的 INTENTS_FILE 读取，默认为程序目录下的 intents.json
+    """
+    return os.path.expanduser(os.getenv("INTENTS_FILE") or os.path.join(get_executable_dir(), "intents.json"))
+
+def get_intent_matcher():
+    """
+    返回本地意图匹配器，未开启或自定义意图文件无效时返回None
+    """
+    global _intent_matcher
+    if _intent_matcher is None and intents_enabled():
+        try:
+            _intent_matcher = intents.IntentMatcher(user_file=get_intents_file())
+        except (OSError, ValueError, KeyError, TypeError, re.error) as e:
+            print(colored(f"警告：无法加载自定义意图 {get_intents_file()}: {e}", "yellow"))
+            return None
+    return _intent_matcher
+
+def intent_may_match(query):
+    """
+    问题是否可能命中本地意图模板(只做正则匹配，不检测shell)
+    """
+    matcher = get_intent_matcher()
+    if matcher is None or not query:
+        return False
+    with tracer.span("intent_prefilter") as span:
+        span["hit"] = matcher.may_match(query)
+    return span["hit"]
+
+def record_intent_stats(intent_name):
+    """
+    记录意图匹配结果。统计文件在进程退出时一次写入，读写文件不占用生成和执行命令的时间
+    """
+    if not _pending_intent_stats:
+        atexit.register(lambda: intents.IntentStats().record(*_pending_intent_stats))
+    _pending_intent_stats.append(intent_name)
+
+def match_intent_command(query, shell):
+    """
+    在请求模型之前用本地意图模板匹配常见问题(列出文件、磁盘使用、按名称查找等)，不访问网络。
+    返回:
+        模板生成的命令，无法可靠匹配时返回None
+    """
+    matcher = get_intent_matcher()
+    if matcher is None or not query:
+        return None
+    with tracer.span("intent_match") as span:
+        matched = matcher.match(query, shell)
+        span["hit"] = matched is not None
+        if matched is not None:
+            span["intent"] = matched[0]
+    record_intent_stats(matched[0] if matched else None)
+    if matched is None:
+        return None
+    print(colored(f"使用本地意图模板: {matched[0]}", "cyan"))
+    return matched[1]
+
+def print_intent_stats():
+    """
+    打印本地意图模板的命中统计
+    """
+    stats = intents.IntentStats()
+    print(f"统计文件: {stats.path}")
+    print(f"问题数: {stats.data['queries']}，命中: {stats.data['hits']}，命中率: {stats.hit_rate:.1%}")
+    for name, count in sorted(stats.data["by_intent"].items(), key=lambda item: -item[1]):
+        print(f"  {name}: {count}")
+
+def find_history_command(query, shell):
+    """
+    在请求模型之前查找高度相似且执行成功过的历史命令。
+    返回:
+        历史命令，没有匹配时返回None
+    """
+    history = get_command_history()
+    if history is None or not query:
+        return None
+    try:
+        threshold = float(os.getenv("HISTORY_THRESHOLD", "0.8"))
+    except ValueError:
+        threshold = 0.8
+    import sqlite3
+    try:
+        with tracer.span("history_search") as span:
+            matches = history.search(query, shell, get_os_friendly_name())
+            span["hit"] = bool(matches and matches[0][0] >= threshold)
+    except sqlite3.Error:
+        return None
+    if not matches or matches[0][0] < threshold:
+        return None
+    similarity, past_query, command = matches[0]
+    print(colored(f"找到相似的历史命令 (相似度 {similarity:.2f}，原问题: {past_query})", "cyan"))
+    return command
+
+def suggest_command(client, query, shell, ask_flag, history=None, generate_query=None, after_generate=None):
+    """
+    给出命令并询问用户的操作：有高度相似的历史命令时把它作为建议命令(无论安全模式如何都需要确认)，
+    用户可以在同一个提示中选择 [r] 改为请求模型；否则请求模型生成命令。
+    参数:
+        client: 模型客户端
+        query: 用户输入的自然语言
+        shell: shell类型
+        ask_flag: 是否强制询问标志
+        history: 之前的多轮消息，有上下文时问题不能单独理解，不查找历史命令
+        generate_query: 发送给模型的问题，默认为query
+        after_generate: 模型生成命令后、询问用户之前调用的函数
+    返回:
+        (命令, 用户的选择)
+    """
+    command = find_history_command(query, shell) if not history else None
+    from_history = command is not None
+    echoed = False
+    while True:
+        if command is None:
+            echo = StreamEcho() if stream_enabled() else None
+            command, echoed = generate_command(client, generate_query or query, shell, echo=echo, history=history)
+            if after_generate is not None:
+                after_generate()
+        with tracer.span("user_wait"):
+            user_input = prompt_user_for_action(ask_flag, command, echoed=echoed, from_history=from_history)
+        if from_history and user_input.strip().upper() == "R":
+            command, from_history = None, False
+            continue
+        return command, user_input
+
+def record_command_result(query, shell, command, exit_status):
+    """
+    记录命令执行结果：成功的命令写入历史，失败的历史命令不再被推荐。
+    """
+    history = get_command_history()
+    if history is None or not query:
+        return
+    import sqlite3
+    try:
+        if exit_status == 0:
+            history.record(query, shell, get_os_friendly_name(), command, exit_status)
+        else:
+            history.mark_failed(shell, get_os_friendly_name(), command, exit_status)
+    except sqlite3.Error:
+        pass
+
+def invalidate_cached_response(query, shell):
+    """
+    执行失败时删除该问题的缓存回复，避免下次再次返回失败的命令。
+    """
+    cache = get_response_cache()
+    if cache is not None and query:
+        cache.invalidate(get_cache_key(query, shell))
+
+ISSUE_PREFIXES = ("sorry", "i'm sorry", "the question is not clear", "i'm", "i am")
+
+def response_has_issue(response):
+  return response.lower().startswith(ISSUE_PREFIXES)
+
+def response_has_markdown(response):
+  return response.lstrip().startswith("```") or response.count("```",2) > 0
+
+def response_is_invalid(response):
+  return response_has_issue(response) or response_has_markdown(response)
+
+# 已收到的部分回复是否仍可能以错误说明或Markdown代码块开头
+def response_may_become_invalid(partial):
+  lowered = partial.lstrip().lower()
+  return any(prefix.startswith(lowered) for prefix in ISSUE_PREFIXES + ("```",))
+
+def stream_enabled():
+  return os.getenv("STREAM", "0").lower() in ("true", "1")
 
 # 检查响应是否存在问题
 def check_for_issue(response):
-  prefixes = ("sorry", "i'm sorry", "the question is not clear", "i'm", "i am")
-  if response.lower().startswith(prefixes):
+  if response_has_issue(response):
     print(colored("存在错误: "+response, 'red'))
     sys.exit(-1)
 
 # 检查响应是否包含Markdown代码块
 def check_for_markdown(response):
-  if response.count("```",2):
+  if response_has_markdown(response):
     print(colored("响应包含Markdown代码块，因此不直接执行命令: \n", 'red')+response)
     sys.exit(-1)
 
+def copy_to_clipboard(text):
+  import pyperclip
+  pyperclip.copy(text)
+
 # 检查是否缺少POSIX显示环境
 def missing_posix_display():
   return 'DISPLAY' not in os.environ or not os.environ["DISPLAY"]
 
-def prompt_user_for_action(ask_flag, response):
+# from_history: 命令来自相似的历史命令，无论安全模式如何都需要确认，并可选择 [r] 请求模型
+def prompt_user_for_action(ask_flag, response, echoed=False, from_history=False):
   color = os.getenv("SUGGESTED_COMMAND_COLOR", "yellow")
-  print("命令: " + colored(response, color, attrs=['bold']))
+  if not echoed:
+    print("命令: " + colored(response, color, attrs=['bold']))
+  regenerate_snippet = " [r]请求模型" if from_history else ""
   modify_snippet = ""
   if os.getenv("MODIFY", "0").lower() in ("true", "1"):
     modify_snippet = " [m]修改"
@@ -207,15 +883,87 @@ def prompt_user_for_action(ask_flag, response):
   if os.name == "posix" and missing_posix_display():
     if get_os_friendly_name() != "Darwin/macOS":
       copy_to_clipboard_snippet = ""
-  if os.getenv("SAFETY", "1").lower() in ("true", "1") or ask_flag == True:
-    prompt_text = f"执行命令? [Y]是 [n]否{modify_snippet}{copy_to_clipboard_snippet} ==> "
+  if os.getenv("SAFETY", "1").lower() in ("true", "1") or ask_flag == True or from_history:
+    prompt_text = f"执行命令? [Y]是 [n]否{regenerate_snippet}{modify_snippet}{copy_to_clipboard_snippet} ==> "
     print(prompt_text, end = '')
     user_input = input()
     return user_input 
   if os.getenv("SAFETY", "0").lower() in ("false", "0"):
      return "Y"
 
-def execute_command_with_error_handling(client, command, shell, ask_flag, original_query=None, retry_count=0):
+def get_command_timeout():
+    """
+    命令执行超时时间(秒)，从.env的 COMMAND_TIMEOUT 读取，0 表示不限时。
+    """
+    try:
+        return float(os.getenv("COMMAND_TIMEOUT", "30"))
+    except ValueError:
+        print(colored(f"警告：.env 文件中的 COMMAND_TIMEOUT ('{os.getenv('COMMAND_TIMEOUT')}') 不是有效的数字，将使用默认值 30。", "yellow"))
+        return 30.0
+
+def get_error_context_budget():
+    """
+    重试提示中失败输出的token预算，从.env的 ERROR_CONTEXT_TOKENS 读取。
+    """
+    try:
+        return int(os.getenv("ERROR_CONTEXT_TOKENS", "1500"))
+    except ValueError:
+        print(colored(f"警告：.env 文件中的 ERROR_CONTEXT_TOKENS ('{os.getenv('ERROR_CONTEXT_TOKENS')}') 不是有效的整数，将使用默认值 1500。", "yellow"))
+        return 1500
+
+MAX_SHOWN_CANDIDATES = 5  # 最多列出的候选命令数
+
+def get_retry_candidates():
+    """
+    命令失败后每轮并发生成的候选命令数，从.env的 RETRY_CANDIDATES 读取，1 表示只生成一个。
+    """
+    try:
+        return max(1, int(os.getenv("RETRY_CANDIDATES", "1")))
+    except ValueError:
+        print(colored(f"警告：.env 文件中的 RETRY_CANDIDATES ('{os.getenv('RETRY_CANDIDATES')}') 不是有效的整数，将使用默认值 1。", "yellow"))
+        return 1
+
+def generate_retry_candidates(client, error_context, shell, failed_commands, history=None):
+    """
+    并发请求多个候选命令，并在本地按语法、程序是否存在、与失败命令是否重复等规则排序。
+    兼容接口的服务商大多不支持 n 参数，因此使用并行请求。
+    参数:
+        client: OpenAIModel实例
+        error_context: 包含错误信息的重试提示
+        shell: shell类型
+        failed_commands: 之前执行失败的命令
+        history: 之前的多轮消息
+    返回:
+        [(命令, 问题说明列表), ...]，最优的排在最前；模型只返回了空回复时为空列表
+    """
+    count = get_retry_candidates()
+    if count <= 1:
+        response = chat_completion(client, error_context, shell, use_cache=False, history=history)
+        check_for_issue(response)
+        check_for_markdown(response)
+        return cmdcheck.rank_candidates([response] if response and response.strip() else [], shell, failed_commands)
+
+    from concurrent.futures import ThreadPoolExecutor
+    get_model_params()  # 配置有误时只在主线程中提示一次
+    responses, errors = [], []
+    with ThreadPoolExecutor(max_workers=count) as pool:
+        futures = [pool.submit(chat_completion, client, error_context, shell, False, None, history) for _ in range(count)]
+        for future in futures:
+            try:
+                responses.append(future.result())
+            except Exception as e:
+                errors.append(e)
+    if not responses:
+        raise errors[0]
+    valid = [r for r in responses if r and r.strip() and not response_is_invalid(r)]
+    if not valid:
+        # 没有可用的候选时按单个回复的方式提示错误说明或Markdown代码块，全部为空时返回空列表
+        for response in responses:
+            check_for_issue(response)
+            check_for_markdown(response)
+    return cmdcheck.rank_candidates(valid, shell, failed_commands)
+
+def execute_command_with_error_handling(client, command, shell, ask_flag, original_query=None, history=None):
     """
     执行命令并处理错误，如果命令失败则重新生成
     参数:
@@ -224,96 +972,131 @@ def execute_command_with_error_handling(client, command, shell, ask_flag, origin
         shell: shell类型
         ask_flag: 是否强制询问标志
         original_query: 原始用户查询
-        retry_count: 重试次数
+        history: 之前的多轮消息，重新生成命令时一并发送。
+                 有上下文时问题不能单独理解，执行结果不写入历史命令，也不影响响应缓存
+    返回:
+        最后一次执行的结果 {"command", "status", "returncode", "stdout", "stderr"}，未执行时返回None
     """
     max_retries = 2  # 最大重试次数
-    
+    attempts = []  # 所有失败的尝试，用于构造重试提示
+    outcome = None
+    standalone = bool(original_query) and not history
+
     try:
-        print(colored(f"正在执行命令: {command}", "cyan"))
-        
-        if shell == "powershell.exe":
-            result = subprocess.run([shell, "-Command", command], 
-                                  shell=False, capture_output=True, text=True, timeout=30)
-        elif shell == "cmd.exe":
-            result = subprocess.run([shell, "/c", command], 
-                                  shell=False, capture_output=True, text=True, timeout=30)
-        else: 
-            result = subprocess.run([shell, "-c", command], 
-                                  shell=False, capture_output=True, text=True, timeout=30)
-        
-        # 检查命令执行结果
-        if result.returncode == 0:
-            print(colored("命令执行成功！", "green"))
-            if result.stdout.strip():
-                print("输出:")
-                print(result.stdout)
-        else:
+        while True:
+            print(colored(f"正在执行命令: {command}", "cyan"))
+
+            # 输出实时显示在终端上，只保留有界的开头+结尾内容用于重试
+            timeout = get_command_timeout()
+            with tracer.span("execute", attempt=len(attempts) + 1) as span:
+                result = streamexec.run_streaming(streamexec.build_shell_argv(shell, command), timeout=timeout)
+                span.update(returncode=result.returncode, timed_out=result.timed_out)
+            outcome = {"command": command, "status": "failed", "returncode": result.returncode,
+                       "stdout": result.stdout, "stderr": result.stderr}
+
+            # 检查命令执行结果
+            if result.timed_out:
+                print(colored(f"命令执行超时（{timeout:g}秒），已终止。", "red"))
+                outcome["status"] = "timeout"
+                return outcome
+            if result.interrupted:
+                print(colored("\n用户中断了命令执行。", "yellow"))
+                outcome["status"] = "interrupted"
+                return outcome
+            if result.returncode == 0:
+                print(colored("命令执行成功！", "green"))
+                if standalone:
+                    record_command_result(original_query, shell, command, 0)
+                outcome["status"] = "success"
+                return outcome
+
             print(colored(f"命令执行失败，返回码: {result.returncode}", "red"))
-            error_message = result.stderr.strip() if result.stderr else "未知错误"
-            print(colored(f"错误信息: {error_message}", "red"))
-            
+            if not result.stderr.strip():
+                print(colored("错误信息: 未知错误", "red"))
+            attempts.append({
+                "command": command,
+                "returncode": result.returncode,
+                "stdout": result.stdout,
+                "stderr": result.stderr,
+            })
+
+            # 缓存或历史中的命令执行失败，下次不应再直接返回它
+            if standalone and len(attempts) == 1:
+                invalidate_cached_response(original_query, shell)
+                record_command_result(original_query, shell, command, result.returncode)
+
             # 如果有原始查询且重试次数未超限，尝试重新生成命令
-            if original_query and retry_count < max_retries:
-                print(colored(f"\n尝试重新生成命令 (第{retry_count + 1}次重试)...", "yellow"))
-                
-                # 构建包含错误信息和重试历史的新查询
-                retry_hints = [
-                    "请尝试使用不同的参数或方法",
-                    "考虑使用替代命令或工具", 
-                    "请检查命令语法是否正确",
-                    "尝试更简单或更直接的方法",
-                    "考虑分步骤执行任务"
-                ]
-                
-                # 获取完整的错误信息（包括stdout和stderr）
-                full_error = ""
-                if result.stderr:
-                    full_error += f"错误输出: {result.stderr.strip()}\n"
-                if result.stdout:
-                    full_error += f"标准输出: {result.stdout.strip()}\n"
-                if not full_error:
-                    full_error = f"命令返回码: {result.returncode}，无详细错误信息\n"
-                
-                error_context = f"""第{retry_count + 1}次重试：
-之前尝试的命令: '{command}'
-执行结果: 失败
-{full_error}
-原始任务: {original_query}
-
-重要提示: {retry_hints[retry_count % len(retry_hints)]}
-请生成一个完全不同的命令来完成任务，避免重复之前失败的方法。"""
-                
-                # 重新调用模型生成命令
-                new_response = chat_completion(client, error_context, shell)
-                check_for_issue(new_response)
-                check_for_markdown(new_response)
-                
+            if not original_query:
+                return outcome
+            retry_count = len(attempts) - 1
+            if retry_count >= max_retries:
+                print(colored(f"已达到最大重试次数({max_retries})，停止重试。", "red"))
+                return outcome
+            print(colored(f"\n尝试重新生成命令 (第{retry_count + 1}次重试)...", "yellow"))
+
+            # 构建包含错误信息和全部重试历史的新查询，失败输出按token预算截取
+            retry_hints = [
+                "请尝试使用不同的参数或方法",
+                "考虑使用替代命令或工具",
+                "请检查命令语法是否正确",
+                "尝试更简单或更直接的方法",
+                "考虑分步骤执行任务"
+            ]
+            error_context = errorcontext.build_error_context(
+                original_query, attempts, get_error_context_budget(),
+                retry_hints[retry_count % len(retry_hints)])
+
+            # 重新调用模型生成命令，RETRY_CANDIDATES > 1 时并发生成多个候选并在本地排序
+            with tracer.span("generate", reason="retry"):
+                candidates = generate_retry_candidates(
+                    client, error_context, shell, [a["command"] for a in attempts], history)[:MAX_SHOWN_CANDIDATES]
+
+            if not candidates:
+                print(colored("\n模型没有返回可用的命令，停止重试。", "red"))
+                return outcome
+            if len(candidates) == 1:
+                new_response, notes = candidates[0]
                 print(colored(f"\n重新生成的命令: {new_response}", "yellow"))
-                
-                # 检查是否生成了相同的命令
-                if new_response.strip() == command.strip():
-                    print(colored("⚠️  警告: 生成了相同的命令，这可能不会解决问题。", "yellow"))
-                
-                user_choice = input("执行重新生成的命令? [Y]是 [n]否 [c]复制到剪贴板 ==> ").strip()
-                
-                if user_choice.upper() in ["", "Y"]:
-                    return execute_command_with_error_handling(client, new_response, shell, ask_flag, original_query, retry_count + 1)
-                elif user_choice.upper() == "C":
-                    pyperclip.copy(new_response)
-                    print("已将重新生成的命令复制到剪贴板。")
-                    return
+
+                # 本地检查发现的问题，如生成了之前失败过的命令、语法错误、程序不存在
+                if notes:
+                    print(colored(f"⚠️  警告: {'；'.join(notes)}，这可能不会解决问题。", "yellow"))
+
+                with tracer.span("user_wait"):
+                    user_choice = input("执行重新生成的命令? [Y]是 [n]否 [c]复制到剪贴板 ==> ").strip()
+                selected = new_response if user_choice.upper() in ["", "Y"] else None
             else:
-                if retry_count >= max_retries:
-                    print(colored(f"已达到最大重试次数({max_retries})，停止重试。", "red"))
-                    
-    except subprocess.TimeoutExpired:
-        print(colored("命令执行超时（30秒），已终止。", "red"))
+                print(colored("\n重新生成的候选命令(按本地检查结果排序):", "yellow"))
+                for i, (candidate, notes) in enumerate(candidates, 1):
+                    print(colored(f"  [{i}] {candidate}", "yellow"))
+                    if notes:
+                        print(colored(f"      ⚠️  {'；'.join(notes)}", "red"))
+                with tracer.span("user_wait"):
+                    user_choice = input(f"执行哪个命令? [1-{len(candidates)}]选择(默认1) [n]否 [c]复制第一个 ==> ").strip()
+                selected = None
+                if user_choice.upper() in ["", "Y"]:
+                    selected = candidates[0][0]
+                elif user_choice.isdigit() and 1 <= int(user_choice) <= len(candidates):
+                    selected = candidates[int(user_choice) - 1][0]
+                new_response = candidates[0][0]
+
+            if selected is not None:
+                command = selected
+                continue
+            elif user_choice.upper() == "C":
+                copy_to_clipboard(new_response)
+                print("已将重新生成的命令复制到剪贴板。")
+            return outcome
+
     except KeyboardInterrupt:
         print(colored("\n用户中断了命令执行。", "yellow"))
+        if outcome is not None:
+            outcome["status"] = "interrupted"
     except Exception as e:
         print(colored(f"执行命令时发生错误: {e}", "red"))
+    return outcome
 
-def eval_user_intent_and_execute(client, user_input, command, shell, ask_flag, original_query=None):
+def eval_user_intent_and_execute(client, user_input, command, shell, ask_flag, original_query=None, history=None):
     """
     根据用户意图执行相应操作
     参数:
@@ -323,28 +1106,167 @@ def eval_user_intent_and_execute(client, user_input, command, shell, ask_flag, o
         shell: shell类型
         ask_flag: 是否强制询问标志
         original_query: 原始用户查询（用于错误重试）
+        history: 之前的多轮消息(交互模式)
+    返回:
+        执行结果(见 execute_command_with_error_handling)，未执行时返回None
     """
     if user_input.upper() not in ["", "Y", "C", "M"]:
         print("未执行任何操作。")
-        return
+        return None
     if user_input.upper() == "Y" or user_input == "":
-        execute_command_with_error_handling(client, command, shell, ask_flag, original_query)
+        return execute_command_with_error_handling(client, command, shell, ask_flag, original_query, history)
     if os.getenv("MODIFY", "0").lower() in ("true", "1") and user_input.upper() == "M":
       print("修改提示: ", end = '')
       modded_query = input()
-      modded_response = chat_completion(client, modded_query, shell)
-      check_for_issue(modded_response)
-      check_for_markdown(modded_response)
-      user_intent = prompt_user_for_action(ask_flag, modded_response)
+      # 修改后的问题通常是对上一个问题的补充，把原问题和生成的命令作为上下文
+      modded_history = list(history or [])
+      if original_query:
+        modded_history += [{"role": "user", "content": original_query}, {"role": "assistant", "content": command}]
+      echo = StreamEcho() if stream_enabled() else None
+      modded_response, echoed = generate_command(client, modded_query, shell, echo=echo, history=modded_history)
+      user_intent = prompt_user_for_action(ask_flag, modded_response, echoed=echoed)
       print()
-      eval_user_intent_and_execute(client, user_intent, modded_response, shell, ask_flag, modded_query)
+      # 修改后的问题依赖原问题，重试时带上同样的上下文，执行结果也不按修改后的问题单独记录
+      return eval_user_intent_and_execute(client, user_intent, modded_response, shell, ask_flag, modded_query, modded_history)
     if user_input.upper() == "C":
         if os.name == "posix" and missing_posix_display():
           if get_os_friendly_name() != "Darwin/macOS":
             return
-        pyperclip.copy(command) 
+        copy_to_clipboard(command)
         print("已将命令复制到剪贴板。")
 
+def get_session_tokens():
+    """
+    交互模式中历史消息的token预算，从.env的 SESSION_TOKENS 读取，超出时压缩较早的轮次。
+    """
+    try:
+        return max(200, int(os.getenv("SESSION_TOKENS", "2000")))
+    except ValueError:
+        print(colored(f"警告：.env 文件中的 SESSION_TOKENS ('{os.getenv('SESSION_TOKENS')}') 不是有效的整数，将使用默认值 2000。", "yellow"))
+        return 2000
+
+SESSION_EXIT_COMMANDS = ("exit", "quit", "q", "退出")
+
+def run_interactive_mode(client, shell, ask_flag, first_query=""):
+    """
+    交互模式：复用同一个模型客户端连续提问。之前的问题、命令和执行结果作为多轮消息发送，
+    超出 SESSION_TOKENS 时较早的轮次在本地压缩为摘要，每轮的延迟和费用不随会话增长。
+    参数:
+        client: 模型客户端
+        shell: shell类型
+        ask_flag: 是否强制询问标志
+        first_query: 启动时在命令行给出的第一个问题
+    """
+    import mmsession
+    session = mmsession.Session(get_session_tokens())
+    print(colored("mm 交互模式：输入问题生成命令，输入 /reset 清空上下文，输入 exit 或按 Ctrl+D 退出。", "cyan"))
+    query = first_query
+    while True:
+        if not query:
+            try:
+                query = input(colored("mm> ", "cyan")).strip()
+            except (EOFError, KeyboardInterrupt):
+                print()
+                return
+            if not query:
+                continue
+        if query.lower() in SESSION_EXIT_COMMANDS:
+            return
+        if query == "/reset":
+            session.reset()
+            print(colored("已清空会话上下文。", "cyan"))
+            query = ""
+            continue
+        try:
+            with tracer.span("turn", index=len(session.turns) + 1):
+                history, full_query = session.build(query)
+                # 本地意图模板和历史命令与上下文无关，只在会话开始时使用
+                result = match_intent_command(query, shell) if intents_enabled() and not history else None
+                if result is None:
+                    result, users_intent = suggest_command(client, query, shell, ask_flag, history=history,
+                                                           generate_query=full_query)
+                else:
+                    with tracer.span("user_wait"):
+                        users_intent = prompt_user_for_action(ask_flag, result)
+                print()
+                outcome = eval_user_intent_and_execute(client, users_intent, result, shell, ask_flag, query, history)
+            session.add_turn(query, outcome["command"] if outcome else result, outcome)
+        except KeyboardInterrupt:
+            print()
+        except SystemExit:
+            # 模型返回了错误说明或Markdown，已打印原因，继续下一个问题
+            pass
+        query = ""
+
+def run_fanout_mode(client, targets_spec, shell, ask_flag, query, concurrency=None):
+    """
+    并发执行模式：只生成并确认一次命令，然后以有限并发在所有目标上执行，
+    输出按目标加前缀实时显示，最后汇总成功和失败的目标。
+    目标默认是本地目录；配置 FANOUT_WRAPPER (如 "ssh {target} {command}") 后通过包装命令在远程执行。
+    参数:
+        client: 模型客户端
+        targets_spec: 目标文件、逗号分隔的目标列表或目录通配符
+        shell: shell类型
+        ask_flag: 是否强制询问标志
+        query: 用户问题
+        concurrency: 最大并发数，默认读取 FANOUT_CONCURRENCY
+    返回:
+        失败的目标数
+    """
+    import fanout
+    targets = fanout.read_targets(targets_spec)
+    if not targets:
+        print(colored(f"没有找到目标: {targets_spec}", "red"))
+        return 1
+    if concurrency is None:
+        concurrency = os.getenv("FANOUT_CONCURRENCY", "8")
+    try:
+        concurrency = max(1, int(concurrency))
+    except ValueError:
+        print(colored(f"警告：并发数 ('{concurrency}') 不是有效的整数，将使用默认值 8。", "yellow"))
+        concurrency = 8
+    wrapper = os.getenv("FANOUT_WRAPPER") or None
+
+    preview = ", ".join(targets[:5]) + (f" 等 {len(targets)} 个" if len(targets) > 5 else "")
+    print(colored(f"将在 {len(targets)} 个{'目标' if wrapper else '目录'}上执行 (最大并发 {concurrency}): {preview}", "cyan"))
+    # 在多个目标上执行，无论安全模式如何都需要确认
+    result = match_intent_command(query, shell) if intents_enabled() else None
+    if result is None:
+        result, users_intent = suggest_command(client, query, shell, True)
+    else:
+        with tracer.span("user_wait"):
+            users_intent = prompt_user_for_action(True, result)
+    print()
+    if users_intent.upper() == "C":
+        eval_user_intent_and_execute(client, users_intent, result, shell, ask_flag)
+        return 0
+    if users_intent.upper() not in ("", "Y"):
+        print("未执行任何操作。")
+        return 0
+
+    print(colored(f"正在执行命令: {result}", "cyan"))
+    start = time.perf_counter()
+    try:
+        with tracer.span("fanout", targets=len(targets), concurrency=concurrency) as span:
+            results = fanout.run_fanout(shell, result, targets, concurrency, get_command_timeout(), wrapper)
+            failed = sum(1 for r in results if not r.ok)
+            span["failed"] = failed
+    except KeyboardInterrupt:
+        # 各目标的子进程已由 run_fanout 中断
+        print(colored("\n用户中断了命令执行。", "yellow"))
+        return len(targets)
+    summary = fanout.format_summary(results, time.perf_counter() - start)
+    print(colored(summary, "green" if not failed else "yellow" if failed < len(results) else "red"))
+
+    # 所有目标都成功时记入历史；全部失败说明命令本身有问题，不应再从缓存或历史返回
+    if not failed:
+        record_command_result(query, shell, result, 0)
+    elif failed == len(results):
+        invalidate_cached_response(query, shell)
+        first = next((r for r in results if r.result is not None), None)
+        record_command_result(query, shell, result, first.result.returncode if first else 1)
+    return failed
+
 def get_executable_dir():
     """获取可执行文件或脚本所在的目录。"""
     if getattr(sys, 'frozen', False) and hasattr(sys, '_MEIPASS'):
@@ -355,31 +1277,22 @@ def get_executable_dir():
         # 直接运行 .py 脚本
         return os.path.dirname(os.path.abspath(__file__))
 
-# 优先从可执行文件/脚本所在目录加载 .env
-executable_dir = get_executable_dir()
-env_path_executable_dir = os.path.join(executable_dir, '.env')
-
-if os.path.exists(env_path_executable_dir):
-    load_dotenv(dotenv_path=env_path_executable_dir)
-    # print(colored(f"[DEBUG] Loaded .env from: {env_path_executable_dir}", "magenta")) # 调试信息
-    # 在这里也需要初始化 client 和 shell，如果 .env 在可执行文件目录找到
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key or api_key == "sk-xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx":
-        print(colored("错误: OPENAI_API_KEY 未配置或使用的是示例值。", "red"))
-        print(colored("请在程序运行目录下创建或修改 .env 文件, 并正确配置您的 OPENAI_API_KEY。", "red"))
-        print(colored("您可以参考项目中的 .env.example 文件获取配置模板。", "yellow"))
-        if __name__ == "__main__":
-             sys.exit(1)
-        else:
-            raise EnvironmentError("OPENAI_API_KEY not configured correctly.")
-    client = OpenAIModel()
-    shell = get_current_shell()
-elif __name__ == "__main__": # 只有在直接运行时，如果可执行文件目录没有.env，才尝试从CWD加载并执行后续逻辑
-    # 如果可执行文件/脚本目录没有 .env，则尝试从当前工作目录加载（兼容旧行为）
-    load_dotenv() # 这里也需要 load_dotenv
-    # print(colored(f"[DEBUG] .env not found in executable directory, attempting load from CWD.", "magenta")) # 调试信息
+def load_env():
+    """
+    加载 .env 配置：优先从可执行文件/脚本所在目录加载，
+    找不到时从当前工作目录(及其上级目录)加载（兼容旧行为）。
+    """
+    from dotenv import load_dotenv, find_dotenv
+    env_path_executable_dir = os.path.join(get_executable_dir(), '.env')
+    if os.path.exists(env_path_executable_dir):
+        load_dotenv(dotenv_path=env_path_executable_dir)
+    else:
+        load_dotenv(find_dotenv(usecwd=True))
 
-    # 检查 OPENAI_API_KEY 是否已配置
+def check_api_key():
+    """
+    检查 OPENAI_API_KEY 是否已配置，未配置时提示并退出。
+    """
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key or api_key == "sk-xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx":
         print(colored("错误: OPENAI_API_KEY 未配置或使用的是示例值。", "red"))
@@ -387,80 +1300,96 @@ elif __name__ == "__main__": # 只有在直接运行时，如果可执行文件
         print(colored("您可以参考项目中的 .env.example 文件获取配置模板。", "yellow"))
         sys.exit(1)
 
-    client = OpenAIModel()
-    shell = get_current_shell() # 默认为 powershell.exe
-    command_start_idx = 1     # 问题参数从哪个argv索引开始
-    ask_flag = False           # 安全开关-a命令行参数
-    if len(sys.argv) < 2:
+def finish_trace(profile, trace_file=None):
+    """
+    运行结束时输出跟踪记录：--profile 打印耗时分解，TRACE_FILE 追加一行JSON
+    """
+    tracer.set(model=os.getenv("MODEL_NAME"), daemon=daemon_enabled())
+    if _environment is not None:
+        tracer.set(shell=_environment.get("shell"), os=_environment.get("os_name"))
+    if _client is not None and getattr(_client, "prewarm_stats", None):
+        tracer.set(**{f"prewarm_{k}_ms": round(v, 1) for k, v in _client.prewarm_stats.items()})
+    if trace_file:
+        tracer.write_jsonl(trace_file)
+    if profile:
+        print(colored("\n各阶段耗时 (user_wait 为等待用户输入的时间):", "cyan"), file=sys.stderr)
+        print(colored(tracer.report(), "cyan"), file=sys.stderr)
+
+def main(argv):
+    """
+    命令行入口
+    参数:
+        argv: 不含程序名的参数列表
+    """
+    global response_cache_enabled, history_enabled, _client
+    main_start = time.perf_counter()
+    if platform.system() == "Windows":
+        from colorama import init
+        init() # 确保 colorama 初始化
+    load_env()
+    env_loaded = time.perf_counter()
+
+    if len(argv) < 1 or argv[0] in ("-h", "--help"):
         print_usage()
-        sys.exit(1)
-    if sys.argv[1] == "-a":
-        ask_flag = True
-        command_start_idx = 2
-    arguments = sys.argv[command_start_idx:]
-    user_prompt = " ".join(arguments)
-    
-    # 确保 client 和 shell 在此作用域内有效
-    # 注意：client 和 shell 的初始化可能依赖于 .env 文件加载后的配置
-    # 因此，如果它们在全局作用域定义并依赖配置，需要确保配置已加载
-    # 这段逻辑在回退后，如果client和shell在上面分支已初始化，这里就不需要了
-    # if 'client' not in globals() or 'shell' not in globals():
-    #     # 重新获取配置，确保 client 和 shell 初始化
-    #     api_key = os.getenv("OPENAI_API_KEY")
-    #     if not api_key or api_key == "sk-xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx":
-    #         print(colored("错误: OPENAI_API_KEY 未配置或使用的是示例值 (在 __main__ 中检查)。", "red"))
-    #         sys.exit(1)
-    #     client = OpenAIModel() # 重新初始化 client
-    #     shell = os.environ.get("SHELL", "powershell.exe") # 重新获取 shell
-
-    result = chat_completion(client, user_prompt, shell)
-    check_for_issue(result)
-    check_for_markdown(result)
-    users_intent = prompt_user_for_action(ask_flag, result)
+        sys.exit(0 if argv else -1)
+    options, user_prompt = parse_args(argv)
+    ask_flag = options["ask"]  # 安全开关-a命令行参数
+    response_cache_enabled = not options["no_cache"]
+    history_enabled = not options["no_history"]
+    if options["stream"]:
+        os.environ["STREAM"] = "1"
+    if options["timeout"] is not None:
+        os.environ["COMMAND_TIMEOUT"] = options["timeout"]
+    trace_file = os.getenv("TRACE_FILE")
+    if options["profile"] or trace_file:
+        # 导入和.env加载发生在解析参数之前，事后补记
+        tracer.enabled = True
+        tracer.add_span("import", tracer.start, main_start)
+        tracer.add_span("load_env", main_start, env_loaded)
+        atexit.register(finish_trace, options["profile"], trace_file)
+    if handle_service_options(options):
+        sys.exit(0)
+
+    check_api_key()
+    if options["batch"] is not None:
+        failed = run_batch_mode(options["batch"], get_current_shell(), options["concurrency"], not options["unordered"])
+        sys.exit(1 if failed else 0)
+    if options["interactive"]:
+        # 整个会话复用同一个客户端及其连接
+        client = _client = create_client()
+        start_prewarm(client)
+        run_interactive_mode(client, get_current_shell(), ask_flag, user_prompt)
+        sys.exit(0)
+    if options["fanout"] is not None:
+        client = _client = create_client()
+        start_prewarm(client)
+        failed = run_fanout_mode(client, options["fanout"], get_current_shell(), ask_flag, user_prompt,
+                                 options["concurrency"])
+        sys.exit(1 if failed else 0)
+    # 常见问题由本地意图模板直接给出命令，此时不预连接(命令执行失败需要重试时才访问网络)。
+    # 先只做不依赖shell的正则匹配：不可能命中的问题在配置已知后立即在后台建立连接，
+    # 与下面的shell检测、系统提示词生成等本地准备工作重叠；可能命中时等模板匹配的结果再决定
+    intent_candidate = intents_enabled() and intent_may_match(user_prompt)
+    if intents_enabled() and not intent_candidate:
+        record_intent_stats(None)
+    client = _client = create_client()
+    if not intent_candidate:
+        start_prewarm(client)
+    shell = get_current_shell()
+    result = match_intent_command(user_prompt, shell) if intent_candidate else None
+    if result is None and intent_candidate:
+        start_prewarm(client)
+
+    if result is None:
+        # 高度相似且执行成功过的历史命令无需请求模型
+        result, users_intent = suggest_command(
+            client, user_prompt, shell, ask_flag,
+            after_generate=(lambda: print_prewarm_timing(client)) if options["timing"] else None)
+    else:
+        with tracer.span("user_wait"):
+            users_intent = prompt_user_for_action(ask_flag, result)
     print()
-    eval_user_intent_and_execute(client, users_intent, result, shell, ask_flag)
+    eval_user_intent_and_execute(client, users_intent, result, shell, ask_flag, user_prompt)
 
 if __name__ == "__main__":
-  init() # 确保 colorama 初始化
-  # 主要逻辑移到上面的 elif __name__ == "__main__" 分支中
-  # 如果 env_path_executable_dir 存在，则 client 和 shell 已经在 if 分支中初始化
-  # 如果不存在，则在 elif __name__ == "__main__" 分支中初始化并执行
-  # 这里保留是为了确保脚本直接执行时，上面的逻辑能被触发
-  # 如果脚本作为模块导入，则 __main__ 块不会执行，上面的全局 client 和 shell 初始化也不会发生
-  # 这是一个稍微复杂的控制流，需要仔细考虑导入和直接执行的场景
-  # 简单的回退到上一个版本，可能就是将 client 和 shell 的定义放回 __main__ 块内，
-  # 并在 load_dotenv() 之后。
-
-  # --- 开始回退到更接近上一个版本的结构 ---
-  # 确保 load_dotenv 已经被调用 (在文件顶部附近)
-
-  # 检查 OPENAI_API_KEY 是否已配置 (这部分逻辑可能需要调整到 main 函数或全局配置加载后)
-  api_key = os.getenv("OPENAI_API_KEY")
-  if not api_key or api_key == "sk-xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx":
-      print(colored("错误: OPENAI_API_KEY 未配置或使用的是示例值。", "red"))
-      print(colored("请在程序运行目录下创建或修改 .env 文件, 并正确配置您的 OPENAI_API_KEY。", "red"))
-      print(colored("您可以参考项目中的 .env.example 文件获取配置模板。", "yellow"))
-      sys.exit(1)
-
-  client = OpenAIModel()
-  shell = get_current_shell()
-  # --- 结束回退 --- 
-
-  command_start_idx = 1     # 问题参数从哪个argv索引开始
-  ask_flag = False           # 安全开关-a命令行参数
-  if len(sys.argv) < 2:
-      print_usage()
-      sys.exit(-1)
-  if sys.argv[1] == "-a":
-      ask_flag = True
-      command_start_idx = 2
-  arguments = sys.argv[command_start_idx:]
-  user_prompt = " ".join(arguments)
-  
-  result = chat_completion(client, user_prompt, shell)
-  check_for_issue(result)
-  check_for_markdown(result)
-  users_intent = prompt_user_for_action(ask_flag, result)
-  print()
-  eval_user_intent_and_execute(client, users_intent, result, shell, ask_flag, user_prompt)
-  
\ No newline at end of file
+    main(sys.argv[1:])
@@ -0,0 +1,87 @@
+import json
+import sys
+
+
+def read_batch_items(stream):
+    """
+    读取批量输入，每行一个问题。
+    行可以是纯文本，也可以是JSON对象：问题取自 prompt/query/title 字段，
+    编号取自 id/request_id 字段(缺省为行号)，可选的 shell 字段覆盖当前shell。
+    参数:
+        stream: 文本输入流
+    返回:
+        [{"id": ..., "prompt": ..., "shell": ...}, ...]
+    """
+    items = []
+    for line_no, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        item = {"id": line_no, "prompt": line, "shell": None}
+        if line.startswith("{"):
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            if isinstance(record, dict):
+                item["id"] = record.get("id", record.get("request_id", line_no))
+                item["prompt"] = record.get("prompt") or record.get("query") or record.get("title") or ""
+                item["shell"] = record.get("shell")
+        items.append(item)
+    return items
+
+
+def write_record(out, record):
+    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+    out.flush()
+
+
+async def _run(items, translate, concurrency, ordered, out):
+    import asyncio
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    results = [None] * len(items)
+    next_to_write = 0
+    failed = 0
+
+    async def worker(index, item):
+        async with semaphore:
+            record = {"id": item["id"], "prompt": item["prompt"]}
+            try:
+                record["command"] = await translate(item)
+            except Exception as e:
+                record["error"] = str(e)
+            return index, record
+
+    tasks = [asyncio.ensure_future(worker(i, item)) for i, item in enumerate(items)]
+    for finished in asyncio.as_completed(tasks):
+        index, record = await finished
+        if "error" in record:
+            failed += 1
+        if not ordered:
+            write_record(out, record)
+            continue
+        # 按输入顺序输出：已完成的连续前缀立即写出，不必等待全部完成
+        results[index] = record
+        while next_to_write < len(results) and results[next_to_write] is not None:
+            write_record(out, results[next_to_write])
+            results[next_to_write] = None
+            next_to_write += 1
+    return failed
+
+
+def run_batch(items, translate, concurrency=8, ordered=True, out=None):
+    """
+    以有限并发批量翻译问题，结果以JSONL写出，从不执行命令。
+    每行输出 {"id", "prompt", "command"}，失败时以 "error" 代替 "command"。
+    参数:
+        items: read_batch_items() 返回的列表
+        translate: 协程函数，参数为单个item，返回生成的命令，失败时抛出异常
+        concurrency: 同时进行的请求数上限
+        ordered: True按输入顺序输出；False按完成顺序输出(通过id对应)
+        out: 输出流，默认标准输出
+    返回:
+        失败的条目数
+    """
+    # asyncio 导入较慢，只在批量模式下才导入
+    import asyncio
+    return asyncio.run(_run(items, translate, concurrency, ordered, out or sys.stdout))
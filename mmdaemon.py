@@ -0,0 +1,325 @@
+import hashlib
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+
+import ratelimit
+from cachedir import get_cache_dir
+from tracing import tracer
+
+
+def daemon_supported():
+    """Unix域套接字不可用的平台(如旧版Windows)不支持守护进程模式。"""
+    return hasattr(socket, "AF_UNIX")
+
+
+def get_socket_path():
+    """
+    获取守护进程监听的Unix域套接字路径，可通过 MM_DAEMON_SOCKET 覆盖。
+    """
+    path = os.getenv("MM_DAEMON_SOCKET")
+    if path:
+        return path
+    runtime_dir = os.getenv("XDG_RUNTIME_DIR")
+    if runtime_dir and os.path.isdir(runtime_dir):
+        return os.path.join(runtime_dir, "mm.sock")
+    return os.path.join(get_cache_dir(), "mm.sock")
+
+
+def config_fingerprint():
+    """
+    根据API相关配置生成指纹，客户端与守护进程配置不一致时不使用守护进程。
+    """
+    names = ("OPENAI_API_KEY", "OPENAI_API_BASE", "MODEL_NAME", "HEDGE_DELAY_MS",
+             "RATE_LIMIT_RPM", "RATE_LIMIT_TPM", "RATE_LIMIT_RETRIES")
+    material = "\0".join(os.getenv(name, "") for name in names)
+    if os.getenv("FALLBACK_ENDPOINTS"):
+        # 备用端点的密钥来自其他环境变量，按解析后的结果计入。
+        # 客户端只在需要时才导入 opensdkmodel，守护进程模式下 mm 不加载 openai 等模块
+        from opensdkmodel import parse_endpoints
+        material += "\0" + repr(parse_endpoints(os.getenv("FALLBACK_ENDPOINTS")))
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def _send(wfile, message):
+    wfile.write((json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8"))
+    wfile.flush()
+
+
+class DaemonHandler(socketserver.StreamRequestHandler):
+    """
+    处理单个客户端请求：每行一个JSON消息。
+    流式请求以 {"token": ...} 逐段返回，最后以 {"content": ...} 或 {"error": ...} 结束；
+    限流等待的提示以 {"notice": ...} 转发给客户端显示。429 错误附带 "status" 和 "retry_after"。
+    """
+    def handle(self):
+        self.server.touch()
+        try:
+            request = json.loads(self.rfile.readline())
+        except ValueError:
+            return
+        if request.get("command") == "ping":
+            _send(self.wfile, {"pong": os.getpid(), "fingerprint": self.server.fingerprint})
+            return
+        if request.get("command") == "shutdown":
+            _send(self.wfile, {"ok": True})
+            threading.Thread(target=self.server.shutdown, daemon=True).start()
+            return
+        if request.get("fingerprint") != self.server.fingerprint:
+            _send(self.wfile, {"error": "配置与守护进程不一致"})
+            return
+        # 对冲请求的工作线程也会发送提示，写入需要加锁
+        lock = threading.Lock()
+
+        def send(message):
+            with lock:
+                _send(self.wfile, message)
+
+        try:
+            stream = bool(request.get("stream"))
+            with ratelimit.redirect_notices(lambda text: send({"notice": text})):
+                content = self.server.model.chat(
+                    messages=request["messages"],
+                    model=request.get("model"),
+                    temperature=request.get("temperature", 0.7),
+                    max_tokens=request.get("max_tokens", 2048),
+                    stream=stream,
+                    on_token=(lambda delta: send({"token": delta})) if stream else None)
+            send({"content": content})
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端已取消(例如检测到无效回复)，流在 chat() 中已被关闭
+            pass
+        except Exception as e:
+            reply = {"error": str(e)}
+            if ratelimit.is_rate_limited(e):
+                reply.update(status=429, retry_after=ratelimit.retry_after_seconds(e))
+            try:
+                send(reply)
+            except OSError:
+                pass
+        finally:
+            self.server.touch()
+
+
+class MMDaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    常驻的mm守护进程，持有预热的OpenAIModel(及其HTTP连接池)，空闲超时后自动退出。
+    """
+    daemon_threads = True
+
+    def __init__(self, socket_path, model, idle_timeout=1800):
+        self.model = model
+        self.fingerprint = config_fingerprint()
+        self.idle_timeout = idle_timeout
+        self.last_active = time.monotonic()
+        old_umask = os.umask(0o177)  # 套接字仅当前用户可访问
+        try:
+            super().__init__(socket_path, DaemonHandler)
+        finally:
+            os.umask(old_umask)
+
+    def touch(self):
+        self.last_active = time.monotonic()
+
+    def service_actions(self):
+        if self.idle_timeout > 0 and time.monotonic() - self.last_active > self.idle_timeout:
+            threading.Thread(target=self.shutdown, daemon=True).start()
+
+
+def ping_daemon(socket_path=None, timeout=1):
+    """
+    向守护进程发送ping。
+    返回:
+        守护进程的回复字典，未运行时返回None
+    """
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(socket_path or get_socket_path())
+            sock.sendall(b'{"command": "ping"}\n')
+            with sock.makefile("rb") as rfile:
+                return json.loads(rfile.readline())
+    except (OSError, ValueError):
+        return None
+
+
+def daemon_running(socket_path=None):
+    """检查守护进程是否正在监听。"""
+    return ping_daemon(socket_path) is not None
+
+
+def _try_lock(path):
+    """
+    以非阻塞方式获取排他文件锁。
+    返回:
+        持有锁的文件对象(关闭即释放)，锁已被其他进程持有时返回None
+    """
+    f = open(path, "a+b")
+    try:
+        if os.name == "nt":
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return f
+    except OSError:
+        f.close()
+        return None
+
+
+def _wait_for_lock(socket_path, timeout=5):
+    """
+    获取套接字旁的锁文件。锁被配置不同的旧守护进程持有时(它已被要求退出，
+    最多需要一个轮询周期)等待其退出；已有配置相同的守护进程在运行时立即放弃。
+    返回:
+        持有锁的文件对象，未能获取时返回None
+    """
+    fingerprint = config_fingerprint()
+    deadline = time.monotonic() + timeout
+    while True:
+        lock = _try_lock(socket_path + ".lock")
+        if lock is not None:
+            return lock
+        reply = ping_daemon(socket_path)
+        if (reply is not None and reply.get("fingerprint") == fingerprint) or time.monotonic() >= deadline:
+            return None
+        time.sleep(0.1)
+
+
+def run_daemon(model, idle_timeout=1800):
+    """
+    在前台运行守护进程，直到收到停止请求或空闲超时。
+    同时启动的多个守护进程通过套接字旁的锁文件保证只有一个监听，其余立即退出，
+    因此不会删除正在监听的守护进程的套接字。配置变化后旧守护进程仍在退出时，等待它释放锁。
+    参数:
+        model: 预先构造好的OpenAIModel实例
+        idle_timeout: 空闲多少秒后自动退出，<=0 表示不退出
+    """
+    socket_path = get_socket_path()
+    lock = _wait_for_lock(socket_path)
+    if lock is None or daemon_running(socket_path):
+        print("mm 守护进程已在运行: " + socket_path)
+        if lock is not None:
+            lock.close()
+        return
+    try:
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)  # 上次异常退出遗留的套接字文件
+        server = MMDaemonServer(socket_path, model, idle_timeout)
+        print("mm 守护进程已启动，监听: " + socket_path)
+        try:
+            server.serve_forever(poll_interval=1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+    finally:
+        lock.close()
+
+
+def stop_daemon():
+    """
+    请求正在运行的守护进程退出。
+    返回:
+        守护进程是否在运行
+    """
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(5)
+            sock.connect(get_socket_path())
+            sock.sendall(b'{"command": "shutdown"}\n')
+            sock.recv(4096)
+        return True
+    except OSError:
+        return False
+
+
+def spawn_daemon():
+    """
+    在后台启动守护进程(不等待其就绪)，供后续调用复用。
+    多个mm同时调用时可能各自启动一个，多余的会因拿不到锁而退出(见 run_daemon)。
+    """
+    import subprocess
+    if getattr(sys, "frozen", False):
+        argv = [sys.executable, "--daemon"]
+    else:
+        argv = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "mm.py"), "--daemon"]
+    subprocess.Popen(argv, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                     stderr=subprocess.DEVNULL, start_new_session=True, close_fds=True)
+
+
+class DaemonModel:
+    """
+    守护进程客户端，接口与 OpenAIModel.chat() 相同，请求转发给守护进程中已预热的模型。
+    """
+    def __init__(self, socket_path=None, connect_timeout=0.5):
+        """
+        参数:
+            socket_path: 守护进程套接字路径，默认由 get_socket_path() 决定
+            connect_timeout: 连接超时(秒)
+        异常:
+            OSError: 守护进程未运行、无法连接或其配置与当前.env不一致
+        """
+        self.socket_path = socket_path or get_socket_path()
+        self.connect_timeout = connect_timeout
+        self.fingerprint = config_fingerprint()
+        # 构造时先确认守护进程可用，不可用时由调用方回退到本地模型
+        reply = ping_daemon(self.socket_path, connect_timeout)
+        if reply is None:
+            raise ConnectionRefusedError("mm daemon is not running: " + self.socket_path)
+        if reply.get("fingerprint") != self.fingerprint:
+            # .env已修改，停止旧的守护进程以便按新配置重新启动
+            stop_daemon()
+            raise ConnectionRefusedError("mm daemon was started with a different configuration")
+
+    def chat(self, messages, model=None, temperature=0.7, max_tokens=2048, stream=False, on_token=None, should_abort=None):
+        """
+        参数与返回值同 OpenAIModel.chat()。
+        should_abort 返回True时关闭连接，守护进程随即取消生成。
+        """
+        request = {
+            "fingerprint": self.fingerprint,
+            "messages": messages,
+            "model": model,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stream": stream,
+        }
+        content = ""
+        with tracer.span("daemon.chat", model=model, stream=stream) as span, \
+                socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            start = time.perf_counter()
+            sock.settimeout(self.connect_timeout)
+            sock.connect(self.socket_path)
+            sock.settimeout(None)
+            sock.sendall((json.dumps(request, ensure_ascii=False) + "\n").encode("utf-8"))
+            with sock.makefile("rb") as rfile:
+                for line in rfile:
+                    message = json.loads(line)
+                    if "token" in message:
+                        if not content:
+                            span["ttft_ms"] = round((time.perf_counter() - start) * 1000, 1)
+                            tracer.event("first_token")
+                        content += message["token"]
+                        if should_abort and should_abort(content):
+                            span["aborted"] = True
+                            return content
+                        if on_token:
+                            on_token(message["token"])
+                    elif "notice" in message:
+                        ratelimit.show_notice(message["notice"])
+                    elif "content" in message:
+                        return message["content"]
+                    elif "error" in message:
+                        if message.get("status") == 429:
+                            raise ratelimit.RateLimitExceeded(message["error"], message.get("retry_after"))
+                        raise RuntimeError("mm daemon: " + message["error"])
+        raise ConnectionError("mm daemon closed the connection unexpectedly")
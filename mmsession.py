@@ -0,0 +1,111 @@
+from errorcontext import estimate_tokens, last_error_line
+
+MAX_TURN_CHARS = 400  # 问题和命令保留的最大字符数
+MAX_SUMMARY_LINE_CHARS = 200  # 摘要中每轮的最大字符数
+
+
+def _clip(text, limit):
+    return text if len(text) <= limit else text[:limit] + "..."
+
+
+def describe_outcome(outcome):
+    """
+    把命令的执行结果描述为一行文字
+    参数:
+        outcome: 执行结果字典(status、returncode、stdout、stderr)，None 表示未执行
+    """
+    if outcome is None:
+        return "未执行"
+    status = outcome.get("status")
+    if status == "success":
+        return "执行成功"
+    if status == "timeout":
+        return "执行超时"
+    if status == "interrupted":
+        return "被用户中断"
+    return f"执行失败 (返回码 {outcome.get('returncode')}): {last_error_line(outcome)}"
+
+
+class Session:
+    """
+    交互模式的会话上下文：记录之前的问题、命令和执行结果，以多轮消息发送给模型。
+    超出token预算时把最早的若干轮在本地压缩为一行一轮的摘要(不额外请求模型)，
+    摘要本身也超出预算时丢弃最早的行，因此每轮的请求长度不会随会话增长。
+    一次压缩较多的轮次，使两次压缩之间消息的前缀保持不变，便于服务端的提示词缓存命中。
+    """
+    def __init__(self, budget_tokens=2000):
+        """
+        参数:
+            budget_tokens: 历史消息(不含系统提示词和当前问题)的token预算
+        """
+        self.budget_tokens = max(200, budget_tokens)
+        self.turns = []
+        self.summary = []
+        self.dropped = 0
+
+    def add_turn(self, query, command, outcome=None):
+        """
+        记录一轮对话
+        参数:
+            query: 用户问题
+            command: 最终使用的命令
+            outcome: 执行结果字典，None 表示未执行
+        """
+        self.turns.append({"query": _clip(query, MAX_TURN_CHARS), "command": _clip(command, MAX_TURN_CHARS),
+                           "outcome": describe_outcome(outcome)})
+        self._compact()
+
+    def _turn_tokens(self, turn):
+        return estimate_tokens(turn["query"]) + estimate_tokens(turn["command"]) + estimate_tokens(turn["outcome"]) + 16
+
+    def _summary_tokens(self):
+        return sum(estimate_tokens(line) + 1 for line in self.summary)
+
+    def _compact(self):
+        if sum(self._turn_tokens(t) for t in self.turns) + self._summary_tokens() <= self.budget_tokens:
+            return
+        # 保留的原文不超过预算的一半，其余压缩为摘要
+        kept = []
+        used = 0
+        for turn in reversed(self.turns):
+            used += self._turn_tokens(turn)
+            if kept and used > self.budget_tokens // 2:
+                break
+            kept.append(turn)
+        kept.reverse()
+        for turn in self.turns[:len(self.turns) - len(kept)]:
+            self.summary.append(_clip(f"{turn['query']} => {turn['command']} ({turn['outcome']})",
+                                      MAX_SUMMARY_LINE_CHARS))
+        self.turns = kept
+        while self.summary and self._summary_tokens() > self.budget_tokens // 4:
+            self.summary.pop(0)
+            self.dropped += 1
+
+    def _summary_text(self):
+        lines = []
+        if self.dropped:
+            lines.append(f"(更早的 {self.dropped} 轮已省略)")
+        lines.extend(f"- {line}" for line in self.summary)
+        return "之前的会话摘要 (问题 => 命令 (执行结果)):\n" + "\n".join(lines)
+
+    def build(self, query):
+        """
+        构造发送给模型的多轮消息。
+        上一轮的执行结果放在下一条用户消息的开头，使用户和助手的消息严格交替。
+        参数:
+            query: 当前问题
+        返回:
+            (之前的消息列表, 当前问题的完整内容)
+        """
+        history = []
+        prefix = self._summary_text() + "\n\n" if self.summary or self.dropped else ""
+        for turn in self.turns:
+            history.append({"role": "user", "content": prefix + turn["query"]})
+            history.append({"role": "assistant", "content": turn["command"]})
+            prefix = f"(上一条命令{turn['outcome']})\n"
+        return history, prefix + query
+
+    def reset(self):
+        self.turns = []
+        self.summary = []
+        self.dropped = 0
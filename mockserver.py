@@ -0,0 +1,236 @@
+"""
+本地的 OpenAI 兼容模拟服务，用于在无网络、无费用的情况下测试和基准测试 mm。
+
+支持 /v1/chat/completions (流式和非流式)，可配置首字节延迟、流式输出速率和错误注入(如 429、500)。
+部分初始回复可以是执行必定失败的命令，用于测量失败重试；重试请求总是得到成功的命令。
+
+用法: python mockserver.py [--port 8765] [--latency-ms 200] [--tokens-per-sec 50]
+                         [--error-rate 0.1] [--error-status 429] [--fail-rate 0.2] [--reply "ls -la"]
+然后在 .env 中设置 OPENAI_API_BASE=http://127.0.0.1:8765/v1
+"""
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_REPLY = "ls -la"
+SUCCESS_REPLY = "true"  # 重试请求的回复，必定执行成功
+FAILING_REPLY = "ls /nonexistent-mm-benchmark"  # 注入的失败命令，执行时返回非零值
+CHARS_PER_TOKEN = 4  # 流式输出时每个片段的字符数
+
+
+class MockConfig:
+    """
+    模拟服务的行为配置
+    """
+    def __init__(self, latency_ms=0, jitter_ms=0, tokens_per_sec=0, error_rate=0.0, error_status=429,
+                 retry_after=None, fail_rate=0.0, reply=DEFAULT_REPLY, seed=0):
+        """
+        参数:
+            latency_ms: 收到请求到返回首个字节的延迟(毫秒)
+            jitter_ms: 延迟的随机波动范围(毫秒)
+            tokens_per_sec: 流式输出速率，0 表示不限速
+            error_rate: 注入错误的请求比例
+            error_status: 注入错误的HTTP状态码
+            retry_after: 429响应的 Retry-After 头(秒)
+            fail_rate: 初始请求回复失败命令的比例
+            reply: 正常回复的命令
+            seed: 随机数种子，保证结果可复现
+        """
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.tokens_per_sec = tokens_per_sec
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.fail_rate = fail_rate
+        self.reply = reply
+        self.random = random.Random(seed)
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # 响应头和正文分开写出，不关闭Nagle算法时会与客户端的延迟确认叠加出约40ms的额外延迟
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_HEAD(self):
+        # 预连接使用 HEAD 请求建立连接，结果无关紧要
+        self.send_response(404)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/stats"):
+            self._send_json(200, self.server.snapshot())
+        elif self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": "mock", "object": "model"}]})
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": {"message": "invalid JSON", "type": "invalid_request_error"}})
+            return
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+
+        server = self.server
+        config = server.config
+        with server.lock:
+            server.stats["requests"] += 1
+            inject_error = config.random.random() < config.error_rate
+            delay = max(0.0, config.latency_ms + config.random.uniform(-config.jitter_ms, config.jitter_ms)) / 1000
+            reply = self._choose_reply(request)
+            if inject_error:
+                server.stats["errors"] += 1
+        time.sleep(delay)
+
+        if inject_error:
+            headers = {}
+            if config.error_status == 429 and config.retry_after is not None:
+                headers["Retry-After"] = str(config.retry_after)
+            self._send_json(config.error_status, {"error": {
+                "message": f"injected error {config.error_status}", "type": "mock_error"}}, headers)
+            return
+
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in request.get("messages", [])) // CHARS_PER_TOKEN
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": max(1, len(reply) // CHARS_PER_TOKEN),
+                 "total_tokens": prompt_tokens + max(1, len(reply) // CHARS_PER_TOKEN),
+                 "prompt_tokens_details": {"cached_tokens": 0}}
+        model = request.get("model") or "mock"
+        if not request.get("stream"):
+            self._send_json(200, {
+                "id": "chatcmpl-mock", "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}],
+                "usage": usage})
+            return
+        self._stream(reply, model, usage if (request.get("stream_options") or {}).get("include_usage") else None)
+
+    def _choose_reply(self, request):
+        messages = request.get("messages") or [{}]
+        last = str(messages[-1].get("content", ""))
+        if "重试" in last or "本地检查未通过" in last:
+            self.server.stats["retries"] += 1
+            return SUCCESS_REPLY
+        if self.server.config.random.random() < self.server.config.fail_rate:
+            return FAILING_REPLY
+        return self.server.config.reply
+
+    def _write_chunk(self, payload):
+        data = f"data: {payload}\n\n".encode("utf-8")
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def _stream(self, reply, model, usage):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        interval = 1.0 / self.server.config.tokens_per_sec if self.server.config.tokens_per_sec > 0 else 0
+        try:
+            for i in range(0, len(reply), CHARS_PER_TOKEN):
+                self._write_chunk(json.dumps({
+                    "id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": int(time.time()),
+                    "model": model, "choices": [{"index": 0, "delta": {"content": reply[i:i + CHARS_PER_TOKEN]},
+                                                 "finish_reason": None}]}))
+                if interval:
+                    time.sleep(interval)
+            if usage is not None:
+                self._write_chunk(json.dumps({
+                    "id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": int(time.time()),
+                    "model": model, "choices": [], "usage": usage}))
+            self._write_chunk("[DONE]")
+            self.wfile.write(b"0\r\n\r\n")
+        except OSError:
+            # 客户端提前取消(例如检测到无效回复)
+            with self.server.lock:
+                self.server.stats["cancelled"] += 1
+
+
+class MockOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, config=None):
+        """
+        参数:
+            host: 监听地址
+            port: 监听端口，0 表示自动分配
+            config: MockConfig
+        """
+        super().__init__((host, port), MockHandler)
+        self.config = config or MockConfig()
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "errors": 0, "retries": 0, "cancelled": 0}
+
+    @property
+    def base_url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}/v1"
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stats)
+
+    def reset_stats(self):
+        with self.lock:
+            for key in self.stats:
+                self.stats[key] = 0
+
+
+def start_mock_server(config=None, host="127.0.0.1", port=0):
+    """
+    在后台线程中启动模拟服务。
+    返回:
+        MockOpenAIServer 实例，使用完毕后调用 shutdown()
+    """
+    server = MockOpenAIServer(host, port, config)
+    threading.Thread(target=server.serve_forever, name="mm-mockserver", daemon=True).start()
+    return server
+
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description="OpenAI 兼容的本地模拟服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--tokens-per-sec", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=429)
+    parser.add_argument("--retry-after", type=float, default=None)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    parser.add_argument("--reply", default=DEFAULT_REPLY)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    config = MockConfig(args.latency_ms, args.jitter_ms, args.tokens_per_sec, args.error_rate, args.error_status,
+                        args.retry_after, args.fail_rate, args.reply, args.seed)
+    server = MockOpenAIServer(args.host, args.port, config)
+    print(f"模拟服务已启动: OPENAI_API_BASE={server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
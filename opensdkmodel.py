@@ -1,27 +1,169 @@
-
-from abc import ABC, abstractmethod
-from openai import OpenAI
+import contextvars
+import json
 import os
-from dotenv import load_dotenv
+import queue
+import threading
+import time
+
+import ratelimit
+from cachedir import get_cache_dir
+from tracing import tracer, usage_attrs
 
-# 加载.env文件中的环境变量
-load_dotenv()
+DEFAULT_API_BASE = "https://api.openai.com/v1"
+TRANSIENT_RETRIES = 2  # 连接失败、服务端错误等临时错误的重试次数(同SDK的默认值)
 
 # OpenAI通用模型实现类，支持OpenAI SDK兼容的所有模型（如deepseek、豆包、openrouter等）
 class OpenAIModel:
     """
     OpenAIModel 仅支持OpenAI SDK及其兼容API的模型调用。
     """
-    def __init__(self):
+    def __init__(self, api_key=None, api_base=None, model_name=None, max_retries=None):
+        """
+        初始化OpenAIModel，未指定的参数自动从环境变量加载API密钥和API_BASE等参数。
+        参数:
+            max_retries: SDK内部的自动重试次数。None 表示由 chat()/achat() 自行重试：
+                         429 按 Retry-After 或指数退避等待(所有进程共享暂停时间)，临时错误最多重试 TRANSIENT_RETRIES 次
+        """
+        self.api_key = api_key if api_key is not None else os.getenv("OPENAI_API_KEY")
+        self.api_base = api_base if api_base is not None else os.getenv("OPENAI_API_BASE")
+        self.model_name = model_name if model_name is not None else os.getenv("MODEL_NAME")  # 从.env读取模型名称
+        self.max_retries = max_retries
+        self._client = None
+        self._async_client = None
+        self._prewarm_thread = None
+        self._client_lock = threading.Lock()
+        self._rate_limiter = None
+        # 预连接耗时统计(毫秒)：import、connect 为后台线程中的耗时，waited 为主线程等待后台线程的耗时
+        self.prewarm_stats = None
+
+    def _build_client(self, http_client=None):
+        from openai import OpenAI
+        kwargs = {"api_key": self.api_key}
+        if self.api_base:
+            kwargs["base_url"] = self.api_base
+        if http_client is not None:
+            kwargs["http_client"] = http_client
+        kwargs["max_retries"] = self.max_retries if self.max_retries is not None else 0
+        return OpenAI(**kwargs)
+
+    @property
+    def client(self):
+        """
+        OpenAI SDK客户端，首次发起请求时才导入openai并构造，避免拖慢不访问网络的启动路径。
+        若已调用 prewarm()，则等待并复用后台线程中建立好连接的客户端。
+        """
+        if self._prewarm_thread is not None:
+            start = time.perf_counter()
+            self._prewarm_thread.join()
+            self._prewarm_thread = None
+            if self.prewarm_stats is not None:
+                self.prewarm_stats["waited"] = (time.perf_counter() - start) * 1000
+        with self._client_lock:
+            if self._client is None:
+                self._client = self._build_client()
+        return self._client
+
+    def prewarm(self):
         """
-        初始化OpenAIModel，自动从环境变量加载API密钥和API_BASE等参数。
+        在后台线程中导入openai、构造客户端并建立到API_BASE的TCP+TLS连接，
+        使其与调用方的本地准备工作(shell检测、系统提示词生成等)重叠进行。
+        建立的连接保留在客户端的连接池中，第一次请求直接复用。
         """
-        api_key = os.getenv("OPENAI_API_KEY")
-        api_base = os.getenv("OPENAI_API_BASE")
-        self.model_name = os.getenv("MODEL_NAME")  # 从.env读取模型名称
-        self.client = OpenAI(api_key=api_key, base_url=api_base) if api_base else OpenAI(api_key=api_key)
+        if self._client is not None or self._prewarm_thread is not None:
+            return
+        self._prewarm_thread = threading.Thread(target=self._prewarm, name="mm-prewarm", daemon=True)
+        self._prewarm_thread.start()
+
+    def _prewarm(self):
+        start = time.perf_counter()
+        try:
+            from openai import DefaultHttpxClient
+            http_client = DefaultHttpxClient()
+            client = self._build_client(http_client)
+        except Exception:
+            return
+        imported = time.perf_counter()
+        try:
+            # 请求结果无关紧要，目的只是完成DNS解析、TCP和TLS握手并让连接进入连接池
+            http_client.request("HEAD", self.api_base or DEFAULT_API_BASE, timeout=5)
+        except Exception:
+            pass
+        connected = time.perf_counter()
+        with self._client_lock:
+            if self._client is None:
+                self._client = client
+        self.prewarm_stats = {
+            "import": (imported - start) * 1000,
+            "connect": (connected - imported) * 1000,
+            "waited": 0.0,
+        }
 
-    def chat(self, messages, model=None, temperature=0.7, max_tokens=2048):
+    @property
+    def async_client(self):
+        """
+        异步OpenAI SDK客户端，仅批量模式使用，同样在首次使用时才构造。
+        """
+        if self._async_client is None:
+            from openai import AsyncOpenAI
+            kwargs = {"api_key": self.api_key}
+            if self.api_base:
+                kwargs["base_url"] = self.api_base
+            kwargs["max_retries"] = self.max_retries if self.max_retries is not None else 0
+            self._async_client = AsyncOpenAI(**kwargs)
+        return self._async_client
+
+    @property
+    def rate_limiter(self):
+        """
+        与使用同一API_BASE和密钥的其他进程共享的限流器(见 ratelimit.py)
+        """
+        if self._rate_limiter is None:
+            self._rate_limiter = ratelimit.RateLimiter.from_env(self.api_base or DEFAULT_API_BASE, self.api_key or "")
+        return self._rate_limiter
+
+    def _retry_delay(self, error, attempt):
+        """
+        第 attempt 次(从0开始)请求失败后，重试前需要在本进程中等待的时间；不应重试时返回None。
+        启用了限流时 429 的暂停时间写入共享状态，下一次 acquire() 时所有进程都会等待；否则只在本进程内等待。
+        """
+        if self.max_retries is not None:
+            return None
+        if ratelimit.is_rate_limited(error):
+            delay = ratelimit.backoff_delay(attempt, ratelimit.retry_after_seconds(error))
+            self.rate_limiter.block(delay)
+            if attempt >= ratelimit.get_rate_limit_retries():
+                return None
+            if self.rate_limiter.enabled:
+                return 0.0
+            ratelimit.notify_wait(delay, "API 返回请求频率超限 (429)")
+            return delay
+        if attempt < TRANSIENT_RETRIES and ratelimit.is_transient(error):
+            delay = ratelimit.backoff_delay(attempt)
+            ratelimit.notify_wait(delay, f"请求失败 ({type(error).__name__})，稍后重试")
+            return delay
+        return None
+
+    def _give_up(self, error, attempt):
+        """
+        不再重试时应抛出的异常：由本类自行重试的 429 转换为说明重试次数的 RateLimitExceeded
+        """
+        if self.max_retries is None and ratelimit.is_rate_limited(error):
+            return ratelimit.RateLimitExceeded(f"API 请求频率超限 (429)，已重试 {attempt} 次仍未成功",
+                                               ratelimit.retry_after_seconds(error))
+        return error
+
+    @staticmethod
+    def _create(client, kwargs):
+        try:
+            return client.chat.completions.create(**kwargs)
+        except Exception as e:
+            # 部分兼容接口不支持 stream_options
+            if "stream_options" not in kwargs or getattr(e, "status_code", None) != 400:
+                raise
+            del kwargs["stream_options"]
+            return client.chat.completions.create(**kwargs)
+
+    def chat(self, messages, model=None, temperature=0.7, max_tokens=2048, stream=False, on_token=None, should_abort=None):
         """
         通用聊天方法，支持OpenAI SDK兼容的所有模型。
         参数:
@@ -29,17 +171,112 @@ class OpenAIModel:
             model: 使用的模型名称（如gpt-3.5-turbo、deepseek-chat等），默认读取.env中的MODEL_NAME
             temperature: 生成文本的温度参数
             max_tokens: 生成文本的最大token数
+            stream: 是否以流式方式接收回复
+            on_token: 流式模式下每收到一段文本时的回调，参数为该段文本
+            should_abort: 流式模式下的检查函数，参数为已收到的完整文本，返回True时立即取消生成
+        返回:
+            模型生成的回复内容（流式模式下被取消时为已收到的部分内容）
+        """
+        use_model = model if model else self.model_name
+        with tracer.span("api.chat", model=use_model, stream=stream) as span:
+            with tracer.span("api.client"):
+                client = self.client
+            kwargs = dict(model=use_model, messages=messages, temperature=temperature,
+                          max_tokens=max_tokens, stream=stream)
+            limiter = self.rate_limiter
+            if stream and (tracer.enabled or limiter.tpm):
+                # 流式回复默认不含token用量，需要跟踪或按TPM限流时额外请求
+                kwargs["stream_options"] = {"include_usage": True}
+            reserved = ratelimit.estimate_request_tokens(messages, max_tokens)
+            queued, attempt = 0.0, 0
+            while True:
+                queued += limiter.acquire(reserved)
+                start = time.perf_counter()
+                try:
+                    resp = self._create(client, kwargs)
+                    break
+                except Exception as e:
+                    # 失败的请求不产生用量，退还预占的额度
+                    limiter.settle(reserved, 0)
+                    delay = self._retry_delay(e, attempt)
+                    if delay is None:
+                        raise self._give_up(e, attempt) from e
+                    attempt += 1
+                    span["retries"] = attempt
+                    time.sleep(delay)
+                    queued += delay
+            if queued:
+                span["queue_ms"] = round(queued * 1000, 1)
+            if not stream:
+                span.update(usage_attrs(resp.usage))
+                content = resp.choices[0].message.content
+                limiter.settle(reserved, getattr(resp.usage, "total_tokens", None)
+                               or ratelimit.estimate_used_tokens(messages, content))
+                return content
+
+            content = ""
+            usage = None
+            try:
+                for chunk in resp:
+                    if getattr(chunk, "usage", None) is not None:
+                        usage = chunk.usage
+                        span.update(usage_attrs(usage))
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if not delta:
+                        continue
+                    if not content:
+                        span["ttft_ms"] = round((time.perf_counter() - start) * 1000, 1)
+                        tracer.event("first_token")
+                    content += delta
+                    if should_abort and should_abort(content):
+                        span["aborted"] = True
+                        break
+                    if on_token:
+                        on_token(delta)
+            finally:
+                # 提前退出时关闭连接，服务端随即停止生成
+                resp.close()
+                # 被取消的回复没有用量，按已生成的内容估算
+                limiter.settle(reserved, getattr(usage, "total_tokens", None)
+                               or ratelimit.estimate_used_tokens(messages, content))
+            return content
+
+    async def achat(self, messages, model=None, temperature=0.7, max_tokens=2048):
+        """
+        chat() 的异步版本(非流式)，用于批量模式下的并发请求。
+        参数:
+            同 chat()
         返回:
             模型生成的回复内容
         """
+        import asyncio
         use_model = model if model else self.model_name
-        resp = self.client.chat.completions.create(
-            model=use_model,
-            messages=messages,
-            temperature=temperature,
-            max_tokens=max_tokens
-        )
-        return resp.choices[0].message.content
+        limiter = self.rate_limiter
+        reserved = ratelimit.estimate_request_tokens(messages, max_tokens)
+        attempt = 0
+        while True:
+            await limiter.acquire_async(reserved)
+            try:
+                resp = await self.async_client.chat.completions.create(
+                    model=use_model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens
+                )
+                break
+            except Exception as e:
+                limiter.settle(reserved, 0)
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise self._give_up(e, attempt) from e
+                attempt += 1
+                await asyncio.sleep(delay)
+        content = resp.choices[0].message.content
+        limiter.settle(reserved, getattr(resp.usage, "total_tokens", None)
+                       or ratelimit.estimate_used_tokens(messages, content))
+        return content
 
     def moderate(self, message):
         """
@@ -50,3 +287,340 @@ class OpenAIModel:
             审核结果
         """
         return self.client.moderations.create(input=message)
+
+
+def parse_endpoints(spec):
+    """
+    解析 FALLBACK_ENDPOINTS：以分号分隔的多个端点，每个端点为 "API_BASE|模型名|API密钥环境变量名"。
+    密钥环境变量名为空时(如本地Ollama)使用占位密钥。
+    返回:
+        [(api_base, model_name, api_key), ...]
+    """
+    endpoints = []
+    for entry in (spec or "").split(";"):
+        parts = [p.strip() for p in entry.split("|")]
+        if not parts[0]:
+            continue
+        model_name = parts[1] if len(parts) > 1 and parts[1] else None
+        key_var = parts[2] if len(parts) > 2 else ""
+        api_key = (os.getenv(key_var) if key_var else None) or "none"
+        endpoints.append((parts[0], model_name, api_key))
+    return endpoints
+
+
+class EndpointStats:
+    """
+    各端点首个token延迟的指数加权移动平均(EWMA)和连续失败次数，保存在缓存目录中，跨进程共享。
+    """
+    ALPHA = 0.3  # EWMA中新样本的权重
+    BASE_COOLDOWN = 60  # 失败后暂停优先使用的基础时间(秒)，连续失败时翻倍
+    MAX_COOLDOWN = 600
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(get_cache_dir(), "endpoints.json")
+        self.lock = threading.Lock()
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self.data = json.load(f)
+            if not isinstance(self.data, dict):
+                self.data = {}
+        except (OSError, ValueError):
+            self.data = {}
+
+    def get(self, key):
+        return self.data.get(key, {})
+
+    def record_success(self, key, latency_ms):
+        with self.lock:
+            entry = self.data.setdefault(key, {})
+            previous = entry.get("ewma_ms")
+            entry["ewma_ms"] = latency_ms if previous is None else previous + self.ALPHA * (latency_ms - previous)
+            entry["failures"] = 0
+            entry["down_until"] = 0
+
+    def record_slow(self, key, elapsed_ms, winner_ms):
+        """
+        被取消的请求：只知道其首个token延迟不小于 elapsed_ms。
+        只有等待时间超过胜者的延迟(确实更慢)且会使平均值变大时才计入。
+        """
+        if elapsed_ms <= winner_ms:
+            return
+        with self.lock:
+            entry = self.data.setdefault(key, {})
+            previous = entry.get("ewma_ms")
+            if previous is None or elapsed_ms > previous:
+                entry["ewma_ms"] = elapsed_ms if previous is None else previous + self.ALPHA * (elapsed_ms - previous)
+
+    def record_failure(self, key):
+        with self.lock:
+            entry = self.data.setdefault(key, {})
+            entry["failures"] = entry.get("failures", 0) + 1
+            cooldown = min(self.MAX_COOLDOWN, self.BASE_COOLDOWN * 2 ** (entry["failures"] - 1))
+            entry["down_until"] = time.time() + cooldown
+
+    def save(self):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with self.lock:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(self.data, f)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+
+class _Attempt:
+    """
+    对单个端点的一次请求
+    """
+    def __init__(self, index, endpoint):
+        self.index = index
+        self.endpoint = endpoint
+        self.cancel = threading.Event()
+        self.response = None
+        self.started = time.perf_counter()
+
+
+# 多端点对冲请求：第一个端点迟迟没有返回首个token时向下一个端点再发一个请求，采用最先返回的结果
+class HedgedModel:
+    """
+    按顺序配置多个OpenAI兼容端点(主端点来自 OPENAI_API_BASE/MODEL_NAME，其余来自 FALLBACK_ENDPOINTS)。
+    请求总是先发给当前最快的健康端点；超过 HEDGE_DELAY_MS 仍未收到首个token时向下一个端点发出对冲请求，
+    某个端点出错时立即转向下一个。最先返回首个token的请求胜出，其余请求被取消。
+    各端点的延迟和健康状态保存在缓存目录中，供之后的运行选择端点。
+    """
+    def __init__(self, endpoints=None, hedge_delay_ms=None, stats=None):
+        """
+        参数:
+            endpoints: [(api_base, model_name, api_key), ...]，默认读取环境变量
+            hedge_delay_ms: 发出对冲请求前等待首个token的时间(毫秒)，默认读取 HEDGE_DELAY_MS
+            stats: EndpointStats 实例
+        """
+        if endpoints is None:
+            endpoints = [(os.getenv("OPENAI_API_BASE") or DEFAULT_API_BASE, os.getenv("MODEL_NAME"),
+                          os.getenv("OPENAI_API_KEY"))]
+            endpoints += parse_endpoints(os.getenv("FALLBACK_ENDPOINTS"))
+        if hedge_delay_ms is None:
+            try:
+                hedge_delay_ms = float(os.getenv("HEDGE_DELAY_MS", "1500"))
+            except ValueError:
+                hedge_delay_ms = 1500.0
+        self.hedge_delay = max(0.0, hedge_delay_ms) / 1000
+        # 出错时直接转向其他端点，不使用SDK内部的重试
+        self.models = [OpenAIModel(api_key, api_base, model_name, max_retries=0)
+                       for api_base, model_name, api_key in endpoints]
+        self.stats = stats or EndpointStats()
+
+    @staticmethod
+    def _key(model):
+        return f"{model.api_base}|{model.model_name}"
+
+    @property
+    def model_name(self):
+        return self.models[0].model_name
+
+    def ordered_models(self):
+        """
+        按健康状态和延迟排序的端点：健康的端点在前，其中EWMA延迟低的在前；
+        没有统计数据的端点按配置顺序排在同类端点之间。
+        """
+        now = time.time()
+
+        def sort_key(item):
+            index, model = item
+            entry = self.stats.get(self._key(model))
+            down = entry.get("down_until", 0) > now
+            ewma = entry.get("ewma_ms")
+            return (down, ewma if ewma is not None else self.hedge_delay * 1000, index)
+
+        return [model for _, model in sorted(enumerate(self.models), key=sort_key)]
+
+    @property
+    def prewarm_stats(self):
+        return self.ordered_models()[0].prewarm_stats
+
+    def prewarm(self):
+        """
+        预连接最可能用到的两个端点
+        """
+        for model in self.ordered_models()[:2]:
+            model.prewarm()
+
+    def _run(self, attempt, events, messages, model, temperature, max_tokens):
+        endpoint = attempt.endpoint
+        limiter = endpoint.rate_limiter
+        reserved = 0
+        received = ""
+        refund = False  # 请求没有到达服务端或被拒绝
+        try:
+            client = endpoint.client
+            # 限流的排队时间不计入端点延迟
+            reserved = ratelimit.estimate_request_tokens(messages, max_tokens)
+            limiter.acquire(reserved)
+            if attempt.cancel.is_set():
+                refund = True
+                return
+            attempt.started = time.perf_counter()
+            # 内部总是使用流式请求，才能在收到首个token时决定胜者并取消其余请求
+            attempt.response = client.chat.completions.create(
+                model=model or endpoint.model_name, messages=messages, temperature=temperature,
+                max_tokens=max_tokens, stream=True)
+            for chunk in attempt.response:
+                if attempt.cancel.is_set():
+                    break
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    received += delta
+                    events.put((attempt, "token", delta))
+            events.put((attempt, "done", None))
+        except Exception as e:
+            refund = not received
+            if ratelimit.is_rate_limited(e):
+                # 其他进程在暂停时间内也不再使用该端点；本次请求直接转向下一个端点
+                endpoint.rate_limiter.block(ratelimit.backoff_delay(0, ratelimit.retry_after_seconds(e)))
+            events.put((attempt, "error", e))
+        finally:
+            if attempt.response is not None:
+                try:
+                    attempt.response.close()
+                except Exception:
+                    pass
+            # 内部的流式请求不返回用量：没有发出或失败的请求退还额度，其余(包括被取消的)按已收到的内容估算
+            limiter.settle(reserved, 0 if refund else ratelimit.estimate_used_tokens(messages, received))
+
+    def chat(self, messages, model=None, temperature=0.7, max_tokens=2048, stream=False, on_token=None, should_abort=None):
+        """
+        参数与返回值同 OpenAIModel.chat()。model 只用于主端点，其余端点使用各自配置的模型。
+        """
+        models = self.ordered_models()
+        primary = self.models[0]
+        events = queue.Queue()
+        attempts = []
+
+        def launch():
+            endpoint = models[len(attempts)]
+            attempt = _Attempt(len(attempts), endpoint)
+            attempts.append(attempt)
+            # 复制上下文，使等待提示的接收方(见 ratelimit.redirect_notices)对工作线程同样有效
+            threading.Thread(target=contextvars.copy_context().run, name="mm-hedge", daemon=True,
+                             args=(self._run, attempt, events, messages, model if endpoint is primary else None,
+                                   temperature, max_tokens)).start()
+            return attempt
+
+        with tracer.span("hedge.chat", endpoints=len(models)) as span:
+            # 首次构造客户端需要导入openai，不应计入对冲延迟和端点延迟
+            with tracer.span("api.client"):
+                models[0].client
+            launch()
+            next_launch = time.perf_counter() + self.hedge_delay
+            active = 1
+            rate_limited = 0
+            winner = None
+            content = ""
+            try:
+                while True:
+                    timeout = None
+                    if winner is None and len(attempts) < len(models):
+                        timeout = max(0.0, next_launch - time.perf_counter())
+                    try:
+                        attempt, kind, value = events.get(timeout=timeout)
+                    except queue.Empty:
+                        # 超过对冲延迟仍无首个token
+                        launch()
+                        active += 1
+                        next_launch = time.perf_counter() + self.hedge_delay
+                        continue
+
+                    if winner is None:
+                        if kind == "error":
+                            self.stats.record_failure(self._key(attempt.endpoint))
+                            rate_limited += ratelimit.is_rate_limited(value)
+                            active -= 1
+                            if len(attempts) < len(models):
+                                launch()
+                                active += 1
+                                next_launch = time.perf_counter() + self.hedge_delay
+                            elif active == 0:
+                                if rate_limited == len(models):
+                                    raise self._all_rate_limited(value) from value
+                                raise value
+                            continue
+                        winner = attempt
+                        elapsed_ms = (time.perf_counter() - attempt.started) * 1000
+                        self.stats.record_success(self._key(attempt.endpoint), elapsed_ms)
+                        for other in attempts:
+                            if other is not winner:
+                                other.cancel.set()
+                                self.stats.record_slow(self._key(other.endpoint),
+                                                       (time.perf_counter() - other.started) * 1000, elapsed_ms)
+                        span.update(winner=attempt.endpoint.api_base, launched=len(attempts),
+                                    ttft_ms=round(elapsed_ms, 1))
+                    if attempt is not winner:
+                        continue
+
+                    if kind == "done":
+                        return content
+                    if kind == "error":
+                        raise value
+                    content += value
+                    if stream and should_abort and should_abort(content):
+                        span["aborted"] = True
+                        return content
+                    if stream and on_token:
+                        on_token(value)
+            finally:
+                for attempt in attempts:
+                    attempt.cancel.set()
+                self.stats.save()
+
+    async def achat(self, messages, model=None, temperature=0.7, max_tokens=2048):
+        """
+        chat() 的异步版本，用于批量模式：不对冲(避免成倍增加并发请求)，出错时按顺序转向下一个端点。
+        """
+        last_error = None
+        rate_limited = 0
+        try:
+            for endpoint in self.ordered_models():
+                started = time.perf_counter()
+                try:
+                    content = await endpoint.achat(messages, model if endpoint is self.models[0] else None,
+                                                   temperature, max_tokens)
+                except Exception as e:
+                    last_error = e
+                    rate_limited += ratelimit.is_rate_limited(e)
+                    self.stats.record_failure(self._key(endpoint))
+                    if ratelimit.is_rate_limited(e):
+                        endpoint.rate_limiter.block(ratelimit.backoff_delay(0, ratelimit.retry_after_seconds(e)))
+                    continue
+                # 非流式请求没有首个token的时间，用完整响应的时间近似(生成的命令通常很短)
+                self.stats.record_success(self._key(endpoint), (time.perf_counter() - started) * 1000)
+                return content
+        finally:
+            self.stats.save()
+        if rate_limited == len(self.models):
+            raise self._all_rate_limited(last_error) from last_error
+        raise last_error
+
+    def _all_rate_limited(self, error):
+        """
+        所有端点都返回 429 时的异常。对冲模式不按 Retry-After 重试，而是暂停该端点并转向下一个
+        """
+        return ratelimit.RateLimitExceeded(f"所有 {len(self.models)} 个端点均返回请求频率超限 (429)",
+                                           ratelimit.retry_after_seconds(error))
+
+    def moderate(self, message):
+        return self.ordered_models()[0].moderate(message)
+
+
+def create_model():
+    """
+    根据配置创建模型客户端：配置了 FALLBACK_ENDPOINTS 时使用多端点对冲的 HedgedModel，否则使用 OpenAIModel。
+    """
+    if parse_endpoints(os.getenv("FALLBACK_ENDPOINTS")):
+        return HedgedModel()
+    return OpenAIModel()
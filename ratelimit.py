@@ -0,0 +1,342 @@
+"""
+跨进程共享的客户端限流。
+
+多名工程师或多个脚本共用一个API密钥时，突发请求容易触发 429。本模块用令牌桶同时限制每分钟请求数
+(RATE_LIMIT_RPM) 和每分钟token数 (RATE_LIMIT_TPM)，桶的状态保存在缓存目录的 ratelimit.json 中，
+通过文件锁在同一台机器的所有 mm 进程之间共享。收到 429 时按 Retry-After (或带随机抖动的指数退避)
+设置共享的暂停时间，其他进程也会等到该时间之后再发送请求，使吞吐量平滑下降而不是直接失败。
+"""
+import contextvars
+import json
+import os
+import random
+import sys
+import time
+from contextlib import contextmanager
+
+from cachedir import get_cache_dir
+from errorcontext import estimate_tokens
+
+BASE_BACKOFF = 1.0  # 没有 Retry-After 时首次退避的时间(秒)，之后每次翻倍
+MAX_BACKOFF = 60.0  # 单次退避的最长时间(秒)
+NOTICE_SECONDS = 1.0  # 排队超过该时间时在终端提示
+
+# 当前请求的等待提示的接收方，None 表示直接输出到终端(守护进程中转发给客户端)
+_notice_handler = contextvars.ContextVar("mm_notice_handler", default=None)
+
+
+class RateLimitExceeded(Exception):
+    """
+    收到 429 后重试(或转向其他端点)仍未成功
+    """
+    status_code = 429
+
+    def __init__(self, message, retry_after=None):
+        """
+        参数:
+            message: 给用户的说明
+            retry_after: 服务端最后一次要求等待的时间(秒)，未知时为None
+        """
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _env_number(name, default):
+    try:
+        return max(0.0, float(os.getenv(name, default)))
+    except ValueError:
+        return float(default)
+
+
+def get_rate_limit_retries():
+    """
+    收到 429 后的最大重试次数，从.env的 RATE_LIMIT_RETRIES 读取
+    """
+    return int(_env_number("RATE_LIMIT_RETRIES", "5"))
+
+
+@contextmanager
+def _file_lock(path):
+    """
+    跨进程的排他文件锁：POSIX 使用 fcntl.flock，Windows 使用 msvcrt.locking
+    (LK_LOCK 重试约10秒后仍未获得锁时抛出 OSError，由调用方放弃限流)
+    """
+    with open(path, "a+b") as f:
+        if os.name == "nt":
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def estimate_request_tokens(messages, max_tokens):
+    """
+    估算一次请求占用的token数：提示词加上最大生成长度(OpenAI 等服务商按此计入 TPM 限额)
+    """
+    return sum(estimate_tokens(str(m.get("content", ""))) + 4 for m in messages) + (max_tokens or 0)
+
+
+def estimate_used_tokens(messages, content):
+    """
+    服务端没有返回用量(流式回复被取消、不支持 stream_options 等)时，按提示词和已收到的回复估算实际用量
+    """
+    return estimate_request_tokens(messages, 0) + estimate_tokens(content or "")
+
+
+def retry_after_seconds(error):
+    """
+    从 429 响应的 retry-after-ms 或 Retry-After (秒数或HTTP日期) 头中读取需要等待的时间，没有时返回None
+    """
+    if isinstance(error, RateLimitExceeded):
+        return error.retry_after
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        return max(0.0, float(headers.get("retry-after-ms")) / 1000)
+    except (TypeError, ValueError):
+        pass
+    value = headers.get("retry-after")
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    import email.utils
+    parsed = email.utils.parsedate_tz(value) if value else None
+    if parsed is None:
+        return None
+    return max(0.0, email.utils.mktime_tz(parsed) - time.time())
+
+
+def backoff_delay(attempt, retry_after=None):
+    """
+    第 attempt 次(从0开始)重试前的等待时间：服务端给出 Retry-After 时以它为准，否则使用指数退避；
+    两者都加上随机抖动，避免多个进程在同一时刻重试。
+    """
+    if retry_after is not None:
+        return min(MAX_BACKOFF, retry_after) * random.uniform(1.0, 1.1)
+    delay = min(MAX_BACKOFF, BASE_BACKOFF * 2 ** attempt)
+    return delay * random.uniform(0.5, 1.0)
+
+
+def is_rate_limited(error):
+    return getattr(error, "status_code", None) == 429
+
+
+def is_transient(error):
+    """
+    可以重试的临时错误：连接失败、超时、服务端错误
+    """
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return status in (408, 409) or status >= 500
+    import openai
+    return isinstance(error, openai.APIConnectionError)
+
+
+def show_notice(text):
+    """
+    在标准错误输出显示等待提示
+    """
+    try:
+        from termcolor import colored
+        print(colored(text, "yellow"), file=sys.stderr, flush=True)
+    except (OSError, ValueError):
+        pass
+
+
+def notify_wait(seconds, reason):
+    """
+    排队时间较长时提示用户，使等待不会看起来像卡住
+    """
+    if seconds < NOTICE_SECONDS:
+        return
+    text = f"⏳ {reason}，等待 {seconds:.1f} 秒..."
+    handler = _notice_handler.get()
+    if handler is not None:
+        handler(text)
+    else:
+        show_notice(text)
+
+
+@contextmanager
+def redirect_notices(handler):
+    """
+    在此范围内(包括用 contextvars.copy_context() 启动的线程)把等待提示交给 handler，而不是输出到终端
+    """
+    token = _notice_handler.set(handler)
+    try:
+        yield
+    finally:
+        _notice_handler.reset(token)
+
+
+class RateLimiter:
+    """
+    按 API_BASE 和密钥区分的令牌桶，状态在同一台机器的所有进程间共享。
+    rpm、tpm 为 0 时不限制对应的维度；两者都为 0 时不读写状态文件，所有方法都不做任何事，
+    收到 429 时由调用方只在本进程内退避。状态文件无法读写时同样不限流，而不是让请求失败。
+    """
+    def __init__(self, key, rpm=0, tpm=0, path=None):
+        """
+        参数:
+            key: 限流的分组(同一分组共用额度)，不保存原文
+            rpm: 每分钟最大请求数，0 表示不限制
+            tpm: 每分钟最大token数，0 表示不限制
+            path: 状态文件路径，默认位于用户缓存目录下的 ratelimit.json
+        """
+        import hashlib
+        self.key = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+        self.rpm = rpm
+        self.tpm = tpm
+        self.path = path or os.path.join(get_cache_dir(), "ratelimit.json")
+        self.lock_path = self.path + ".lock"
+
+    @property
+    def enabled(self):
+        return bool(self.rpm or self.tpm)
+
+    @classmethod
+    def from_env(cls, api_base, api_key):
+        return cls(f"{api_base}|{api_key}", _env_number("RATE_LIMIT_RPM", "0"), _env_number("RATE_LIMIT_TPM", "0"))
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self, data):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def _refill(self, entry, now):
+        elapsed = max(0.0, now - entry.get("updated", now))
+        entry["requests"] = min(self.rpm, entry.get("requests", self.rpm) + elapsed * self.rpm / 60)
+        entry["tokens"] = min(self.tpm, entry.get("tokens", self.tpm) + elapsed * self.tpm / 60)
+        entry["updated"] = now
+
+    def _try_acquire(self, tokens):
+        """
+        尝试占用额度。
+        返回:
+            (还需等待的秒数(0表示已占用), 等待原因)
+        """
+        try:
+            return self._try_acquire_locked(tokens)
+        except OSError:
+            return 0.0, None
+
+    def _try_acquire_locked(self, tokens):
+        with _file_lock(self.lock_path):
+            data = self._load()
+            entry = data.setdefault(self.key, {})
+            now = time.time()
+            blocked = entry.get("blocked_until", 0) - now
+            if blocked > 0:
+                return blocked, "API 返回请求频率超限 (429)"
+            self._refill(entry, now)
+            # 单次请求超过整个桶的容量时，等桶满即可发送
+            tokens = min(tokens, self.tpm)
+            waits = []
+            if self.rpm and entry["requests"] < 1:
+                waits.append((1 - entry["requests"]) * 60 / self.rpm)
+            if self.tpm and entry["tokens"] < tokens:
+                waits.append((tokens - entry["tokens"]) * 60 / self.tpm)
+            if waits:
+                return max(waits), "达到客户端限流 (RATE_LIMIT_RPM/RATE_LIMIT_TPM)"
+            if self.rpm:
+                entry["requests"] -= 1
+            if self.tpm:
+                entry["tokens"] -= tokens
+            self._save(data)
+            return 0.0, None
+
+    def acquire(self, tokens=0):
+        """
+        等待直到可以发送请求，并占用一个请求和 tokens 个token的额度。
+        参数:
+            tokens: 预计占用的token数
+        返回:
+            排队等待的秒数
+        """
+        waited = 0.0
+        while self.enabled:
+            wait, reason = self._try_acquire(tokens)
+            if wait <= 0:
+                return waited
+            # 稍加抖动，避免多个等待的进程同时醒来争抢
+            wait = wait * random.uniform(1.0, 1.05) + 0.01
+            notify_wait(wait, reason)
+            time.sleep(wait)
+            waited += wait
+        return waited
+
+    async def acquire_async(self, tokens=0):
+        """
+        acquire() 的异步版本，等待时不阻塞事件循环
+        """
+        import asyncio
+        waited = 0.0
+        while self.enabled:
+            wait, reason = self._try_acquire(tokens)
+            if wait <= 0:
+                return waited
+            wait = wait * random.uniform(1.0, 1.05) + 0.01
+            notify_wait(wait, reason)
+            await asyncio.sleep(wait)
+            waited += wait
+        return waited
+
+    def settle(self, reserved, actual):
+        """
+        用实际的token用量修正之前按估算占用的额度
+        """
+        if not self.tpm or actual is None:
+            return
+        try:
+            with _file_lock(self.lock_path):
+                data = self._load()
+                entry = data.setdefault(self.key, {})
+                self._refill(entry, time.time())
+                entry["tokens"] = min(self.tpm, entry["tokens"] + min(reserved, self.tpm) - actual)
+                self._save(data)
+        except OSError:
+            pass
+
+    def block(self, seconds):
+        """
+        收到 429 后暂停所有进程的请求 seconds 秒
+        """
+        if not self.enabled:
+            return
+        try:
+            with _file_lock(self.lock_path):
+                data = self._load()
+                entry = data.setdefault(self.key, {})
+                entry["blocked_until"] = max(entry.get("blocked_until", 0), time.time() + seconds)
+                self._save(data)
+        except OSError:
+            pass
@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+from cachedir import get_cache_dir
+
+# 模型回复的本地持久化缓存，相同问题直接返回，无需再次请求API
+class ResponseCache:
+    """
+    基于SQLite的模型回复缓存，支持按条目数(LRU)和存活时间(TTL)淘汰，并记录命中统计。
+    多个mm进程可同时访问同一缓存文件。
+    """
+    def __init__(self, path=None, max_entries=1000, ttl=7 * 24 * 3600):
+        """
+        参数:
+            path: 缓存数据库路径，默认位于用户缓存目录下的 responses.sqlite3
+            max_entries: 最大缓存条目数，超出后淘汰最久未使用的条目
+            ttl: 条目存活时间(秒)，<=0 表示永不过期
+        """
+        self.path = path or os.path.join(get_cache_dir(), "responses.sqlite3")
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+            "created REAL NOT NULL, accessed REAL NOT NULL)")
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed)")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+    @staticmethod
+    def normalize_query(query):
+        """
+        规范化用户问题：合并空白、忽略大小写和结尾的问号/句号。
+        """
+        return " ".join(query.split()).lower().rstrip("?？.。")
+
+    @staticmethod
+    def make_key(query, shell, os_name, model, temperature, system_prompt):
+        """
+        根据问题和所有影响回复的参数生成缓存键。
+        """
+        prompt_hash = hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()
+        material = json.dumps([
+            ResponseCache.normalize_query(query), shell, os_name,
+            model, temperature, prompt_hash], ensure_ascii=False)
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def _expired_before(self):
+        return time.time() - self.ttl if self.ttl > 0 else 0
+
+    def _bump(self, name):
+        self.conn.execute(
+            "INSERT INTO stats(name, value) VALUES(?, 1) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + 1", (name,))
+
+    def get(self, key):
+        """
+        查询缓存，命中时刷新访问时间。
+        返回:
+            缓存的回复内容，未命中或已过期时返回None
+        """
+        row = self.conn.execute(
+            "SELECT response FROM responses WHERE key = ? AND created >= ?",
+            (key, self._expired_before())).fetchone()
+        if row is None:
+            self._bump("misses")
+            return None
+        self.conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (time.time(), key))
+        self._bump("hits")
+        return row[0]
+
+    def put(self, key, response):
+        """
+        写入缓存并执行淘汰。
+        """
+        now = time.time()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO responses(key, response, created, accessed) VALUES(?, ?, ?, ?)",
+            (key, response, now, now))
+        self.evict()
+
+    def invalidate(self, key):
+        """
+        删除指定缓存条目(例如缓存的命令执行失败时)。
+        """
+        self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+
+    def evict(self):
+        """
+        删除过期条目，并在超出最大条目数时按最久未使用淘汰。
+        """
+        if self.ttl > 0:
+            self.conn.execute("DELETE FROM responses WHERE created < ?", (self._expired_before(),))
+        if self.max_entries > 0:
+            self.conn.execute(
+                "DELETE FROM responses WHERE key IN ("
+                "SELECT key FROM responses ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,))
+
+    def clear(self):
+        """
+        清空所有缓存条目和统计信息。
+        """
+        self.conn.execute("DELETE FROM responses")
+        self.conn.execute("DELETE FROM stats")
+
+    def stats(self):
+        """
+        返回:
+            包含 entries、hits、misses、size_bytes 的字典
+        """
+        counters = dict(self.conn.execute("SELECT name, value FROM stats").fetchall())
+        entries = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        size = sum(os.path.getsize(p) for p in (self.path, self.path + "-wal") if os.path.exists(p))
+        return {
+            "entries": entries,
+            "hits": counters.get("hits", 0),
+            "misses": counters.get("misses", 0),
+            "size_bytes": size,
+        }
+
+    def close(self):
+        self.conn.close()
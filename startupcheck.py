@@ -0,0 +1,89 @@
+"""
+mm 冷启动时间检查。
+
+多次以新进程运行 `mm.py --help`，取中位数与预算比较，并确认帮助路径没有导入
+openai、pyperclip、sqlite3 等只在发送请求、读写缓存或复制到剪贴板时才需要的模块。
+超出预算或导入了不该导入的模块时以非零状态码退出，可直接用于CI。
+
+用法: python startupcheck.py [--budget-ms 毫秒] [--runs 次数]
+预算也可通过环境变量 MM_STARTUP_BUDGET_MS 设置，默认 150 毫秒。
+"""
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# 帮助路径上不允许出现的模块
+HEAVY_MODULES = ("openai", "httpx", "pyperclip", "distro", "psutil", "colorama",
+                 "asyncio", "sqlite3", "socket", "opensdkmodel")
+
+MM_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mm.py")
+
+# 在子进程中运行 mm --help 并输出已导入的重模块
+PROBE = """
+import runpy, sys
+sys.argv = [{mm_path!r}, "--help"]
+try:
+    runpy.run_path({mm_path!r}, run_name="__main__")
+except SystemExit:
+    pass
+sys.stderr.write(",".join(m for m in {heavy!r} if m in sys.modules))
+"""
+
+
+def time_cold_start(runs):
+    """
+    返回:
+        每次运行 `mm.py --help` 的耗时列表(毫秒)
+    """
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, MM_PATH, "--help"], stdout=subprocess.DEVNULL,
+                       stderr=subprocess.DEVNULL, check=False)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def find_heavy_imports():
+    """
+    返回:
+        帮助路径上被导入的重模块列表
+    """
+    probe = PROBE.format(mm_path=MM_PATH, heavy=HEAVY_MODULES)
+    result = subprocess.run([sys.executable, "-c", probe], stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE, text=True, check=False)
+    output = result.stderr.strip().splitlines()
+    return [m for m in output[-1].split(",") if m] if output else []
+
+
+def main(argv):
+    budget_ms = float(os.getenv("MM_STARTUP_BUDGET_MS", "150"))
+    runs = 7
+    if "--budget-ms" in argv:
+        budget_ms = float(argv[argv.index("--budget-ms") + 1])
+    if "--runs" in argv:
+        runs = int(argv[argv.index("--runs") + 1])
+
+    # 第一次运行用于生成字节码缓存，不计入统计
+    time_cold_start(1)
+    timings = time_cold_start(runs)
+    median = statistics.median(timings)
+    print(f"mm --help 冷启动: 中位数 {median:.1f} ms, 最小 {min(timings):.1f} ms, 最大 {max(timings):.1f} ms (预算 {budget_ms:.0f} ms)")
+
+    failed = False
+    if median > budget_ms:
+        print(f"失败: 冷启动时间超出预算 {median - budget_ms:.1f} ms")
+        failed = True
+    heavy = find_heavy_imports()
+    if heavy:
+        print("失败: 帮助路径导入了不必要的模块: " + ", ".join(heavy))
+        failed = True
+    if not failed:
+        print("通过")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,326 @@
+import codecs
+import locale
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+
+class HeadTailBuffer:
+    """
+    只保留输出开头和结尾若干字符的缓冲区，中间部分丢弃，内存占用有上限。
+    """
+    def __init__(self, head_chars=16384, tail_chars=16384):
+        self.head_chars = head_chars
+        self.tail_chars = tail_chars
+        self.head = ""
+        self.tail = ""
+        self.total = 0
+
+    def write(self, text):
+        self.total += len(text)
+        room = self.head_chars - len(self.head)
+        if room > 0:
+            self.head += text[:room]
+            text = text[room:]
+        if text and self.tail_chars > 0:
+            self.tail = (self.tail + text)[-self.tail_chars:]
+
+    @property
+    def dropped(self):
+        """被丢弃的中间部分字符数"""
+        return self.total - len(self.head) - len(self.tail)
+
+    def getvalue(self):
+        if self.dropped > 0:
+            return f"{self.head}\n... [省略 {self.dropped} 个字符] ...\n{self.tail}"
+        return self.head + self.tail
+
+
+class CommandResult:
+    """
+    流式执行的结果，stdout/stderr 为截断后的开头+结尾内容。
+    """
+    def __init__(self, returncode, stdout, stderr, timed_out=False, interrupted=False, truncated=False):
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.timed_out = timed_out
+        self.interrupted = interrupted
+        self.truncated = truncated
+
+
+def build_shell_argv(shell, command):
+    """
+    根据shell类型构造执行命令的参数列表
+    """
+    if shell == "powershell.exe":
+        return [shell, "-Command", command]
+    elif shell == "cmd.exe":
+        return [shell, "/c", command]
+    return [shell, "-c", command]
+
+
+def _pump(pipe, sink, buffer):
+    """
+    从子进程管道读取数据，原样写到终端(sink)，同时解码后存入有界缓冲区。
+    """
+    decoder = codecs.getincrementaldecoder(locale.getpreferredencoding(False))(errors="replace")
+    try:
+        while True:
+            chunk = pipe.read1(65536) if hasattr(pipe, "read1") else pipe.read(65536)
+            if not chunk:
+                break
+            if sink is not None:
+                try:
+                    sink.write(chunk)
+                    sink.flush()
+                except (OSError, ValueError):
+                    sink = None
+            buffer.write(decoder.decode(chunk))
+        buffer.write(decoder.decode(b"", final=True))
+    except (OSError, ValueError):
+        pass
+    finally:
+        pipe.close()
+
+
+def _terminal_sink(stream):
+    return getattr(stream, "buffer", None)
+
+
+def _signal_group(proc, signum):
+    """
+    向子进程及其派生的进程(如管道中的其他命令)发送信号。
+    POSIX 下子进程是单独进程组的组长，整个进程组一起收到信号；
+    Windows 下子进程在新的进程组中，中断时发送 CTRL_BREAK_EVENT，其他信号直接结束子进程。
+    """
+    try:
+        if os.name == "nt":
+            if signum == signal.SIGINT:
+                proc.send_signal(signal.CTRL_BREAK_EVENT)
+            else:
+                proc.terminate()
+        else:
+            os.killpg(proc.pid, signum)
+    except (OSError, ValueError):
+        pass
+
+
+def _open_controlling_terminal():
+    """
+    mm 在控制终端的前台运行时返回终端的文件描述符，否则返回None。
+    只有这时才能把终端交给子进程，使 sudo、ssh 等需要读写 /dev/tty 的命令正常工作。
+    """
+    if os.name == "nt" or threading.current_thread() is not threading.main_thread():
+        return None
+    try:
+        fd = os.open("/dev/tty", os.O_RDWR)
+    except OSError:
+        return None
+    try:
+        if os.tcgetpgrp(fd) == os.getpgrp():
+            return fd
+    except OSError:
+        pass
+    os.close(fd)
+    return None
+
+
+def _set_foreground(fd, pgid):
+    """
+    把终端的前台进程组设为pgid。后台进程组调用 tcsetpgrp 会收到 SIGTTOU，调用期间屏蔽该信号
+    """
+    previous = signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGTTOU})
+    try:
+        os.tcsetpgrp(fd, pgid)
+    except OSError:
+        pass
+    finally:
+        signal.pthread_sigmask(signal.SIG_SETMASK, previous)
+
+
+def _kill_tree(proc, force=False):
+    """
+    结束子进程及其派生的所有进程。
+    """
+    if os.name == "nt":
+        # taskkill /T 连同子进程树一起结束
+        try:
+            subprocess.run(["taskkill", "/T", "/F", "/PID", str(proc.pid)],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        except OSError:
+            proc.kill()
+        return
+    _signal_group(proc, signal.SIGKILL if force else signal.SIGTERM)
+
+
+class PrefixedSink:
+    """
+    在每一行输出前加上前缀后写到终端。多个命令并发输出时共用同一把锁，按整行写出，行不会被打断。
+    """
+    def __init__(self, stream, prefix, lock):
+        self.stream = stream
+        self.prefix = prefix.encode(locale.getpreferredencoding(False), errors="replace")
+        self.lock = lock
+        self.partial = b""
+
+    def write(self, chunk):
+        lines = (self.partial + chunk).split(b"\n")
+        self.partial = lines.pop()
+        if lines:
+            with self.lock:
+                self.stream.write(b"".join(self.prefix + line + b"\n" for line in lines))
+
+    def flush(self):
+        with self.lock:
+            self.stream.flush()
+
+    def close(self):
+        """
+        写出最后一行不完整的输出
+        """
+        if self.partial:
+            with self.lock:
+                self.stream.write(self.prefix + self.partial + b"\n")
+                self.stream.flush()
+            self.partial = b""
+
+
+def run_streaming(argv, timeout=None, echo=True, head_chars=16384, tail_chars=16384, cwd=None,
+                  prefix=None, lock=None, cancel=None):
+    """
+    执行命令并把stdout/stderr实时输出到终端，同时只保留有界的开头+结尾内容供后续重试使用。
+    POSIX 下子进程是单独进程组的组长，超时时整个进程组一起结束，管道中的其他命令不会继续占用输出管道。
+    mm 在终端前台运行时，子进程的进程组在执行期间成为终端的前台进程组：需要终端的命令(sudo、ssh 的密码提示等)
+    可以正常使用，终端的 Ctrl+C 只发给子进程；否则(如并发执行多个命令时)子进程在新的会话中运行。
+    Windows 下子进程在新的进程组中运行，终端的 Ctrl+C 只发给 mm。
+    执行期间 mm 收到的 SIGINT/SIGTERM/SIGHUP 会转发给子进程(子进程只收到一次)。
+    参数:
+        argv: 命令参数列表
+        timeout: 超时时间(秒)，None或<=0表示不限时
+        echo: 是否实时输出到终端
+        head_chars: 每个输出流保留的开头字符数
+        tail_chars: 每个输出流保留的结尾字符数
+        cwd: 工作目录
+        prefix: 输出到终端时每行的前缀(并发执行多个命令时区分来源)
+        lock: 并发执行时共用的终端输出锁
+        cancel: threading.Event，被设置时中断命令(在非主线程中执行时用于转发用户的 Ctrl+C)
+    返回:
+        CommandResult
+    """
+    if echo:
+        # 之前通过文本层输出的内容(如提示)先写出，避免与直接写到底层缓冲区的输出顺序错乱
+        for stream in (sys.stdout, sys.stderr):
+            try:
+                stream.flush()
+            except (OSError, ValueError):
+                pass
+    terminal = _open_controlling_terminal()
+    if terminal is not None:
+        def enter_foreground():
+            os.setpgid(0, 0)
+            _set_foreground(terminal, os.getpgrp())
+            # mm 不做作业控制，子进程被 Ctrl+Z 暂停后终端会一直停在这里
+            signal.signal(signal.SIGTSTP, signal.SIG_IGN)
+        options = {"preexec_fn": enter_foreground}
+    elif os.name == "nt":
+        options = {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+    else:
+        options = {"start_new_session": True}
+    try:
+        proc = subprocess.Popen(argv, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=cwd, **options)
+    except BaseException:
+        if terminal is not None:
+            _set_foreground(terminal, os.getpgrp())
+            os.close(terminal)
+        raise
+    stdout_buf = HeadTailBuffer(head_chars, tail_chars)
+    stderr_buf = HeadTailBuffer(head_chars, tail_chars)
+    sinks = [_terminal_sink(sys.stdout) if echo else None, _terminal_sink(sys.stderr) if echo else None]
+    if prefix is not None:
+        lock = lock or threading.Lock()
+        sinks = [PrefixedSink(sink, prefix, lock) if sink is not None else None for sink in sinks]
+    readers = [
+        threading.Thread(target=_pump, args=(proc.stdout, sinks[0], stdout_buf), daemon=True),
+        threading.Thread(target=_pump, args=(proc.stderr, sinks[1], stderr_buf), daemon=True),
+    ]
+    for reader in readers:
+        reader.start()
+
+    state = {"interrupted": False}
+    previous_handlers = {}
+
+    def forward(signum, frame):
+        if signum == signal.SIGINT:
+            state["interrupted"] = True
+        _signal_group(proc, signum)
+
+    # 信号处理函数只能在主线程中安装
+    if threading.current_thread() is threading.main_thread():
+        for name in ("SIGINT", "SIGTERM", "SIGHUP"):
+            signum = getattr(signal, name, None)
+            if signum is not None and not (os.name == "nt" and name != "SIGINT"):
+                previous_handlers[signum] = signal.signal(signum, forward)
+
+    timed_out = False
+    deadline = time.monotonic() + timeout if timeout and timeout > 0 else None
+    try:
+        while True:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                timed_out = True
+                break
+            if cancel is not None and cancel.is_set() and not state["interrupted"]:
+                state["interrupted"] = True
+                _signal_group(proc, signal.SIGINT)
+            try:
+                poll = 0.5 if cancel is None else 0.1
+                proc.wait(timeout=poll if remaining is None else min(remaining, poll))
+                break
+            except subprocess.TimeoutExpired:
+                continue
+            except KeyboardInterrupt:
+                state["interrupted"] = True
+                _signal_group(proc, signal.SIGINT)
+        if timed_out:
+            _kill_tree(proc)
+            try:
+                proc.wait(timeout=3)
+            except subprocess.TimeoutExpired:
+                _kill_tree(proc, force=True)
+                proc.wait()
+            if os.name != "nt":
+                # 进程组中先于/晚于shell退出的命令也一并结束
+                _signal_group(proc, signal.SIGKILL)
+    finally:
+        if terminal is not None:
+            _set_foreground(terminal, os.getpgrp())
+            os.close(terminal)
+        for signum, handler in previous_handlers.items():
+            signal.signal(signum, handler)
+    if terminal is not None and proc.returncode in (-signal.SIGINT, 128 + signal.SIGINT):
+        # 终端的 Ctrl+C 直接发给了子进程的进程组
+        state["interrupted"] = True
+
+    # 子进程退出后管道中剩余的数据很快就能读完；
+    # 其派生的后台进程可能仍持有管道，因此只等待有限的时间
+    drain_deadline = time.monotonic() + 2
+    for reader in readers:
+        reader.join(timeout=max(0.0, drain_deadline - time.monotonic()))
+    for sink in sinks:
+        if isinstance(sink, PrefixedSink):
+            try:
+                sink.close()
+            except (OSError, ValueError):
+                pass
+
+    return CommandResult(
+        proc.returncode,
+        stdout_buf.getvalue(),
+        stderr_buf.getvalue(),
+        timed_out=timed_out,
+        interrupted=state["interrupted"],
+        truncated=stdout_buf.dropped > 0 or stderr_buf.dropped > 0)
@@ -0,0 +1,82 @@
+import shutil
+
+import pytest
+
+import cmdcheck
+
+
+@pytest.mark.parametrize("command, expected", [
+    ("ls -la", ["ls"]),
+    ("cat a.txt | grep foo | wc -l", ["cat", "grep", "wc"]),
+    ("cd /tmp && make || echo failed", ["make"]),
+    ("sudo -u root systemctl restart nginx", ["sudo", "systemctl"]),
+    ("timeout 5 curl -s example.com", ["timeout", "curl"]),
+    ("FOO=1 BAR=2 python script.py", ["python"]),
+    ("find . -name '*.py' | xargs -n 1 wc -l", ["find", "xargs", "wc"]),
+    ("for f in *.txt; do wc -l $f; done", ["wc"]),
+    ("if [ -f a ]; then cat a; else touch a; fi", ["cat", "touch"]),
+    ("(cd src && make) > build.log", ["make"]),
+    ("sort < in.txt > out.txt", ["sort"]),
+    ("echo hi # rm -rf /", []),
+    ("case $x in a) ls;; b) ls;; esac", ["ls", "ls"]),
+    ("case $x in (a|b) ls -l ;; *) cat ;; esac; whoami", ["ls", "cat", "whoami"]),
+    ('case "$1" in start) nginx;; stop) nginx -s stop;; esac && date', ["nginx", "nginx", "date"]),
+])
+def test_leading_executables_posix(command, expected):
+    assert cmdcheck.leading_executables(command, "/bin/bash") == expected
+
+
+def test_leading_executables_unbalanced_quotes():
+    assert cmdcheck.leading_executables("echo 'unterminated", "/bin/bash") == []
+
+
+def test_leading_executables_cmd_and_powershell():
+    assert cmdcheck.leading_executables("dir /b && findstr foo a.txt", "cmd.exe") == ["dir", "findstr"]
+    assert cmdcheck.leading_executables("Get-ChildItem | Where-Object Length -gt 1", "pwsh") == [
+        "Get-ChildItem", "Where-Object"]
+
+
+def test_missing_executables(monkeypatch):
+    installed = {"ls", "grep"}
+    monkeypatch.setattr(cmdcheck.shutil, "which", lambda name: f"/usr/bin/{name}" if name in installed else None)
+    assert cmdcheck.missing_executables("ls | grep x | nosuchtool && nosuchtool", "/bin/bash") == ["nosuchtool"]
+    assert cmdcheck.missing_executables("case $x in a) ls;; b) ls;; esac", "/bin/bash") == []
+    # 内建命令、带路径的脚本和 PowerShell cmdlet 不检查
+    assert cmdcheck.missing_executables("cd /tmp && ./build.sh", "/bin/bash") == []
+    assert cmdcheck.missing_executables("Get-Process", "pwsh") == []
+    assert cmdcheck.missing_executables("dir /b", "cmd.exe") == []
+
+
+@pytest.mark.parametrize("shell, family", [
+    ("/bin/bash", "posix"), ("/usr/bin/zsh", "posix"), ("powershell.exe", "powershell"),
+    ("pwsh", "powershell"), ("cmd.exe", "cmd"),
+])
+def test_shell_family(shell, family):
+    assert cmdcheck.shell_family(shell) == family
+
+
+@pytest.mark.skipif(shutil.which("bash") is None, reason="需要 bash")
+def test_check_syntax_posix():
+    bash = shutil.which("bash")
+    assert cmdcheck.check_syntax("for f in *; do echo $f; done", bash) == (True, "")
+    ok, diagnostic = cmdcheck.check_syntax("for f in *; do echo $f", bash)
+    assert not ok and diagnostic
+
+
+def test_check_syntax_skips_cmd():
+    assert cmdcheck.check_syntax("dir /b", "cmd.exe") == (True, "")
+
+
+def test_rank_candidates(monkeypatch):
+    monkeypatch.setattr(cmdcheck, "check_syntax", lambda command, shell: (True, ""))
+    monkeypatch.setattr(cmdcheck.shutil, "which", lambda name: None if name == "nosuchtool" else f"/usr/bin/{name}")
+    ranked = cmdcheck.rank_candidates(
+        ["ls -la", "nosuchtool -x", "du -sh  .", "du -sh .", "find . -type f"], "/bin/bash",
+        failed_commands=["ls -la"])
+    commands = [command for command, _ in ranked]
+    # 多个候选一致的排在最前，失败过的和程序不存在的排在后面
+    assert commands[0] == "du -sh  ."
+    assert commands[-2:] == ["nosuchtool -x", "ls -la"]
+    notes = dict(ranked)
+    assert notes["ls -la"] == ["与之前失败的命令相同"]
+    assert notes["nosuchtool -x"] == ["未找到程序: nosuchtool"]
@@ -0,0 +1,93 @@
+import pytest
+
+import cmdhistory
+
+SHELL = "/bin/bash"
+OS_NAME = "Linux/Ubuntu"
+
+
+@pytest.fixture
+def history(tmp_path):
+    h = cmdhistory.CommandHistory(str(tmp_path / "history.sqlite3"))
+    yield h
+    h.close()
+
+
+def test_normalize_and_ngrams():
+    assert cmdhistory.normalize("  List ALL files?? ") == "list all files"
+    assert cmdhistory.normalize("列出文件。") == "列出文件"
+    assert cmdhistory.ngrams("ab") == {" ab": 1, "ab ": 1}
+    assert sum(cmdhistory.ngrams("列出文件").values()) == 4
+
+
+def test_empty_history(history):
+    assert history.search("list files", SHELL, OS_NAME) == []
+
+
+def test_exact_match_ignores_case_and_punctuation(history):
+    history.record("List all files", SHELL, OS_NAME, "ls -la")
+    assert history.search("list all files?", SHELL, OS_NAME) == [(1.0, "List all files", "ls -la")]
+
+
+def test_fuzzy_match_ranks_similar_question_first(history):
+    history.record("find the 10 largest files in this directory", SHELL, OS_NAME, "du -ah . | sort -rh | head -n 10")
+    history.record("show disk usage", SHELL, OS_NAME, "df -h")
+    history.record("列出当前目录下最大的10个文件", SHELL, OS_NAME, "ls -S | head -n 10")
+    similarity, past_query, command = history.search("find the 10 largest files in this folder", SHELL, OS_NAME)[0]
+    assert command == "du -ah . | sort -rh | head -n 10"
+    assert 0.6 < similarity < 1.0
+    similarity, _, command = history.search("列出当前目录中最大的10个文件", SHELL, OS_NAME)[0]
+    assert command == "ls -S | head -n 10"
+    assert similarity > 0.6
+
+
+def test_unrelated_question_scores_low(history):
+    history.record("show disk usage", SHELL, OS_NAME, "df -h")
+    matches = history.search("compress the logs directory", SHELL, OS_NAME)
+    assert not matches or matches[0][0] < 0.5
+
+
+def test_results_are_scoped_to_shell_and_os(history):
+    history.record("list all files", SHELL, OS_NAME, "ls -la")
+    assert history.search("list all files", "pwsh", OS_NAME) == []
+    assert history.search("list all files", SHELL, "Darwin/macOS") == []
+
+
+def test_failed_command_is_no_longer_suggested(history):
+    history.record("restart the web server", SHELL, OS_NAME, "systemctl restart nginx")
+    history.mark_failed(SHELL, OS_NAME, "systemctl restart nginx", 1)
+    assert history.search("restart the web server", SHELL, OS_NAME) == []
+    # 再次执行成功后恢复推荐
+    history.record("restart the web server", SHELL, OS_NAME, "systemctl restart nginx")
+    assert history.search("restart the web server", SHELL, OS_NAME)[0][2] == "systemctl restart nginx"
+
+
+def test_repeated_record_updates_instead_of_duplicating(history):
+    for _ in range(3):
+        history.record("list all files", SHELL, OS_NAME, "ls -la")
+    history.record("list all files", SHELL, OS_NAME, "ls -A")
+    assert history.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0] == 2
+    # 使用次数多的命令优先
+    assert history.search("list all files", SHELL, OS_NAME)[0][2] == "ls -la"
+
+
+def test_blank_records_are_ignored(history):
+    history.record("???", SHELL, OS_NAME, "ls")
+    history.record("list files", SHELL, OS_NAME, "   ")
+    assert history.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0] == 0
+
+
+def test_eviction_keeps_newest_entries_and_index_consistent(tmp_path):
+    history = cmdhistory.CommandHistory(str(tmp_path / "history.sqlite3"), max_entries=10)
+    try:
+        for i in range(12):
+            history.record(f"question number {i}", SHELL, OS_NAME, f"echo {i}")
+        # 超出10%后才淘汰，淘汰后恰好剩下 max_entries 条
+        assert history.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0] == 10
+        assert history.search("question number 0", SHELL, OS_NAME)[0][2] != "echo 0"
+        assert history.search("question number 11", SHELL, OS_NAME)[0] == (1.0, "question number 11", "echo 11")
+        orphans = history.conn.execute(
+            "SELECT COUNT(*) FROM postings WHERE entry_id NOT IN (SELECT id FROM entries)").fetchone()[0]
+        assert orphans == 0
+    finally:
+        history.close()
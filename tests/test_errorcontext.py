@@ -0,0 +1,79 @@
+import errorcontext
+
+
+def attempt(command="make", returncode=2, stdout="", stderr=""):
+    return {"command": command, "returncode": returncode, "stdout": stdout, "stderr": stderr}
+
+
+def test_strip_ansi_and_progress_bars():
+    text = "\x1b[31merror\x1b[0m: boom\n\x1b]0;title\x07done\n 10%\r 50%\r100%\n"
+    assert errorcontext.strip_ansi(text) == "error: boom\ndone\n100%\n"
+    assert errorcontext.strip_ansi("line\r\nnext") == "line\nnext"
+
+
+def test_collapse_repeats():
+    assert errorcontext.collapse_repeats(["a", "a", "a", "b", "a"]) == ["a  [重复 3 次]", "b", "a"]
+    assert errorcontext.collapse_repeats([]) == []
+
+
+def test_estimate_tokens():
+    assert errorcontext.estimate_tokens("") == 0
+    assert errorcontext.estimate_tokens("abcdefgh") == 2
+    assert errorcontext.estimate_tokens("找不到文件") == 5
+
+
+def test_fit_to_budget_keeps_short_output():
+    assert errorcontext.fit_to_budget("  one\ntwo  \n", 100) == "one\ntwo"
+
+
+def test_fit_to_budget_keeps_head_and_more_tail():
+    lines = [f"line {i:04d} " + "x" * 40 for i in range(1000)]
+    fitted = errorcontext.fit_to_budget("\n".join(lines), 300)
+    assert errorcontext.estimate_tokens(fitted) <= 300 + 20
+    kept = fitted.split("\n")
+    marker = next(i for i, line in enumerate(kept) if line.startswith("... [省略"))
+    assert kept[0] == lines[0] and kept[-1] == lines[-1]
+    assert len(kept) - marker - 1 > marker  # 结尾保留的行多于开头
+    omitted = int(kept[marker].split()[2])
+    assert omitted == 1000 - (len(kept) - 1)
+
+
+def test_long_lines_are_clipped():
+    fitted = errorcontext.fit_to_budget("{" + "a" * 5000 + "}", 10000)
+    assert len(fitted) < 500
+    assert fitted.endswith(f"...[截断 {5002 - errorcontext.MAX_LINE_CHARS} 个字符]")
+
+
+def test_last_error_line_prefers_stderr():
+    assert errorcontext.last_error_line(attempt(stdout="out\n", stderr="warn\nfatal: nope\n\n")) == "fatal: nope"
+    assert errorcontext.last_error_line(attempt(stdout="only stdout\n")) == "only stdout"
+    assert errorcontext.last_error_line(attempt()) == "无输出"
+
+
+def test_build_error_context_stays_within_budget():
+    noisy = "\n".join(f"\x1b[33mwarning {i}: something\x1b[0m" for i in range(5000)) + "\nerror: the real cause"
+    context = errorcontext.build_error_context("build the project", [attempt(stderr=noisy, stdout="x" * 100000)],
+                                              budget_tokens=800, hint="换一种方法")
+    assert errorcontext.estimate_tokens(context) <= 800 * 1.2
+    assert "error: the real cause" in context
+    assert "\x1b" not in context
+    assert "原始任务: build the project" in context and "重要提示: 换一种方法" in context
+
+
+def test_build_error_context_summarizes_earlier_attempts():
+    attempts = [
+        attempt("make all", 2, stderr="make: *** No rule to make target 'all'.\n"),
+        attempt("ninja", 127, stderr="bash: ninja: command not found\n"),
+        attempt("cmake --build .", 1, stdout="configuring\n", stderr="CMake Error: no CMakeLists.txt\n"),
+    ]
+    context = errorcontext.build_error_context("build the project", attempts)
+    assert context.startswith("第3次重试：")
+    assert "1. 'make all' (返回码 2): make: *** No rule to make target 'all'." in context
+    assert "2. 'ninja' (返回码 127): bash: ninja: command not found" in context
+    assert "最近一次尝试的命令: 'cmake --build .'" in context
+    assert "错误输出: CMake Error: no CMakeLists.txt" in context and "标准输出: configuring" in context
+
+
+def test_build_error_context_without_output():
+    context = errorcontext.build_error_context("do it", [attempt(returncode=1)])
+    assert "命令返回码: 1，无详细错误信息" in context
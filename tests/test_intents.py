@@ -0,0 +1,103 @@
+import json
+
+import pytest
+
+import intents
+
+
+@pytest.fixture
+def matcher(monkeypatch):
+    # 假定模板所需的程序都已安装，结果不依赖测试机器
+    monkeypatch.setattr(intents.shutil, "which", lambda name: f"/usr/bin/{name}")
+    return intents.IntentMatcher()
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("ls", ("list-files", "ls -la")),
+    ("列出当前目录下的所有文件", ("list-files", "ls -la")),
+    ("list files in /var/log", ("list-files-in", "ls -la /var/log")),
+    ("查看这个目录下的文件", ("list-files-in", "ls -la .")),
+    ("查看 src 目录下的文件", ("list-files-in", "ls -la src")),
+    ("pwd", ("current-directory", "pwd")),
+    ("查看当前目录", ("current-directory", "pwd")),
+    ("查看磁盘使用情况", ("disk-usage", "df -h")),
+    ("how big is .", ("directory-size", "du -sh .")),
+    ("how big is ..", ("directory-size", "du -sh ..")),
+    ("show the size of ~/Downloads", ("directory-size", "du -sh ~/Downloads")),
+    ("查看当前目录的大小", ("directory-size", "du -sh .")),
+    ("显示当前文件夹的大小", ("directory-size", "du -sh .")),
+    ("查看此目录的大小", ("directory-size", "du -sh .")),
+    ("查看build目录的大小", ("directory-size", "du -sh build")),
+    ("find files named a.txt", ("find-by-name", "find . -name a.txt")),
+    ("find *.log in /tmp", ("find-by-name", "find /tmp -name '*.log'")),
+    ("在当前目录下查找名为a.txt的文件", ("find-by-name", "find . -name a.txt")),
+    ("在本文件夹中查找名为a.txt的文件", ("find-by-name", "find . -name a.txt")),
+    ("在src目录下查找名为a.txt的文件", ("find-by-name", "find src -name a.txt")),
+    ("查找所有*.py文件", ("find-by-name", "find . -name '*.py'")),
+    ("what process is using port 8080?", ("port-owner", "lsof -i :8080")),
+    ("杀死占用8080端口的进程", ("kill-by-port", "kill $(lsof -t -i :8080)")),
+    ("tail the last 50 lines of /var/log/syslog", ("tail-file", "tail -n 50 /var/log/syslog")),
+    ("显示 app.log 的最后 10 行", ("tail-file", "tail -n 10 app.log")),
+])
+def test_builtin_intents_posix(matcher, query, expected):
+    assert matcher.match(query, "/bin/bash") == expected
+
+
+@pytest.mark.parametrize("query", [
+    "",
+    "list files and delete them",
+    "how big is the moon",
+    "find files named a.txt; rm -rf ~",
+    "帮我写一个备份脚本",
+])
+def test_unmatched_queries_go_to_model(matcher, query):
+    assert matcher.match(query, "/bin/bash") is None
+
+
+def test_arguments_are_quoted_per_shell(matcher):
+    assert matcher.match("find files named a'b.txt", "/bin/bash") == ("find-by-name", "find . -name 'a'\"'\"'b.txt'")
+    assert matcher.match("find files named a'b.txt", "pwsh") == (
+        "find-by-name", "Get-ChildItem -Path '.' -Recurse -Filter 'a''b.txt'")
+    assert matcher.match("查看当前目录的大小", "pwsh")[1].startswith("(Get-ChildItem '.' ")
+
+
+def test_cmd_rejects_unsafe_arguments(matcher):
+    assert matcher.match("find files named a&b.txt", "cmd.exe") is None
+    assert matcher.match("find files named a.txt", "cmd.exe") == ("find-by-name", "dir /s /b .\\a.txt")
+
+
+def test_missing_shell_template_goes_to_model(matcher):
+    assert matcher.match("tail the last 5 lines of a.log", "cmd.exe") is None
+
+
+def test_falls_back_to_next_available_program(monkeypatch):
+    monkeypatch.setattr(intents.shutil, "which", lambda name: None if name == "lsof" else f"/usr/bin/{name}")
+    assert intents.IntentMatcher().match("who is using port 22", "/bin/bash") == (
+        "port-owner", "ss -ltnp sport = :22")
+
+
+def test_normalize_query_keeps_trailing_dot():
+    assert intents.normalize_query("  how   big is .  ") == "how big is ."
+    assert intents.normalize_query("查看磁盘使用情况？") == "查看磁盘使用情况"
+
+
+def test_may_match_ignores_shell(matcher):
+    assert matcher.may_match("show disk usage")
+    assert not matcher.may_match("write a backup script")
+
+
+def test_user_intents_take_precedence(tmp_path, matcher):
+    user_file = tmp_path / "intents.json"
+    user_file.write_text(json.dumps([
+        {"name": "my-ls", "patterns": ["ls"], "templates": {"posix": "ls -lah --color"}},
+    ]), encoding="utf-8")
+    assert intents.IntentMatcher(user_file=str(user_file)).match("ls", "/bin/bash") == ("my-ls", "ls -lah --color")
+
+
+def test_intent_stats_round_trip(tmp_path):
+    path = str(tmp_path / "intent_stats.json")
+    intents.IntentStats(path).record("list-files", None, "list-files")
+    stats = intents.IntentStats(path)
+    assert stats.data["queries"] == 3
+    assert stats.data["by_intent"] == {"list-files": 2}
+    assert stats.hit_rate == pytest.approx(2 / 3)
@@ -0,0 +1,77 @@
+import mmsession
+from errorcontext import estimate_tokens
+
+
+def success():
+    return {"status": "success", "returncode": 0, "stdout": "", "stderr": ""}
+
+
+def test_describe_outcome():
+    assert mmsession.describe_outcome(None) == "未执行"
+    assert mmsession.describe_outcome(success()) == "执行成功"
+    assert mmsession.describe_outcome({"status": "timeout"}) == "执行超时"
+    assert mmsession.describe_outcome({"status": "interrupted"}) == "被用户中断"
+    failed = {"status": "failed", "returncode": 2, "stdout": "", "stderr": "ls: x: No such file\n"}
+    assert mmsession.describe_outcome(failed) == "执行失败 (返回码 2): ls: x: No such file"
+
+
+def test_empty_session():
+    assert mmsession.Session().build("list files") == ([], "list files")
+
+
+def test_messages_alternate_and_carry_outcome():
+    session = mmsession.Session()
+    session.add_turn("找出最大的10个文件", "du -ah . | sort -rh | head -n 10", success())
+    session.add_turn("只看 .log 文件", "ls *.log", {"status": "failed", "returncode": 2, "stderr": "no match"})
+    history, query = session.build("压缩它们")
+    assert [m["role"] for m in history] == ["user", "assistant", "user", "assistant"]
+    assert history[0]["content"] == "找出最大的10个文件"
+    assert history[2]["content"] == "(上一条命令执行成功)\n只看 .log 文件"
+    assert history[3]["content"] == "ls *.log"
+    assert query == "(上一条命令执行失败 (返回码 2): no match)\n压缩它们"
+
+
+def test_long_turns_are_clipped():
+    session = mmsession.Session()
+    session.add_turn("q" * 1000, "c" * 1000)
+    turn = session.turns[0]
+    assert len(turn["query"]) == mmsession.MAX_TURN_CHARS + 3
+    assert turn["outcome"] == "未执行"
+
+
+def test_compaction_keeps_requests_bounded():
+    session = mmsession.Session(budget_tokens=400)
+    sizes = []
+    for i in range(200):
+        session.add_turn(f"question {i} " + "detail " * 10, f"echo {i} " + "arg " * 10, success())
+        history, _ = session.build("next")
+        sizes.append(sum(estimate_tokens(m["content"]) for m in history))
+    # 请求长度有上限，不随会话增长
+    assert max(sizes[50:]) <= 400
+    assert max(sizes[150:]) <= max(sizes[50:100]) + 20
+    assert session.dropped > 0
+    history, _ = session.build("next")
+    first = history[0]["content"]
+    assert first.startswith("之前的会话摘要 (问题 => 命令 (执行结果)):\n(更早的")
+    assert "question 199" in history[-2]["content"]
+
+
+def test_compaction_keeps_prefix_stable_between_compactions():
+    session = mmsession.Session(budget_tokens=400)
+    prefixes = []
+    for i in range(40):
+        session.add_turn(f"question {i} " + "detail " * 10, f"echo {i}", success())
+        history, _ = session.build("next")
+        prefixes.append(history[0]["content"])
+    # 一次压缩多轮，因此大多数轮次之间第一条消息不变
+    changes = sum(1 for a, b in zip(prefixes, prefixes[1:]) if a != b)
+    assert changes < len(prefixes) // 2
+
+
+def test_reset():
+    session = mmsession.Session(budget_tokens=200)
+    for i in range(30):
+        session.add_turn(f"question {i}", f"echo {i}", success())
+    session.reset()
+    assert session.build("again") == ([], "again")
+    assert session.dropped == 0
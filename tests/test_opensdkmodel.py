@@ -0,0 +1,97 @@
+import asyncio
+import json
+
+import pytest
+
+import opensdkmodel
+import ratelimit
+
+
+def test_parse_endpoints(monkeypatch):
+    monkeypatch.setenv("BACKUP_KEY", "sk-backup")
+    assert opensdkmodel.parse_endpoints(
+        " https://b.example.com/v1 | gpt-x | BACKUP_KEY ; http://localhost:11434/v1|llama3| ;; ") == [
+        ("https://b.example.com/v1", "gpt-x", "sk-backup"),
+        ("http://localhost:11434/v1", "llama3", "none"),
+    ]
+    assert opensdkmodel.parse_endpoints("") == []
+    assert opensdkmodel.parse_endpoints(None) == []
+
+
+@pytest.fixture
+def stats(tmp_path):
+    return opensdkmodel.EndpointStats(str(tmp_path / "endpoints.json"))
+
+
+def test_ewma_and_cooldown(stats, monkeypatch):
+    stats.record_success("a", 100)
+    stats.record_success("a", 200)
+    assert stats.get("a")["ewma_ms"] == pytest.approx(130)
+    # 被取消的请求只在确实更慢时计入
+    stats.record_slow("a", 90, 80)
+    assert stats.get("a")["ewma_ms"] == pytest.approx(130)
+    stats.record_slow("a", 330, 80)
+    assert stats.get("a")["ewma_ms"] == pytest.approx(190)
+    monkeypatch.setattr(opensdkmodel.time, "time", lambda: 1000.0)
+    stats.record_failure("a")
+    stats.record_failure("a")
+    assert stats.get("a")["down_until"] == 1000.0 + 2 * opensdkmodel.EndpointStats.BASE_COOLDOWN
+    stats.record_success("a", 100)
+    assert stats.get("a")["failures"] == 0 and stats.get("a")["down_until"] == 0
+
+
+def test_stats_persist(stats, tmp_path):
+    stats.record_success("a", 42)
+    stats.save()
+    assert opensdkmodel.EndpointStats(str(tmp_path / "endpoints.json")).get("a")["ewma_ms"] == 42
+
+
+def hedged(stats, *bases):
+    return opensdkmodel.HedgedModel([(base, "m", "k") for base in bases], hedge_delay_ms=500, stats=stats)
+
+
+def test_ordered_models_prefers_fast_healthy_endpoints(stats):
+    model = hedged(stats, "http://a", "http://b", "http://c", "http://d")
+    # 没有统计数据的端点按对冲延迟估计，配置顺序决定同类端点的先后
+    assert [m.api_base for m in model.ordered_models()] == ["http://a", "http://b", "http://c", "http://d"]
+    stats.record_success("http://c|m", 100)
+    stats.record_success("http://a|m", 900)
+    stats.record_success("http://b|m", 50)
+    stats.record_failure("http://b|m")
+    assert [m.api_base for m in model.ordered_models()] == ["http://c", "http://d", "http://a", "http://b"]
+
+
+class StubEndpoint:
+    def __init__(self, api_base, error=None, reply="ls"):
+        self.api_base = api_base
+        self.model_name = "m"
+        self.error = error
+        self.reply = reply
+        self.rate_limiter = ratelimit.RateLimiter("stub", 0, 0)
+        self.calls = 0
+
+    async def achat(self, messages, model=None, temperature=0.7, max_tokens=2048):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return self.reply
+
+
+def test_achat_fails_over_and_saves_stats(stats, tmp_path):
+    model = hedged(stats, "http://a", "http://b")
+    model.models = [StubEndpoint("http://a", error=RuntimeError("boom")), StubEndpoint("http://b")]
+    assert asyncio.run(model.achat([{"role": "user", "content": "list"}])) == "ls"
+    with open(tmp_path / "endpoints.json", encoding="utf-8") as f:
+        saved = json.load(f)
+    assert saved["http://a|m"]["failures"] == 1
+    assert saved["http://b|m"]["ewma_ms"] >= 0
+    # 之后的批量请求先发给健康的端点
+    assert [m.api_base for m in model.ordered_models()] == ["http://b", "http://a"]
+
+
+def test_achat_reports_when_every_endpoint_is_rate_limited(stats):
+    model = hedged(stats, "http://a", "http://b")
+    error = ratelimit.RateLimitExceeded("429", retry_after=2)
+    model.models = [StubEndpoint("http://a", error=error), StubEndpoint("http://b", error=error)]
+    with pytest.raises(ratelimit.RateLimitExceeded, match="所有 2 个端点均返回请求频率超限"):
+        asyncio.run(model.achat([{"role": "user", "content": "list"}]))
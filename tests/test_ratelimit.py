@@ -0,0 +1,171 @@
+import asyncio
+import email.utils
+import os
+import time
+import types
+
+import pytest
+
+import ratelimit
+
+
+class FakeClock:
+    """替换 ratelimit 中的 time 模块，sleep 只推进时间"""
+    def __init__(self):
+        self.now = 1_000_000.0
+        self.slept = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(ratelimit, "time", types.SimpleNamespace(time=clock.time, sleep=clock.sleep))
+    return clock
+
+
+@pytest.fixture
+def notices():
+    received = []
+    with ratelimit.redirect_notices(received.append):
+        yield received
+
+
+def limiter(tmp_path, rpm=0, tpm=0):
+    return ratelimit.RateLimiter("https://api.example.com/v1|sk-test", rpm, tpm, path=str(tmp_path / "ratelimit.json"))
+
+
+def test_disabled_limiter_touches_no_files(tmp_path, clock):
+    rl = limiter(tmp_path)
+    assert not rl.enabled
+    assert rl.acquire(1000) == 0.0
+    rl.settle(1000, 10)
+    rl.block(30)
+    assert os.listdir(tmp_path) == []
+
+
+def test_requests_per_minute(tmp_path, clock, notices):
+    rl = limiter(tmp_path, rpm=2)
+    assert rl.acquire() == 0.0
+    assert rl.acquire() == 0.0
+    # 桶已空：按每分钟2个的速度，补满一个请求需要30秒
+    waited = rl.acquire()
+    assert 30 <= waited <= 30 * 1.05 + 0.02
+    assert len(notices) == 1 and "RATE_LIMIT_RPM" in notices[0]
+
+
+def test_tokens_per_minute_and_oversized_request(tmp_path, clock, notices):
+    rl = limiter(tmp_path, tpm=600)
+    assert rl.acquire(500) == 0.0
+    # 剩余100个，还需要补充300个token，即30秒
+    assert 30 <= rl.acquire(400) <= 30 * 1.05 + 0.02
+    # 超过桶容量的请求只需等桶满
+    clock.now += 120
+    assert rl.acquire(10_000) == 0.0
+
+
+def test_settle_refunds_unused_reservation(tmp_path, clock, notices):
+    rl = limiter(tmp_path, tpm=1000)
+    assert rl.acquire(1000) == 0.0
+    # 实际只用了200个，退还800个
+    rl.settle(1000, 200)
+    assert rl.acquire(800) == 0.0
+    # 没有发出的请求全部退还
+    clock.now += 60
+    assert rl.acquire(1000) == 0.0
+    rl.settle(1000, 0)
+    assert rl.acquire(1000) == 0.0
+    assert notices == []
+
+
+def test_state_is_shared_between_instances(tmp_path, clock, notices):
+    assert limiter(tmp_path, rpm=1).acquire() == 0.0
+    assert limiter(tmp_path, rpm=1).acquire() > 0
+    # 不同的 API_BASE/密钥 使用各自的额度
+    other = ratelimit.RateLimiter("https://other.example.com/v1|sk-x", 1, 0, path=str(tmp_path / "ratelimit.json"))
+    assert other.acquire() == 0.0
+
+
+def test_block_pauses_every_process(tmp_path, clock, notices):
+    rl = limiter(tmp_path, rpm=100)
+    rl.block(12)
+    waited = limiter(tmp_path, rpm=100).acquire()
+    assert 12 <= waited <= 12 * 1.05 + 0.02
+    assert "429" in notices[0]
+
+
+def test_unwritable_state_fails_open(tmp_path, clock):
+    rl = ratelimit.RateLimiter("k", 1, 0, path=str(tmp_path / "missing" / "ratelimit.json"))
+    assert rl.acquire() == 0.0
+    assert rl.acquire() == 0.0
+    rl.block(10)
+    rl.settle(10, 1)
+
+
+def test_acquire_async(tmp_path, clock, notices, monkeypatch):
+    async def fake_sleep(seconds):
+        clock.sleep(seconds)
+    monkeypatch.setattr(asyncio, "sleep", fake_sleep)
+    rl = limiter(tmp_path, rpm=1)
+    assert asyncio.run(rl.acquire_async()) == 0.0
+    assert 60 <= asyncio.run(rl.acquire_async()) <= 60 * 1.05 + 0.02
+
+
+def test_backoff_delay():
+    for attempt in range(10):
+        delay = ratelimit.backoff_delay(attempt)
+        expected = min(ratelimit.MAX_BACKOFF, ratelimit.BASE_BACKOFF * 2 ** attempt)
+        assert expected * 0.5 <= delay <= expected
+    assert 3 <= ratelimit.backoff_delay(0, 3) <= 3.3
+    assert ratelimit.backoff_delay(0, 3600) <= ratelimit.MAX_BACKOFF * 1.1
+
+
+def fake_error(status=429, headers=None):
+    response = types.SimpleNamespace(headers=headers or {})
+    return types.SimpleNamespace(status_code=status, response=response)
+
+
+def test_retry_after_seconds():
+    assert ratelimit.retry_after_seconds(fake_error(headers={"retry-after-ms": "1500"})) == 1.5
+    assert ratelimit.retry_after_seconds(fake_error(headers={"retry-after": "7"})) == 7.0
+    date = email.utils.formatdate(time.time() + 30, usegmt=True)
+    assert 25 <= ratelimit.retry_after_seconds(fake_error(headers={"retry-after": date})) <= 30
+    assert ratelimit.retry_after_seconds(fake_error(headers={"retry-after": "soon"})) is None
+    assert ratelimit.retry_after_seconds(fake_error()) is None
+    assert ratelimit.retry_after_seconds(ValueError("no response")) is None
+    assert ratelimit.retry_after_seconds(ratelimit.RateLimitExceeded("x", 4.0)) == 4.0
+
+
+def test_error_classification():
+    assert ratelimit.is_rate_limited(fake_error(429))
+    assert ratelimit.is_rate_limited(ratelimit.RateLimitExceeded("x"))
+    assert not ratelimit.is_rate_limited(fake_error(500))
+    assert ratelimit.is_transient(fake_error(503))
+    assert ratelimit.is_transient(fake_error(408))
+    assert not ratelimit.is_transient(fake_error(400))
+    assert not ratelimit.is_transient(fake_error(429))
+
+
+def test_token_estimates():
+    messages = [{"role": "system", "content": "abcd" * 10}, {"role": "user", "content": "列出文件"}]
+    assert ratelimit.estimate_request_tokens(messages, 100) == (10 + 4) + (4 + 4) + 100
+    assert ratelimit.estimate_used_tokens(messages, "ls -la") == (10 + 4) + (4 + 4) + 2
+
+
+def test_notices_go_to_handler_only_when_long(notices):
+    ratelimit.notify_wait(0.2, "短暂排队")
+    ratelimit.notify_wait(2.5, "达到客户端限流")
+    assert notices == ["⏳ 达到客户端限流，等待 2.5 秒..."]
+
+
+def test_rate_limit_retries_from_env(monkeypatch):
+    monkeypatch.setenv("RATE_LIMIT_RETRIES", "3")
+    assert ratelimit.get_rate_limit_retries() == 3
+    monkeypatch.setenv("RATE_LIMIT_RETRIES", "many")
+    assert ratelimit.get_rate_limit_retries() == 5
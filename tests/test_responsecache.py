@@ -0,0 +1,76 @@
+import pytest
+
+import responsecache
+
+
+class FakeTime:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeTime()
+    monkeypatch.setattr(responsecache.time, "time", clock.time)
+    return clock
+
+
+def cache(tmp_path, **kwargs):
+    return responsecache.ResponseCache(str(tmp_path / "responses.sqlite3"), **kwargs)
+
+
+def key(query, **overrides):
+    params = dict(shell="/bin/bash", os_name="Linux", model="m", temperature=0.7, system_prompt="prompt")
+    params.update(overrides)
+    return responsecache.ResponseCache.make_key(query, **params)
+
+
+def test_key_normalizes_question_but_not_parameters():
+    assert key("List files?") == key("  list   FILES ")
+    assert key("list files") != key("list files", shell="pwsh")
+    assert key("list files") != key("list files", temperature=0.2)
+    assert key("list files") != key("list files", system_prompt="other prompt")
+
+
+def test_hit_miss_and_stats(tmp_path, clock):
+    c = cache(tmp_path)
+    assert c.get(key("a")) is None
+    c.put(key("a"), "ls")
+    assert c.get(key("a")) == "ls"
+    stats = c.stats()
+    assert (stats["entries"], stats["hits"], stats["misses"]) == (1, 1, 1)
+    c.invalidate(key("a"))
+    assert c.get(key("a")) is None
+    c.clear()
+    assert c.stats()["hits"] == 0
+
+
+def test_ttl(tmp_path, clock):
+    c = cache(tmp_path, ttl=60)
+    c.put(key("a"), "ls")
+    clock.now += 59
+    assert c.get(key("a")) == "ls"
+    # 过期以写入时间为准，访问不会延长
+    clock.now += 2
+    assert c.get(key("a")) is None
+
+
+def test_lru_eviction(tmp_path, clock):
+    c = cache(tmp_path, max_entries=2, ttl=0)
+    c.put(key("a"), "1")
+    clock.now += 1
+    c.put(key("b"), "2")
+    clock.now += 1
+    assert c.get(key("a")) == "1"
+    clock.now += 1
+    c.put(key("c"), "3")
+    assert c.get(key("b")) is None
+    assert c.get(key("a")) == "1" and c.get(key("c")) == "3"
+
+
+def test_shared_between_connections(tmp_path, clock):
+    cache(tmp_path).put(key("a"), "ls")
+    assert cache(tmp_path).get(key("a")) == "ls"
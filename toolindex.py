@@ -0,0 +1,222 @@
+import json
+import os
+import platform
+import subprocess
+
+from cachedir import get_cache_dir
+
+INDEX_VERSION = 1
+# 写入系统提示词的常用工具：模型经常使用但不一定安装的程序，按类别排列
+CURATED_TOOLS = (
+    "rg", "fd", "fdfind", "ag", "fzf", "jq", "yq", "bat", "batcat", "eza", "exa", "tree",
+    "git", "curl", "wget", "rsync", "ssh", "nc", "python3", "python", "node", "perl",
+    "gawk", "zip", "unzip", "7z", "xz", "zstd", "ffmpeg", "convert", "magick",
+    "docker", "podman", "kubectl", "systemctl", "journalctl", "ip", "ss", "netstat", "lsof",
+    "apt", "dnf", "yum", "pacman", "apk", "brew", "sudo", "parallel", "pwsh",
+    "winget", "choco", "scoop",
+)
+WINDOWS_TOOLS = {"winget", "choco", "scoop"}
+# 需要区分 GNU/BSD/BusyBox 版本的核心工具：不同版本的参数差异是命令失败的常见原因
+FLAVOUR_TOOLS = ("grep", "sed", "find", "date", "stat", "xargs", "tar", "awk", "ls")
+PROBE_TIMEOUT = 2  # 探测单个工具版本的超时时间(秒)
+
+
+def get_path_dirs():
+    """
+    $PATH 中的目录(去重，保持顺序)
+    """
+    seen, dirs = set(), []
+    for entry in os.environ.get("PATH", "").split(os.pathsep):
+        if entry and entry not in seen:
+            seen.add(entry)
+            dirs.append(entry)
+    return dirs
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def path_signature():
+    """
+    $PATH 各目录的修改时间，安装或删除程序后会变化；只需要少量 stat 调用。
+    """
+    return [[d, _mtime(d)] for d in get_path_dirs()]
+
+
+def _executable_names(directory):
+    """
+    列出目录中的可执行文件名；Windows下按 PATHEXT 判断并去掉扩展名。
+    """
+    names = []
+    if platform.system() == "Windows":
+        extensions = {e.lower() for e in os.environ.get("PATHEXT", ".COM;.EXE;.BAT;.CMD").split(";") if e}
+    else:
+        extensions = None
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    if not entry.is_file():
+                        continue
+                except OSError:
+                    continue
+                if extensions is not None:
+                    base, ext = os.path.splitext(entry.name)
+                    if ext.lower() in extensions:
+                        names.append(base.lower())
+                elif os.access(entry.path, os.X_OK):
+                    names.append(entry.name)
+    except OSError:
+        pass
+    return sorted(set(names))
+
+
+def detect_flavour(path):
+    """
+    通过 --version 的输出判断工具是 GNU、BSD 还是 BusyBox 版本。
+    """
+    try:
+        result = subprocess.run([path, "--version"], capture_output=True, text=True,
+                                timeout=PROBE_TIMEOUT, stdin=subprocess.DEVNULL)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    output = (result.stdout + result.stderr).lower()
+    if "busybox" in output:
+        return "BusyBox"
+    if "bsd" in output:
+        return "BSD"
+    if "gnu" in output:
+        return "GNU"
+    # 不支持 --version 的工具在 macOS/BSD 上是系统自带的 BSD 版本，在 Linux 上可能是 mawk 等其他实现
+    if result.returncode != 0 and platform.system() in ("Darwin", "FreeBSD", "OpenBSD", "NetBSD"):
+        return "BSD"
+    return None
+
+
+class ToolIndex:
+    """
+    $PATH 中可执行文件的索引，按目录缓存在磁盘上。
+    重建时只重新扫描修改时间变化的目录，只重新探测文件变化的核心工具版本，扫描和探测均并行进行。
+    """
+    def __init__(self, path=None):
+        """
+        参数:
+            path: 索引文件路径，默认位于用户缓存目录下的 tools.json
+        """
+        self.path = path or os.path.join(get_cache_dir(), "tools.json")
+        self.dirs = {}
+        self.flavours = {}
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if isinstance(data, dict) and data.get("version") == INDEX_VERSION:
+            self.dirs = data.get("dirs", {})
+            self.flavours = data.get("flavours", {})
+
+    def _save(self):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"version": INDEX_VERSION, "dirs": self.dirs, "flavours": self.flavours}, f)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+
+    def refresh(self):
+        """
+        增量更新索引并写回磁盘。
+        返回:
+            重新扫描的目录数
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        mtimes = {d: mtime for d, mtime in path_signature() if mtime is not None}
+        stale = [d for d, mtime in mtimes.items() if d not in self.dirs or self.dirs[d].get("mtime") != mtime]
+        with ThreadPoolExecutor(max_workers=min(16, len(stale) + len(FLAVOUR_TOOLS)) or 1) as pool:
+            for d, names in zip(stale, pool.map(_executable_names, stale)):
+                self.dirs[d] = {"mtime": mtimes[d], "names": names}
+            # 只保留仍在 $PATH 中的目录
+            self.dirs = {d: self.dirs[d] for d in mtimes if d in self.dirs}
+
+            probes = []
+            if platform.system() != "Windows":
+                for tool in FLAVOUR_TOOLS:
+                    resolved = self.resolve(tool)
+                    if resolved is None:
+                        continue
+                    real = os.path.realpath(resolved)
+                    key = f"{real}:{_mtime(real)}"
+                    if self.flavours.get(tool, {}).get("key") != key:
+                        probes.append((tool, key, resolved))
+            for (tool, key, _), flavour in zip(probes, pool.map(lambda p: detect_flavour(p[2]), probes)):
+                self.flavours[tool] = {"key": key, "flavour": flavour}
+        if stale or probes:
+            self._save()
+        return len(stale)
+
+    def resolve(self, name):
+        """
+        按 $PATH 顺序查找程序，返回完整路径，不存在时返回None
+        """
+        for d in get_path_dirs():
+            entry = self.dirs.get(d)
+            if entry and name in entry["names"]:
+                return os.path.join(d, name)
+        return None
+
+    def available(self):
+        """
+        所有可用的程序名集合
+        """
+        names = set()
+        for entry in self.dirs.values():
+            names.update(entry["names"])
+        return names
+
+    def summary(self):
+        """
+        写入系统提示词的简短摘要：已安装/未安装的常用工具，以及核心工具的版本类型。
+        """
+        names = self.available()
+        if not names:
+            return ""
+        windows = platform.system() == "Windows"
+        curated = [t for t in CURATED_TOOLS if windows or t not in WINDOWS_TOOLS]
+        installed = [t for t in curated if t in names]
+        missing = [t for t in curated if t not in names]
+        lines = []
+        if installed:
+            lines.append("* 已安装: " + ", ".join(installed))
+        if missing:
+            lines.append("* 未安装(不要使用): " + ", ".join(missing))
+        by_flavour = {}
+        for tool in FLAVOUR_TOOLS:
+            flavour = self.flavours.get(tool, {}).get("flavour")
+            if flavour and tool in names:
+                by_flavour.setdefault(flavour, []).append(tool)
+        for flavour, tools in by_flavour.items():
+            lines.append(f"* {flavour} 版本: " + ", ".join(tools) + "，只使用该版本支持的参数")
+        return "\n".join(lines)
+
+
+def build_summary():
+    """
+    增量更新索引并返回摘要，失败时返回空字符串(不影响主流程)。
+    """
+    try:
+        index = ToolIndex()
+        index.refresh()
+        return index.summary()
+    except Exception:
+        return ""
@@ -0,0 +1,213 @@
+"""
+mm 运行各阶段的耗时跟踪。
+
+各模块通过全局的 tracer 记录阶段(span)和事件，开销只有几次 perf_counter 调用。
+只有使用 --profile 或配置了 TRACE_FILE 时才开启记录：前者打印可读的耗时分解，后者把每次运行
+追加为一行JSON，便于跨机器汇总。未开启时(包括常驻的守护进程)不保存任何记录。
+
+汇总用法: python tracing.py 文件.jsonl [更多文件...]
+按阶段输出 p50/p95 耗时。
+"""
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+TRACE_VERSION = 1
+
+
+class Tracer:
+    """
+    记录一次运行中的阶段耗时。阶段可以嵌套(按线程记录嵌套深度)，
+    每个阶段可附带属性，如 token 用量、是否命中缓存、返回码等。
+    """
+    def __init__(self, start=None):
+        """
+        参数:
+            start: 运行开始时间(perf_counter)，默认为创建时间
+        """
+        self.start = start if start is not None else time.perf_counter()
+        self.spans = []
+        self.attrs = {}
+        # 是否保存记录；开启时模型客户端还会额外请求流式回复的token用量
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _offset_ms(self, t):
+        return (t - self.start) * 1000
+
+    def add_span(self, name, start, end, **attrs):
+        """
+        记录一个已结束的阶段(起止时间为 perf_counter 值)，返回其属性字典
+        """
+        span = {"name": name, "start_ms": round(self._offset_ms(start), 3),
+                "duration_ms": round((end - start) * 1000, 3),
+                "depth": len(getattr(self._local, "stack", ()))}
+        span.update(attrs)
+        if self.enabled:
+            with self._lock:
+                self.spans.append(span)
+        return span
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """
+        记录代码块的耗时。返回的字典可在代码块内补充属性，结束时一并记录。
+        """
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        span = {"name": name, "depth": len(stack)}
+        span.update(attrs)
+        start = time.perf_counter()
+        stack.append(span)
+        try:
+            yield span
+        finally:
+            end = time.perf_counter()
+            stack.pop()
+            span["start_ms"] = round(self._offset_ms(start), 3)
+            span["duration_ms"] = round((end - start) * 1000, 3)
+            if self.enabled:
+                with self._lock:
+                    self.spans.append(span)
+
+    def event(self, name, **attrs):
+        """
+        记录一个时间点(如收到第一个token)
+        """
+        now = time.perf_counter()
+        self.add_span(name, now, now, event=True, **attrs)
+
+    def set(self, **attrs):
+        """
+        设置整次运行的属性
+        """
+        self.attrs.update(attrs)
+
+    def to_record(self):
+        """
+        整次运行的JSON记录
+        """
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s["start_ms"])
+        return {
+            "version": TRACE_VERSION,
+            "ts": time.time(),
+            "total_ms": round(self._offset_ms(time.perf_counter()), 3),
+            "attrs": dict(self.attrs),
+            "spans": spans,
+        }
+
+    def report(self):
+        """
+        可读的耗时分解
+        """
+        record = self.to_record()
+        lines = [f"总耗时 {record['total_ms']:.1f} ms"]
+        for span in record["spans"]:
+            indent = "  " * (span["depth"] + 1)
+            extra = ", ".join(f"{k}={v}" for k, v in span.items()
+                              if k not in ("name", "start_ms", "duration_ms", "depth", "event"))
+            if span.get("event"):
+                line = f"{indent}@ {span['start_ms']:8.1f} ms  {span['name']}"
+            else:
+                line = f"{indent}{span['duration_ms']:8.1f} ms  {span['name']}"
+            lines.append(line + (f"  ({extra})" if extra else ""))
+        if record["attrs"]:
+            lines.append("  " + ", ".join(f"{k}={v}" for k, v in record["attrs"].items()))
+        return "\n".join(lines)
+
+    def write_jsonl(self, path):
+        """
+        把本次运行追加到JSONL文件，写入失败时忽略
+        """
+        try:
+            with open(os.path.expanduser(path), "a", encoding="utf-8") as f:
+                f.write(json.dumps(self.to_record(), ensure_ascii=False) + "\n")
+        except OSError:
+            pass
+
+
+# 全局跟踪器。mm.py 最先导入本模块，因此起点即 mm 开始导入各模块的时间
+tracer = Tracer()
+
+
+def usage_attrs(usage):
+    """
+    从接口返回的 usage 中提取token用量，包括服务端提示词缓存命中的token数：
+    OpenAI 为 prompt_tokens_details.cached_tokens，DeepSeek 为 prompt_cache_hit_tokens。
+    """
+    if usage is None:
+        return {}
+    attrs = {}
+    for name in ("prompt_tokens", "completion_tokens", "total_tokens"):
+        value = getattr(usage, name, None)
+        if value is not None:
+            attrs[name] = value
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) if details is not None else None
+    if cached is None:
+        cached = getattr(usage, "prompt_cache_hit_tokens", None)
+    if cached is not None:
+        attrs["cached_tokens"] = cached
+    return attrs
+
+
+def percentile(values, q):
+    """
+    线性插值的百分位数
+    """
+    values = sorted(values)
+    if len(values) == 1:
+        return values[0]
+    position = (len(values) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def summarize(paths):
+    """
+    汇总多个JSONL文件，按阶段名统计耗时分布(同一次运行中同名阶段的耗时相加)。
+    返回:
+        {阶段名: {"count", "p50", "p95", "max"}}，另含 "total" 表示整次运行
+    """
+    import statistics
+    durations = {}
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                durations.setdefault("total", []).append(record.get("total_ms", 0))
+                per_run = {}
+                for span in record.get("spans", []):
+                    if not span.get("event"):
+                        per_run[span["name"]] = per_run.get(span["name"], 0) + span["duration_ms"]
+                for name, value in per_run.items():
+                    durations.setdefault(name, []).append(value)
+    return {name: {"count": len(values), "p50": statistics.median(values),
+                   "p95": percentile(values, 0.95), "max": max(values)}
+            for name, values in durations.items()}
+
+
+def main(argv):
+    if not argv:
+        print(__doc__.strip())
+        return 1
+    stats = summarize(argv)
+    width = max(len(name) for name in stats) if stats else 0
+    print(f"{'阶段'.ljust(width)}  {'次数':>6}  {'p50(ms)':>10}  {'p95(ms)':>10}  {'max(ms)':>10}")
+    for name, s in sorted(stats.items(), key=lambda item: -item[1]["p50"]):
+        print(f"{name.ljust(width)}  {s['count']:>6}  {s['p50']:>10.1f}  {s['p95']:>10.1f}  {s['max']:>10.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))